@@ -0,0 +1,44 @@
+#!/usr/bin/env python3.12
+
+# Esperas exponenciales con jitter para los reintentos de conexión, compartidas
+# por la gestión de dispositivos Modbus, el escritor de PostgreSQL y el spool.
+
+import random                                       # Para el jitter del backoff
+
+MAX_EXPONENT = 64       # Tope del exponente: factor ** n desborda un float tras unos mil intentos
+
+
+class Backoff:
+    """
+    Calcula esperas exponenciales con jitter ("full jitter" acotado):
+    base * factor^n, limitado a max_delay, con una variación aleatoria de ±jitter.
+    """
+
+    def __init__(self, base=0.5, factor=2.0, max_delay=30.0, jitter=0.2):
+        """
+        :param base: espera inicial en segundos
+        :param factor: multiplicador entre intentos consecutivos
+        :param max_delay: espera máxima en segundos
+        :param jitter: fracción de variación aleatoria (0.2 = ±20 %)
+        """
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        Retorna la siguiente espera y avanza el contador de intentos.
+        """
+        delay = min(self.max_delay, self.base * self.factor ** self.attempts)
+        # Una vez alcanzado max_delay el exponente deja de crecer
+        if delay < self.max_delay and self.attempts < MAX_EXPONENT:
+            self.attempts += 1
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reset(self):
+        """
+        Reinicia la secuencia tras un intento exitoso.
+        """
+        self.attempts = 0
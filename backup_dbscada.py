@@ -1,52 +1,613 @@
 #!/usr/bin/env python3.12
 
+# Respaldo lógico de la base de datos de las API 1, 2, 3 con pg_dump.
+# Formatos soportados:
+#   - plain: un único archivo .sql sin comprimir (formato original, lo carga
+#     restore_dbscada.py con psql).
+#   - custom: un único archivo comprimido, escrito en flujo desde la salida de pg_dump.
+#   - directory: un directorio con un archivo comprimido por tabla, generado con
+#     varios procesos en paralelo (-j) sobre las tablas apis1/apis2/apis3; al
+#     terminar se informa la duración y los bytes de cada tabla.
+#   - incremental: solo las filas nuevas de las tablas de captura desde el
+#     respaldo anterior (ver incremental_backup.py).
+# Con --stream los formatos plain y custom se escriben comprimidos en flujo a
+# la salida estándar (plugin bpipe de Bacula) o a una FIFO (ReadFifo), sin
+# generar el archivo .sql completo en el disco local.
+# Con --throttle el respaldo adapta su caudal a la carga de la captura (ver
+# backup_throttle.py).
+# Los formatos plain y custom escriben junto al respaldo un manifiesto
+# (<archivo>.manifest.json) con el SHA-256 del archivo y, por tabla, filas,
+# instantes mínimo y máximo y SHA-256 de las filas, calculado mientras se
+# escribe el respaldo (ver backup_manifest.py y verify_backup.py).
+# pg_dump se ejecuta dentro del contenedor de PostgreSQL (docker exec) o, si no
+# se configura contenedor, directamente en el equipo con los datos de conexión.
+
 import os
+import re
 import json
 import sys
+import time
+import argparse
+import subprocess
+import threading
+import contextlib
+from datetime import datetime
+from scada_config import load_config, capture_blocks, format_bytes, CONFIG_FILE
+from incremental_backup import IncrementalBackup, connect_config
+import backup_throttle
+import raw_frames
+import backup_manifest
+import metrics
+
+# Formatos de respaldo
+FORMAT_PLAIN = 'plain'
+FORMAT_CUSTOM = 'custom'
+FORMAT_DIRECTORY = 'directory'
+FORMAT_INCREMENTAL = 'incremental'
+FORMATS = (FORMAT_PLAIN, FORMAT_CUSTOM, FORMAT_DIRECTORY, FORMAT_INCREMENTAL)
+
+# Métodos de compresión de pg_dump (se admite nivel, por ejemplo 'zstd:3')
+COMPRESSION_METHODS = ('none', 'gzip', 'lz4', 'zstd')
+
+# Bytes copiados por lectura entre pg_dump y el flujo de salida (y al restaurar)
+STREAM_CHUNK = 1024 * 1024
+
+# Mensajes de pg_dump -v usados para medir cada tabla. Con -j los procesos
+# escriben a la vez en stderr y las líneas pueden mezclarse, por lo que se
+# buscan los patrones en cualquier posición del texto.
+DUMP_START = re.compile(r'dumping contents of table "(?:[^".]+\.)?([^"]+)"')
+DUMP_FINISH = re.compile(r'finished item (\d+) TABLE DATA (\S+)')
+
+# Métricas del último respaldo o restauración ('operation' = backup o restore),
+# escritas en <metrics_dir>/<operación>_<formato>.prom para el textfile collector
+OPERATION_LABELS = ('operation', 'format')
+JOB_SECONDS = metrics.gauge('scada_job_duration_seconds', "Duración de la última ejecución exitosa", OPERATION_LABELS)
+JOB_BYTES = metrics.gauge('scada_job_bytes', "Bytes escritos por el último respaldo exitoso", OPERATION_LABELS)
+JOB_ROWS = metrics.gauge('scada_job_rows', "Filas procesadas por la última ejecución exitosa", OPERATION_LABELS)
+JOB_THROUGHPUT = metrics.gauge('scada_job_throughput_bytes_per_second', "Bytes por segundo de la última ejecución exitosa", OPERATION_LABELS)
+JOB_LAST_SUCCESS = metrics.gauge('scada_job_last_success_timestamp_seconds', "Instante de la última ejecución exitosa", OPERATION_LABELS)
+JOB_LAST_FAILURE = metrics.gauge('scada_job_last_failure_timestamp_seconds', "Instante de la última ejecución fallida", OPERATION_LABELS)
+TABLE_SECONDS = metrics.gauge('scada_job_table_seconds', "Duración por tabla de la última ejecución", OPERATION_LABELS + ('table',))
+TABLE_BYTES = metrics.gauge('scada_job_table_bytes', "Bytes por tabla del último respaldo", OPERATION_LABELS + ('table',))
+TABLE_ROWS = metrics.gauge('scada_job_table_rows', "Filas por tabla de la última ejecución", OPERATION_LABELS + ('table',))
+SECTION_SECONDS = metrics.gauge('scada_job_section_seconds', "Duración por sección de pg_restore", OPERATION_LABELS + ('section',))
+
+
+def postgres_command(config, program, *args):
+    """
+    Construye la línea de comandos de una herramienta de PostgreSQL.
+
+    Con ``docker_container`` configurado (por defecto 'postgres') el programa se
+    ejecuta dentro del contenedor; con ``null`` se ejecuta en el equipo local.
+
+    :param config: diccionario de configuración
+    :param program: programa a ejecutar (pg_dump, pg_restore, psql, ...)
+    :param args: argumentos adicionales del programa
+    :return: lista de argumentos para subprocess
+    """
+    container = config.get('docker_container', 'postgres')
+    prefix = ['docker', 'exec', '-i', container] if container else []
+    return prefix + [program, *args]
+
+
+def connection_string(config):
+    """
+    Cadena de conexión para las herramientas de PostgreSQL. Dentro del
+    contenedor se usa el socket local; fuera, el host y puerto configurados.
+    """
+    conninfo = f"user={config['db_user']} dbname={config['db_name']}"
+    if not config.get('docker_container', 'postgres'):
+        conninfo += f" host={config.get('db_host', 'localhost')} port={config.get('db_port', 5432)}"
+    return conninfo
+
+
+def postgres_env(config):
+    """
+    Entorno para ejecutar las herramientas de PostgreSQL en el equipo local
+    (la contraseña se pasa por PGPASSWORD y no en la línea de comandos).
+    """
+    env = dict(os.environ)
+    if not config.get('docker_container', 'postgres') and config.get('db_password'):
+        env['PGPASSWORD'] = config['db_password']
+    return env
+
+
+def pg_dump_command(config, args, throttle=None):
+    """
+    Línea de comandos de pg_dump; con control de carga, con prioridad de E/S
+    y de CPU reducidas.
+    """
+    if throttle is None:
+        return postgres_command(config, 'pg_dump', *args)
+    return postgres_command(config, *backup_throttle.throttled_command(config, 'pg_dump'), *args)
+
+
+def run_shell(config, *args):
+    """
+    Ejecuta una orden auxiliar (mv, rm, find) en el mismo sistema de archivos
+    donde escribe pg_dump: dentro del contenedor o en el equipo local.
 
-# Define la ruta al archivo de configuración JSON
-# Puedes ajustar esta ruta si el archivo no está en el mismo directorio
-CONFIG_FILE = '/home/administrador/scripts/config.json'
+    :return: salida estándar de la orden
+    """
+    command = postgres_command(config, *args)
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} falló: {result.stderr.strip()}")
+    return result.stdout
 
-try:
-    # Abre y lee el archivo JSON
-    with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
 
-    # Extrae los datos de configuración
-    db_name = config.get('db_name')
-    db_user = config.get('db_user')
-    output_file = config.get('output_file')
+def dump_decoder(config, dump_format, compression):
+    """
+    Orden que convierte la salida de pg_dump en el SQL de los datos, para
+    calcular el manifiesto por tabla: pg_restore en el formato custom y el
+    descompresor en plain comprimido.
 
-    # Construye la cadena de conexión para pg_dump
-    # Usamos comillas dobles alrededor de la cadena de conexión para manejar espacios o caracteres especiales
-    connection_string = f'"user={db_user} dbname={db_name}"'
+    :return: lista de argumentos para subprocess, o None si la salida ya es SQL sin comprimir
+    """
+    if dump_format == FORMAT_CUSTOM:
+        return postgres_command(config, 'pg_restore', '--data-only', '-f', '-')
+    return backup_manifest.DECOMPRESSORS.get(compression.split(':', 1)[0])
 
-    # Construye el comando completo de pg_dump
-    command = f'docker exec postgres pg_dump -d {connection_string} > {output_file}'
 
-    # Ejecuta el comando en el sistema operativo
-    result = os.system(command)
+def pipe_pg_dump_manifest(config, args, out, dump_format, compression, throttle=None):
+    """
+    Como pipe_pg_dump, y además calcula el manifiesto del respaldo en la misma
+    pasada (ver backup_manifest.py).
 
-    # Verifica el código de salida del comando
-    if result == 0:
-        print("Copia de seguridad de la base de datos completada con éxito.")
+    :return: manifiesto del respaldo
+    """
+    writer = backup_manifest.ManifestWriter(out, decoder=dump_decoder(config, dump_format, compression),
+                                            env=postgres_env(config))
+    try:
+        pipe_pg_dump(config, args, writer, throttle)
+        result = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return {'version': backup_manifest.MANIFEST_VERSION, 'format': dump_format, 'compression': compression,
+            'created': datetime.now().isoformat(' '), **result}
+
+
+def manifest_tables(manifest):
+    """
+    Filas por tabla de un manifiesto, para las métricas.
+    """
+    return {table: {'rows': stats['rows']} for table, stats in manifest.get('tables', {}).items()}
+
+
+def remove_manifest(output_file):
+    """
+    Elimina el manifiesto de un respaldo anterior, que ya no corresponde al archivo.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(backup_manifest.manifest_path(output_file))
+
+
+def dump_to_file(config, output_file, dump_format=FORMAT_PLAIN, compression='none', throttle=None,
+                 manifest=True):
+    """
+    Respaldo en un único archivo (formatos plain y custom). La salida de pg_dump
+    se escribe en flujo al archivo, sin redirección del shell.
+
+    :param config: diccionario de configuración
+    :param output_file: ruta del archivo de respaldo en el equipo local
+    :param dump_format: 'plain' o 'custom'
+    :param compression: método de compresión (solo formato custom)
+    :param throttle: backup_throttle.BackupThrottle que limita el caudal (opcional)
+    :param manifest: escribe el manifiesto en <output_file>.manifest.json
+    :return: diccionario con la duración, los bytes escritos y el manifiesto (si se escribió)
+    """
+    args = ['-d', connection_string(config), f'--format={dump_format}']
+    if dump_format == FORMAT_CUSTOM:
+        args.append(f'--compress={compression}')
     else:
-        print(f"Error: pg_dump falló con código de salida {result}.", file=sys.stderr)
-        sys.exit(result) # Sale con el código de error de pg_dump
-
-except FileNotFoundError:
-    print(f"Error: El archivo de configuración '{CONFIG_FILE}' no fue encontrado.", file=sys.stderr)
-    sys.exit(1)
-except json.JSONDecodeError:
-    print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
-    sys.exit(1)
-except KeyError as e:
-    print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
-    sys.exit(1)
-except Exception as e:
-    print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
-    sys.exit(1)
-
-# Si todo fue bien, sale con código de éxito (0)
-sys.exit(0)
+        compression = 'none'
+
+    start = time.monotonic()
+    tmp_file = f"{output_file}.tmp"
+    if throttle is not None or manifest:
+        # La salida pasa por el limitador y el manifiesto; pg_dump espera mientras no se lee
+        try:
+            with open(tmp_file, 'wb') as f:
+                if manifest:
+                    entry = pipe_pg_dump_manifest(config, args, f, dump_format, compression, throttle)
+                else:
+                    pipe_pg_dump(config, args, f, throttle)
+        except BaseException:
+            # Si open() falló el archivo no existe; el error de pg_dump es el que se informa
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_file)
+            raise
+        os.replace(tmp_file, output_file)
+        stats = {'seconds': time.monotonic() - start, 'bytes': os.path.getsize(output_file)}
+        if manifest:
+            entry['file'] = os.path.basename(output_file)
+            stats['manifest'] = entry
+            backup_manifest.save_manifest(backup_manifest.manifest_path(output_file), entry)
+        else:
+            remove_manifest(output_file)
+        return stats
+    with open(tmp_file, 'wb') as f:
+        result = subprocess.run(postgres_command(config, 'pg_dump', *args), stdout=f,
+                                stderr=subprocess.PIPE, env=postgres_env(config))
+    if result.returncode != 0:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_file)
+        sys.stderr.write(result.stderr.decode(errors='replace'))
+        raise subprocess.CalledProcessError(result.returncode, 'pg_dump')
+    # Reemplaza el respaldo anterior solo cuando el nuevo está completo
+    os.replace(tmp_file, output_file)
+    remove_manifest(output_file)
+    return {'seconds': time.monotonic() - start, 'bytes': os.path.getsize(output_file)}
+
+
+@contextlib.contextmanager
+def open_stream(path, mode):
+    """
+    Abre el extremo local de un flujo de respaldo: '-' es la salida (o
+    entrada) estándar del proceso; otra ruta se abre como archivo y, al
+    escribir, se crea como FIFO si no existe. Abrir una FIFO bloquea hasta
+    que el otro extremo (Bacula) la abre.
+
+    :param path: '-' o ruta de la FIFO o archivo
+    :param mode: 'rb' o 'wb'
+    """
+    if path == '-':
+        yield sys.stdin.buffer if 'r' in mode else sys.stdout.buffer
+        return
+    if 'w' in mode and not os.path.exists(path):
+        os.mkfifo(path, 0o600)
+    with open(path, mode) as f:
+        yield f
+
+
+def copy_stream(source, target, head=b'', throttle=None):
+    """
+    Copia un flujo en bloques de STREAM_CHUNK bytes.
+
+    :param head: bytes ya leídos de ``source`` que se escriben primero
+    :param throttle: backup_throttle.BackupThrottle que limita el caudal (opcional)
+    :return: bytes copiados
+    """
+    size = len(head)
+    if head:
+        target.write(head)
+    while chunk := source.read(STREAM_CHUNK):
+        if throttle is not None:
+            throttle.throttle(len(chunk))
+        target.write(chunk)
+        size += len(chunk)
+    target.flush()
+    return size
+
+
+def pipe_pg_dump(config, args, out, throttle=None):
+    """
+    Ejecuta pg_dump y copia su salida estándar a ``out`` a medida que se genera.
+
+    :param args: argumentos de pg_dump
+    :param out: archivo binario abierto para escritura
+    :param throttle: backup_throttle.BackupThrottle que limita el caudal (opcional)
+    :return: bytes copiados
+    """
+    process = subprocess.Popen(pg_dump_command(config, args, throttle), stdout=subprocess.PIPE,
+                               env=postgres_env(config))
+    try:
+        size = copy_stream(process.stdout, out, throttle=throttle)
+    except BaseException:
+        # El lector cerró el flujo o se interrumpió el respaldo: detiene pg_dump
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, 'pg_dump')
+    return size
+
+
+def dump_to_stream(config, target, dump_format=FORMAT_PLAIN, compression='zstd:3', throttle=None,
+                   manifest=None):
+    """
+    Respaldo en flujo (formatos plain y custom): la salida de pg_dump, ya
+    comprimida por pg_dump, se copia a la salida estándar o a una FIFO a
+    medida que se genera. Si pg_dump falla el flujo queda truncado y la
+    excepción hace que el proceso termine con error, de modo que Bacula
+    marca el trabajo como fallido.
+
+    :param config: diccionario de configuración
+    :param target: '-' para la salida estándar, o ruta de la FIFO
+    :param dump_format: 'plain' o 'custom'
+    :param compression: método y nivel de compresión (lz4 y zstd en plain requieren PostgreSQL 16)
+    :param throttle: backup_throttle.BackupThrottle que limita el caudal (opcional)
+    :param manifest: ruta del manifiesto del flujo (None: sin manifiesto)
+    :return: diccionario con la duración, los bytes escritos y el manifiesto (si se escribió)
+    """
+    args = ['-d', connection_string(config), f'--format={dump_format}', f'--compress={compression}']
+    start = time.monotonic()
+    with open_stream(target, 'wb') as out:
+        if manifest is None:
+            return {'seconds': time.monotonic() - start, 'bytes': pipe_pg_dump(config, args, out, throttle)}
+        entry = pipe_pg_dump_manifest(config, args, out, dump_format, compression, throttle)
+    entry['file'] = target
+    backup_manifest.save_manifest(manifest, entry)
+    return {'seconds': time.monotonic() - start, 'bytes': entry['bytes'], 'manifest': entry}
+
+
+def dump_directory(config, target, jobs=4, compression='zstd:3', throttle=None):
+    """
+    Respaldo en formato directorio con ``jobs`` procesos de pg_dump en paralelo,
+    uno por tabla a la vez. Se escribe en ``<target>.tmp`` y solo al terminar
+    reemplaza al respaldo anterior. pg_dump escribe los archivos directamente,
+    por lo que el control de carga solo reduce su prioridad de E/S y de CPU.
+
+    :param config: diccionario de configuración
+    :param target: ruta del directorio de respaldo, vista por pg_dump
+    :param jobs: cantidad de procesos en paralelo
+    :param compression: método y nivel de compresión ('gzip', 'lz4', 'zstd', 'zstd:3', 'none')
+    :param throttle: backup_throttle.BackupThrottle (opcional)
+    :return: diccionario tabla -> {'seconds', 'bytes', 'file'}, y duración total en segundos
+    """
+    tmp_target = f"{target}.tmp"
+    run_shell(config, 'rm', '-rf', tmp_target)
+
+    args = ['-d', connection_string(config), '--format=directory', f'--jobs={jobs}',
+            f'--compress={compression}', '--verbose', '-f', tmp_target]
+    tables = {}
+    started = {}
+    errors = []
+
+    def follow(stream):
+        # Registra el inicio y el fin de cada tabla a medida que pg_dump lo informa
+        for line in stream:
+            now = time.monotonic()
+            for match in DUMP_START.finditer(line):
+                started[match.group(1)] = now
+            for match in DUMP_FINISH.finditer(line):
+                dump_id, table = match.groups()
+                begin = started.get(table)
+                tables[table] = {'id': dump_id, 'seconds': now - begin if begin else None}
+            if 'error:' in line or 'warning:' in line:
+                errors.append(line.rstrip())
+
+    start = time.monotonic()
+    process = subprocess.Popen(pg_dump_command(config, args, throttle), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True, errors='replace',
+                               env=postgres_env(config))
+    reader = threading.Thread(target=follow, args=(process.stderr,), daemon=True)
+    reader.start()
+    returncode = process.wait()
+    reader.join()
+    elapsed = time.monotonic() - start
+
+    if returncode != 0:
+        for line in errors:
+            print(line, file=sys.stderr)
+        run_shell(config, 'rm', '-rf', tmp_target)
+        raise subprocess.CalledProcessError(returncode, 'pg_dump')
+
+    # Tamaño de cada archivo de datos (<id>.dat con la extensión de la compresión)
+    sizes = {}
+    for line in run_shell(config, 'find', tmp_target, '-maxdepth', '1', '-type', 'f',
+                          '-printf', '%f %s\\n').splitlines():
+        name, size = line.rsplit(' ', 1)
+        sizes[name] = int(size)
+    for stats in tables.values():
+        stats['file'] = next((n for n in sizes if n.split('.', 1)[0] == stats['id']), None)
+        stats['bytes'] = sizes.get(stats['file'], 0)
+
+    # Reemplaza el respaldo anterior solo cuando el nuevo está completo
+    run_shell(config, 'rm', '-rf', f"{target}.old")
+    run_shell(config, 'sh', '-c', 'if [ -e "$1" ]; then mv "$1" "$2"; fi', 'sh', target, f"{target}.old")
+    run_shell(config, 'mv', tmp_target, target)
+    run_shell(config, 'rm', '-rf', f"{target}.old")
+    return tables, elapsed
+
+
+def print_report(tables, elapsed):
+    """
+    Muestra la duración y los bytes de cada tabla respaldada.
+    """
+    print(f"{'Tabla':<16} {'Duración':>10} {'Bytes':>12}")
+    for table in sorted(tables):
+        stats = tables[table]
+        seconds = f"{stats['seconds']:.2f} s" if stats['seconds'] is not None else '-'
+        print(f"{table:<16} {seconds:>10} {format_bytes(stats['bytes']):>12}")
+    total = sum(stats['bytes'] for stats in tables.values())
+    print(f"Total: {len(tables)} tablas, {format_bytes(total)} en {elapsed:.2f} s")
+
+
+def dump_incremental(config, directory, base=False, jobs=4, compression='gzip', throttle=None):
+    """
+    Respaldo incremental de las tablas de captura. La base incluye además el
+    esquema de las tablas, generado con pg_dump --schema-only. Con
+    ``throttle`` los COPY pasan por el limitador y se pausa entre tablas.
+    Con 'raw_frames' se respaldan las tablas de tramas, y el esquema incluye
+    las vistas de decodificación y sus triggers (pg_dump -t no incluye las
+    funciones de los triggers).
+
+    :return: entrada del manifiesto del respaldo creado
+    """
+    capture = capture_blocks(config)
+    blocks = raw_frames.storage_tables(config, capture)
+
+    def write_schema(f):
+        # Con las particiones de las tablas particionadas (partition_manager.py)
+        tables = [arg for table in blocks for arg in ('--table-and-children', table)]
+        subprocess.run(postgres_command(config, 'pg_dump', '-d', connection_string(config),
+                                        '--schema-only', *tables),
+                       stdout=f, env=postgres_env(config), check=True)
+        if blocks is not capture:
+            # pg_dump deja el search_path vacío y las vistas usan nombres sin esquema
+            f.write(("SET search_path = public;\n" +
+                     ''.join(f"{sql};\n" for block in capture.values()
+                             for sql in raw_frames.view_sql(block))).encode())
+
+    backup = IncrementalBackup(directory, connect_config(config), blocks, compression=compression,
+                               segment_rows=config.get('incremental_segment_rows', 1000000),
+                               settle_seconds=config.get('incremental_settle_seconds', 300),
+                               keep_chains=config.get('incremental_keep_chains', 2), throttle=throttle)
+    return backup.run(base=base, jobs=jobs, write_schema=write_schema)
+
+
+def print_incremental_report(entry):
+    """
+    Muestra las filas y los bytes exportados de cada tabla en un respaldo incremental.
+    """
+    print(f"Respaldo {entry['type']} {entry['id']}")
+    print(f"{'Tabla':<16} {'Filas':>12} {'Bytes':>12}  Desde")
+    for table in sorted(entry['tables']):
+        stats = entry['tables'][table]
+        size = sum(s['bytes'] for s in stats['segments'])
+        print(f"{table:<16} {stats['rows']:>12} {format_bytes(size):>12}  {stats['from'] or '-'}")
+
+
+def write_metrics(config, operation, dump_format, seconds=None, size=None, tables=None, sections=None,
+                  failed=False):
+    """
+    Escribe las métricas de un respaldo o una restauración en ``metrics_dir``
+    (sin efecto si no está configurado). Una ejecución fallida escribe un
+    archivo aparte, para no borrar las métricas de la última exitosa.
+
+    :param operation: 'backup' o 'restore'
+    :param dump_format: formato del respaldo
+    :param seconds: duración total
+    :param size: bytes escritos (None si no aplica)
+    :param tables: diccionario tabla -> estadísticas con 'seconds', 'bytes' y/o 'rows'
+    :param sections: diccionario sección de pg_restore -> segundos
+    """
+    labels = (operation, dump_format)
+    if failed:
+        JOB_LAST_FAILURE.set(time.time(), labels)
+    else:
+        tables = tables or {}
+        JOB_SECONDS.set(seconds, labels)
+        if size is not None:
+            JOB_BYTES.set(size, labels)
+            JOB_THROUGHPUT.set(size / seconds if seconds else 0.0, labels)
+        if any('rows' in stats for stats in tables.values()):
+            JOB_ROWS.set(sum(stats.get('rows', 0) for stats in tables.values()), labels)
+        for table, stats in tables.items():
+            for gauge, key in ((TABLE_SECONDS, 'seconds'), (TABLE_BYTES, 'bytes'), (TABLE_ROWS, 'rows')):
+                if stats.get(key) is not None:
+                    gauge.set(stats[key], labels + (table,))
+        for section, section_seconds in (sections or {}).items():
+            SECTION_SECONDS.set(section_seconds, labels + (section,))
+        JOB_LAST_SUCCESS.set(time.time(), labels)
+    name = f"{operation}_{dump_format}" + ("_error" if failed else "")
+    metrics.MetricsExporter(name, directory=config.get('metrics_dir')).write()
+
+
+def parse_args(config, argv=None):
+    parser = argparse.ArgumentParser(description="Respaldo lógico de la base de datos SCADA con pg_dump.")
+    parser.add_argument('--format', choices=FORMATS, default=config.get('backup_format', FORMAT_PLAIN),
+                        help="formato del respaldo (por defecto, 'backup_format' de la configuración o plain)")
+    parser.add_argument('-j', '--jobs', type=int, default=config.get('backup_jobs', 4),
+                        help="procesos de pg_dump en paralelo (formato directory)")
+    parser.add_argument('--compress',
+                        help="compresión: none, gzip, lz4 o zstd, con nivel opcional (por ejemplo zstd:3)")
+    parser.add_argument('--base', action='store_true',
+                        help="formato incremental: crea una base nueva con todas las filas")
+    parser.add_argument('-o', '--output', help="archivo (plain/custom) o directorio (directory/incremental) de salida")
+    parser.add_argument('--throttle', action='store_true', default=config.get('backup_throttle', False),
+                        help="adapta el caudal del respaldo a la carga de la captura (ver backup_throttle.py)")
+    parser.add_argument('--stream', action='store_true',
+                        help="plain/custom: escribe el respaldo comprimido en flujo a la salida estándar "
+                             "o a la FIFO indicada con -o ('stream_fifo' de la configuración)")
+    parser.add_argument('--no-manifest', dest='manifest', action='store_false',
+                        default=config.get('backup_manifest', True),
+                        help="plain/custom: no escribe el manifiesto del respaldo (ver verify_backup.py)")
+    parser.add_argument('--manifest-file',
+                        help="--stream: ruta del manifiesto ('stream_manifest' de la configuración, o "
+                             "<FIFO>.manifest.json)")
+    args = parser.parse_args(argv)
+    if args.compress is None:
+        args.compress = config.get('incremental_compression', 'gzip') if args.format == FORMAT_INCREMENTAL \
+            else config.get('backup_compression', 'zstd:3')
+    if args.compress.split(':', 1)[0] not in COMPRESSION_METHODS:
+        parser.error(f"compresión desconocida: {args.compress}")
+    if args.jobs < 1:
+        parser.error("--jobs debe ser mayor o igual a 1")
+    if args.stream and args.format not in (FORMAT_PLAIN, FORMAT_CUSTOM):
+        parser.error("--stream solo aplica a los formatos plain y custom")
+    return args
+
+
+def main(argv=None):
+    config, args, failed, throttle = None, None, True, None
+    try:
+        config = load_config()
+        args = parse_args(config, argv)
+        if args.throttle:
+            throttle = backup_throttle.from_config(config)
+            throttle.start()
+
+        if args.stream:
+            # La salida estándar lleva el respaldo: los mensajes van a stderr
+            target = args.output or config.get('stream_fifo', '-')
+            manifest = None
+            if args.manifest:
+                manifest = args.manifest_file or config.get('stream_manifest') or backup_manifest.manifest_path(
+                    target if target != '-' else os.path.join(os.path.dirname(CONFIG_FILE), 'stream'))
+            stats = dump_to_stream(config, target, dump_format=args.format, compression=args.compress,
+                                   throttle=throttle, manifest=manifest)
+            print(f"{target}: {format_bytes(stats['bytes'])} en {stats['seconds']:.2f} s", file=sys.stderr)
+            write_metrics(config, 'backup', args.format, stats['seconds'], size=stats['bytes'],
+                          tables=manifest_tables(stats.get('manifest', {})))
+        elif args.format == FORMAT_DIRECTORY:
+            target = args.output or config.get('backup_dir', '/backups/db_scada')
+            tables, elapsed = dump_directory(config, target, jobs=args.jobs, compression=args.compress,
+                                             throttle=throttle)
+            print_report(tables, elapsed)
+            write_metrics(config, 'backup', args.format, elapsed,
+                          size=sum(stats['bytes'] for stats in tables.values()), tables=tables)
+        elif args.format == FORMAT_INCREMENTAL:
+            directory = args.output or config.get('incremental_dir',
+                                                  os.path.join(os.path.dirname(CONFIG_FILE), 'incremental'))
+            start = time.monotonic()
+            entry = dump_incremental(config, directory, base=args.base, jobs=args.jobs,
+                                     compression=args.compress, throttle=throttle)
+            print_incremental_report(entry)
+            tables = {table: {'rows': stats['rows'], 'bytes': sum(s['bytes'] for s in stats['segments'])}
+                      for table, stats in entry['tables'].items()}
+            write_metrics(config, 'backup', args.format, time.monotonic() - start,
+                          size=sum(stats['bytes'] for stats in tables.values()), tables=tables)
+        else:
+            output_file = args.output or config['output_file']
+            stats = dump_to_file(config, output_file, dump_format=args.format, compression=args.compress,
+                                 throttle=throttle, manifest=args.manifest)
+            print(f"{output_file}: {format_bytes(stats['bytes'])} en {stats['seconds']:.2f} s")
+            write_metrics(config, 'backup', args.format, stats['seconds'], size=stats['bytes'],
+                          tables=manifest_tables(stats.get('manifest', {})))
+        print("Copia de seguridad de la base de datos completada con éxito.",
+              file=sys.stderr if args.stream else sys.stdout)
+        failed = False
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error: {e.cmd} falló con código de salida {e.returncode}.", file=sys.stderr)
+        sys.exit(e.returncode) # Sale con el código de error de pg_dump
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if throttle is not None:
+            throttle.stop()
+            print(f"Control de carga: {throttle.summary()}", file=sys.stderr)
+        if failed and args is not None:
+            write_metrics(config, 'backup', args.format, failed=True)
+
+    # Si todo fue bien, sale con código de éxito (0)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3.12
+
+# Manifiesto de los respaldos, calculado en una sola pasada mientras se
+# escribe el respaldo: bytes y SHA-256 de la salida completa y, por tabla,
+# filas, instantes mínimo y máximo (columna timestamp) y SHA-256 de sus filas
+# tal como aparecen en los COPY del SQL de pg_dump.
+#   - plain sin comprimir: las filas se leen directamente de la salida y se
+#     registra la posición de cada tabla y de cada tramo entre tablas, de modo
+#     que la verificación relee cada parte en paralelo (una sola lectura).
+#   - plain comprimido (--stream) y custom: la salida pasa a la vez por el
+#     descompresor o por pg_restore --data-only, que entregan el mismo SQL; la
+#     verificación lee el archivo una vez con el mismo procedimiento.
+#   - incremental: cada segmento registra el SHA-256 de sus filas (ver
+#     incremental_backup.py) y se verifica por segmento, en paralelo.
+# Los valores por tabla no dependen del formato: las filas de un respaldo
+# plain y de uno custom de los mismos datos tienen el mismo SHA-256.
+
+import os
+import re
+import json
+import hashlib
+import threading
+import subprocess
+import logging                                      # Para registro de eventos e información de depuración
+from concurrent.futures import ThreadPoolExecutor
+from incremental_backup import open_segment, file_sha256, SCHEMA_FILE
+
+log = logging.getLogger()
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.json'
+READ_CHUNK = 1024 * 1024
+
+# Inicio y fin de los datos de una tabla en el SQL de pg_dump y pg_restore
+COPY_START = re.compile(rb'^COPY (\S+) \(([^)]*)\) FROM stdin;\n', re.MULTILINE)
+COPY_END = b'\\.\n'
+NEXT_FIRST_FIELD = re.compile(rb'\n([^\t\n]*)')      # Primer campo de las líneas siguientes a la primera
+NULL = b'\\N'
+
+# Descompresores de la salida de pg_dump --compress en formato plain
+DECOMPRESSORS = {'gzip': ['gzip', '-dc'], 'zstd': ['zstd', '-dc'], 'lz4': ['lz4', '-dc']}
+
+
+def table_name(name):
+    """
+    Nombre de una tabla en un COPY ('public.apis1_ifv1' -> 'apis1_ifv1').
+    """
+    schema, _, table = (part.strip('"') for part in name.decode().rpartition('.'))
+    return table if schema in ('', 'public') else f"{schema}.{table}"
+
+
+class TableStats:
+    """
+    Filas, instantes mínimo y máximo y SHA-256 de las filas de una tabla en
+    formato COPY, acumulados por bloques de líneas completas.
+    """
+
+    def __init__(self, columns, offset=None):
+        """
+        :param columns: columnas de las filas (el instante es la columna 'timestamp', si existe)
+        :param offset: posición de las filas en el archivo del respaldo (solo plain sin comprimir)
+        """
+        self.columns = list(columns)
+        self.column = columns.index('timestamp') if 'timestamp' in columns else None
+        self.offset = offset
+        self.rows = 0
+        self.bytes = 0
+        self.min = self.max = None
+        self._hash = hashlib.sha256()
+
+    def update(self, data):
+        if not data:
+            return
+        self._hash.update(data)
+        self.bytes += len(data)
+        self.rows += data.count(b'\n')
+        if self.column is None:
+            return
+        if self.column == 0:
+            values = NEXT_FIRST_FIELD.findall(data, 0, len(data) - 1)
+            values.append(data[:data.index(b'\n')].split(b'\t', 1)[0])
+        else:
+            values = [line.split(b'\t')[self.column] for line in data[:-1].split(b'\n')]
+        if NULL in values:
+            values = [value for value in values if value != NULL]
+        if values:
+            low, high = min(values).decode(), max(values).decode()
+            # Los instantes ISO (DateStyle de pg_dump) se ordenan como texto
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+    def to_dict(self):
+        stats = {'columns': self.columns, 'rows': self.rows, 'bytes': self.bytes, 'sha256': self._hash.hexdigest()}
+        if self.column is not None:
+            stats.update({'min': self.min, 'max': self.max})
+        if self.offset is not None:
+            stats['offset'] = self.offset
+        return stats
+
+
+class CopyParser:
+    """
+    Recorre en flujo el SQL de pg_dump (o de pg_restore -f -) y acumula las
+    estadísticas de los datos de cada tabla. Con ``pieces`` registra además
+    la posición y el SHA-256 de cada tramo fuera de los datos (esquema, fin de
+    cada COPY), de modo que tablas y tramos cubren todo el archivo.
+    """
+
+    def __init__(self, pieces=False):
+        self.tables = {}
+        self.pieces = [] if pieces else None
+        self._section = None
+        self._tail = b''
+        self._offset = 0                # Posición en el flujo del inicio de _tail
+        self._gap = None
+        self._gap_offset = 0
+        if pieces:
+            self._gap = hashlib.sha256()
+
+    def _update_gap(self, data):
+        if self._gap is not None:
+            self._gap.update(data)
+
+    def _close_gap(self, end):
+        if self._gap is not None and end > self._gap_offset:
+            self.pieces.append({'offset': self._gap_offset, 'bytes': end - self._gap_offset,
+                                'sha256': self._gap.hexdigest()})
+        if self._gap is not None:
+            self._gap = hashlib.sha256()
+
+    def feed(self, data):
+        buffer = self._tail + data
+        pos = 0
+        while True:
+            if self._section is None:
+                match = COPY_START.search(buffer, pos)
+                if match is None:
+                    # Conserva la última línea incompleta (puede ser el inicio de un COPY)
+                    keep = max(pos, buffer.rfind(b'\n', pos) + 1)
+                    self._update_gap(buffer[pos:keep])
+                    pos = keep
+                    break
+                self._update_gap(buffer[pos:match.end()])
+                pos = match.end()
+                self._close_gap(self._offset + pos)
+                columns = tuple(c.strip().strip('"') for c in match.group(2).decode().split(','))
+                name = table_name(match.group(1))
+                self._section = TableStats(columns, self._offset + pos if self.pieces is not None else None)
+                self.tables[name] = self._section
+            else:
+                # Las filas terminan en la línea '\.'
+                if buffer.startswith(COPY_END, pos):
+                    stop = pos
+                else:
+                    stop = buffer.find(b'\n' + COPY_END, pos)
+                    stop = stop + 1 if stop >= 0 else None
+                if stop is None:
+                    keep = max(pos, buffer.rfind(b'\n', pos) + 1)
+                    self._section.update(buffer[pos:keep])
+                    pos = keep
+                    break
+                self._section.update(buffer[pos:stop])
+                pos = stop
+                self._section = None
+                self._gap_offset = self._offset + pos
+                self._update_gap(buffer[pos:pos + len(COPY_END)])
+                pos += len(COPY_END)
+        self._tail = buffer[pos:]
+        self._offset += pos
+
+    def close(self):
+        """
+        :return: diccionario tabla -> estadísticas
+        """
+        if self._section is not None:
+            raise ValueError("El SQL del respaldo terminó dentro de los datos de una tabla")
+        self._update_gap(self._tail)
+        self._close_gap(self._offset + len(self._tail))
+        return {name: stats.to_dict() for name, stats in self.tables.items()}
+
+
+class ManifestWriter:
+    """
+    Destino de la salida de pg_dump que la escribe en ``out`` y calcula el
+    manifiesto en la misma pasada. Con ``decoder`` (descompresor o
+    pg_restore) la salida se entrega también a ese proceso, cuyo SQL se
+    analiza en un hilo aparte.
+    """
+
+    def __init__(self, out=None, parse=True, decoder=None, env=None):
+        """
+        :param out: archivo binario de destino (None solo calcula el manifiesto)
+        :param parse: calcula las estadísticas por tabla
+        :param decoder: orden que convierte la salida en SQL (None si ya es SQL sin comprimir)
+        :param env: entorno del proceso ``decoder``
+        """
+        self.out = out
+        self.bytes = 0
+        self._hash = hashlib.sha256()
+        self.parser = CopyParser(pieces=decoder is None) if parse else None
+        self._process = self._reader = None
+        self._error = None
+        if self.parser is not None and decoder:
+            try:
+                self._process = subprocess.Popen(decoder, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+            except FileNotFoundError:
+                log.warning(f"{decoder[0]} no está instalado: el manifiesto no incluye las tablas")
+                self.parser = None
+            else:
+                self._reader = threading.Thread(target=self._read, name="manifest-decoder", daemon=True)
+                self._reader.start()
+
+    def _read(self):
+        try:
+            while chunk := self._process.stdout.read(READ_CHUNK):
+                self.parser.feed(chunk)
+        except Exception as e:
+            self._error = e
+            # Sigue leyendo para que el proceso no se bloquee
+            while self._process.stdout.read(READ_CHUNK):
+                pass
+
+    def write(self, data):
+        if self.out is not None:
+            self.out.write(data)
+        self._hash.update(data)
+        self.bytes += len(data)
+        if self._process is not None:
+            self._process.stdin.write(data)
+        elif self.parser is not None:
+            self.parser.feed(data)
+
+    def flush(self):
+        if self.out is not None:
+            self.out.flush()
+
+    def abort(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+
+    def close(self):
+        """
+        :return: bytes y SHA-256 de la salida y, si se calcularon, estadísticas por tabla y tramos
+        """
+        result = {'bytes': self.bytes, 'sha256': self._hash.hexdigest()}
+        if self._process is not None:
+            self._process.stdin.close()
+            self._reader.join()
+            returncode = self._process.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, self._process.args[0])
+            if self._error is not None:
+                raise self._error
+        if self.parser is not None:
+            result['tables'] = self.parser.close()
+            if self.parser.pieces is not None:
+                result['pieces'] = self.parser.pieces
+        return result
+
+
+def manifest_path(output):
+    """
+    Manifiesto de un respaldo en archivo: <archivo>.manifest.json.
+    """
+    return f"{output}{MANIFEST_SUFFIX}"
+
+
+def save_manifest(path, manifest):
+    """
+    Escribe el manifiesto de forma atómica (archivo temporal y reemplazo).
+    """
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+def load_manifest(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare(name, expected, actual, keys=('rows', 'min', 'max', 'sha256')):
+    """
+    Diferencias entre las estadísticas registradas y las calculadas.
+
+    :return: lista de mensajes (vacía si coinciden)
+    """
+    return [f"{name}: {key} {actual.get(key)} (el manifiesto indica {expected[key]})"
+            for key in keys if key in expected and actual.get(key) != expected[key]]
+
+
+def compare_tables(expected, actual, keys=('rows', 'min', 'max', 'sha256')):
+    problems = [f"{table}: no está en el respaldo" for table in expected if table not in actual]
+    problems += [f"{table}: no está en el manifiesto" for table in actual if table not in expected]
+    for table in expected.keys() & actual.keys():
+        problems += compare(table, expected[table], actual[table], keys)
+    return problems
+
+
+def _read_range(path, offset, size):
+    """
+    Bloques de ``size`` bytes de un archivo desde ``offset``.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            chunk = f.read(min(READ_CHUNK, size))
+            if not chunk:
+                break
+            size -= len(chunk)
+            yield chunk
+
+
+def verify_pieces(path, manifest, jobs=4):
+    """
+    Verifica en paralelo un respaldo plain sin comprimir: los datos de cada
+    tabla y los tramos entre tablas, cada uno desde su posición. Entre todos
+    cubren el archivo, que se lee una sola vez.
+
+    :return: (diccionario tabla -> estadísticas calculadas, lista de problemas)
+    """
+    problems = []
+    size = os.path.getsize(path)
+    covered = sum(p['bytes'] for p in manifest['pieces']) + sum(t['bytes'] for t in manifest['tables'].values())
+    if size != manifest['bytes'] or covered != size:
+        # Archivo truncado o manifiesto de otro respaldo: no tiene sentido revisar cada parte
+        return {}, [f"{path}: {size} bytes (el manifiesto indica {manifest['bytes']})"]
+
+    def check_table(item):
+        table, expected = item
+        stats = TableStats(tuple(expected['columns']))
+        data = b''
+        for chunk in _read_range(path, expected['offset'], expected['bytes']):
+            # Solo líneas completas en cada bloque, para el mínimo y el máximo
+            data += chunk
+            end = data.rfind(b'\n') + 1
+            stats.update(data[:end])
+            data = data[end:]
+        stats.update(data)
+        return table, stats.to_dict()
+
+    def check_piece(piece):
+        digest = hashlib.sha256()
+        for chunk in _read_range(path, piece['offset'], piece['bytes']):
+            digest.update(chunk)
+        return piece, digest.hexdigest()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        tables = dict(executor.map(check_table, manifest['tables'].items()))
+        for piece, digest in executor.map(check_piece, manifest['pieces']):
+            if digest != piece['sha256']:
+                problems.append(f"{path}: bytes {piece['offset']}-{piece['offset'] + piece['bytes']} "
+                                f"no coinciden con el manifiesto (esquema)")
+    for table, expected in manifest['tables'].items():
+        problems += compare(table, expected, tables[table], ('rows', 'bytes', 'min', 'max', 'sha256'))
+    return tables, problems
+
+
+def verify_stream(path, manifest, decoder=None, env=None):
+    """
+    Verifica un respaldo leyéndolo una vez: SHA-256 del archivo y, a la vez,
+    estadísticas por tabla del SQL que entrega ``decoder``.
+
+    :return: (diccionario tabla -> estadísticas calculadas, lista de problemas)
+    """
+    writer = ManifestWriter(parse='tables' in manifest, decoder=decoder, env=env)
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(READ_CHUNK):
+                writer.write(chunk)
+        result = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    problems = compare(path, manifest, result, ('bytes', 'sha256'))
+    tables = result.get('tables', {})
+    if 'tables' in manifest:
+        problems += compare_tables(manifest['tables'], tables)
+    return tables, problems
+
+
+def verify_segments(directory, chain, jobs=4):
+    """
+    Verifica en paralelo los segmentos de una cadena de respaldos
+    incrementales: filas, primer y último instante y SHA-256 de las filas
+    (los segmentos anteriores al SHA-256 solo se verifican por filas e
+    instantes), y el esquema de la base.
+
+    :return: (diccionario tabla -> estadísticas de la cadena, lista de problemas)
+    """
+    problems = []
+    segments = [(backup, stats['columns'], segment)
+                for backup in chain for stats in backup['tables'].values() for segment in stats['segments']]
+
+    def check(item):
+        backup, columns, segment = item
+        path = os.path.join(directory, backup['id'], segment['file'])
+        stats = TableStats(tuple(columns))
+        tail = b''
+        with open_segment(path, backup['compression']) as f:
+            while chunk := f.read(READ_CHUNK):
+                data = tail + chunk
+                end = data.rfind(b'\n') + 1
+                stats.update(data[:end])
+                tail = data[end:]
+        stats.update(tail)
+        actual = stats.to_dict()
+        actual.update({'first': actual.get('min'), 'last': actual.get('max')})
+        return compare(path, segment, actual, ('rows', 'first', 'last', 'sha256'))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for segment_problems in executor.map(check, segments):
+            problems += segment_problems
+
+    base = chain[0]
+    if 'schema_sha256' in base:
+        schema = os.path.join(directory, base['id'], base.get('schema', SCHEMA_FILE))
+        if file_sha256(schema) != base['schema_sha256']:
+            problems.append(f"{schema}: el esquema no coincide con el manifiesto")
+    return chain_tables(chain), problems
+
+
+def chain_tables(chain):
+    """
+    Filas e instantes mínimo y máximo de cada tabla en una cadena de respaldos incrementales.
+    """
+    tables = {}
+    for backup in chain:
+        for table, stats in backup['tables'].items():
+            total = tables.setdefault(table, {'rows': 0, 'min': None, 'max': None})
+            total['rows'] += stats['rows']
+            for segment in stats['segments']:
+                if total['min'] is None or segment['first'] < total['min']:
+                    total['min'] = segment['first']
+                if total['max'] is None or segment['last'] > total['max']:
+                    total['max'] = segment['last']
+    return tables
+
+
+def database_tables(conn, tables):
+    """
+    Filas e instantes mínimo y máximo de las tablas en una base (por ejemplo,
+    la restaurada en la base de prueba), con el mismo formato de los COPY.
+
+    :param tables: diccionario tabla -> estadísticas del manifiesto (con 'min' si tiene timestamp)
+    :return: diccionario tabla -> {'rows', 'min', 'max'}
+    """
+    result = {}
+    with conn.cursor() as cursor:
+        cursor.execute("SET DateStyle = ISO")
+        for table, expected in tables.items():
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            if not cursor.fetchone()[0]:
+                continue
+            if 'min' in expected:
+                cursor.execute(f'SELECT count(*), min("timestamp")::text, max("timestamp")::text FROM {table}')
+                rows, low, high = cursor.fetchone()
+                result[table] = {'rows': rows, 'min': low, 'max': high}
+            else:
+                cursor.execute(f"SELECT count(*) FROM {table}")
+                result[table] = {'rows': cursor.fetchone()[0]}
+    conn.rollback()
+    return result
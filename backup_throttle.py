@@ -0,0 +1,268 @@
+#!/usr/bin/env python3.12
+
+# Respaldo con carga controlada. pg_dump compite con los bucles de captura por
+# el disco y la CPU del contenedor de PostgreSQL; este módulo limita el caudal
+# del respaldo según la salud de la captura, medida en las métricas que
+# exponen los scripts (ciclos excedidos y jitter de cada bucle):
+#   - pg_dump se ejecuta con prioridad de E/S y de CPU reducidas (ionice/nice).
+#   - La salida de pg_dump (archivo o flujo) y los COPY del respaldo
+#     incremental pasan por un limitador de bytes por segundo; al leer más
+#     lento, pg_dump y el backend que lo atiende esperan, de modo que el
+#     límite alcanza también a las lecturas del disco.
+#   - El caudal se reduce a la mitad cuando la captura se degrada y crece de
+#     a poco mientras está sana; si sigue degradada con el caudal mínimo, el
+#     respaldo se pausa (entre tablas en el incremental) hasta que se recupera.
+#   - Con una ventana de respaldo configurada, al acercarse su fin se dejan de
+#     aplicar pausas y límites para terminar a tiempo.
+
+import time
+import threading                                    # Hilo del controlador y sincronización
+import logging                                      # Para registro de eventos e información de depuración
+import metrics                                      # Lectura de las métricas de la captura
+
+log = logging.getLogger()
+
+MIB = 1024 * 1024
+THROTTLE_INTERVAL = 2.0         # Segundos entre evaluaciones de la captura
+WINDOW_MARGIN = 0.8             # Fracción de la ventana a partir de la cual se prioriza terminar
+
+
+class RateLimiter:
+    """
+    Limitador de caudal por cubeta de fichas, con caudal ajustable y pausa.
+    ``throttle(n)`` espera lo necesario para que los bytes consumidos no
+    superen el caudal vigente, y mientras el limitador está pausado.
+    """
+
+    def __init__(self, rate=None, burst=1.0):
+        """
+        :param rate: bytes por segundo (None sin límite)
+        :param burst: segundos de caudal que pueden consumirse de una vez
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._running = threading.Event()
+        self._running.set()
+        self._lock = threading.Lock()
+        self.paused_seconds = 0.0
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def wait(self):
+        """
+        Espera mientras el limitador está pausado (punto de pausa entre tablas).
+        """
+        if self._running.is_set():
+            return
+        start = time.monotonic()
+        self._running.wait()
+        with self._lock:
+            self.paused_seconds += time.monotonic() - start
+            # El tiempo en pausa no acumula fichas
+            self._last = time.monotonic()
+            self._tokens = 0.0
+
+    def throttle(self, size):
+        """
+        Consume ``size`` bytes, esperando si se excede el caudal.
+        """
+        self.wait()
+        with self._lock:
+            if self.rate is None:
+                return
+            self._refill()
+            self._tokens -= size
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self._tokens = min(self.rate * self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+class IngestProbe:
+    """
+    Salud de la captura entre dos lecturas de las métricas de los scripts
+    (scheduler.py): ciclos excedidos y jitter medio relativo al periodo, por bucle.
+    """
+
+    def __init__(self, ports, host='127.0.0.1'):
+        """
+        :param ports: puertos HTTP de métricas de los procesos de captura
+        """
+        self.ports = list(ports)
+        self.host = host
+        self._previous = metrics.scrape(self.ports, host) if self.ports else {}
+
+    def sample(self):
+        """
+        :return: (ciclos excedidos, mayor jitter medio como fracción del periodo), o None sin métricas
+        """
+        if not self.ports:
+            return None
+        current = metrics.scrape(self.ports, self.host)
+        if not current:
+            return None
+        previous, self._previous = self._previous, current
+
+        def delta(name):
+            result = {}
+            for (metric, labels), value in current.items():
+                if metric == name:
+                    loop = dict(labels).get('loop')
+                    result[loop] = result.get(loop, 0.0) + value - previous.get((metric, labels), 0.0)
+            return result
+
+        periods = {dict(labels).get('loop'): value for (metric, labels), value in current.items()
+                   if metric == 'scada_sample_period_seconds'}
+        overruns = delta('scada_cycle_overruns_total')
+        jitter_sum = delta('scada_cycle_jitter_seconds_sum')
+        jitter_count = delta('scada_cycle_jitter_seconds_count')
+        pressure = 0.0
+        for loop, count in jitter_count.items():
+            if count > 0 and periods.get(loop):
+                pressure = max(pressure, jitter_sum[loop] / count / periods[loop])
+        return int(sum(overruns.values())), pressure
+
+
+class BackupThrottle(threading.Thread):
+    """
+    Controlador del caudal del respaldo (aumento aditivo, reducción
+    multiplicativa). Cada THROTTLE_INTERVAL segundos evalúa la captura: con
+    ciclos excedidos o jitter medio mayor que ``max_jitter`` veces el periodo
+    reduce el caudal a la mitad, hasta ``min_rate``, y luego pausa; con la
+    captura sana reanuda y aumenta el caudal en un décimo de ``max_rate``.
+    """
+
+    def __init__(self, probe, max_rate=None, min_rate=MIB, max_jitter=0.1, window=None):
+        """
+        :param probe: IngestProbe con los puertos de métricas de la captura
+        :param max_rate: presupuesto de E/S en bytes por segundo (None sin tope)
+        :param min_rate: caudal mínimo antes de pausar, en bytes por segundo
+        :param max_jitter: jitter medio tolerado, como fracción del periodo de cada bucle
+        :param window: segundos de la ventana de respaldo (None sin ventana)
+        """
+        super().__init__(name="backup-throttle", daemon=True)
+        self.probe = probe
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_jitter = max_jitter
+        self.window = window
+        # Sin presupuesto se parte de 16 veces el mínimo y se crece desde ahí
+        self.limiter = RateLimiter(max_rate or min_rate * 16)
+        self.step = (max_rate or min_rate * 16) / 10
+        self.lowest_rate = self.limiter.rate
+        self.reductions = 0
+        self.pauses = 0
+        self.deadline_mode = False
+        self._start = time.monotonic()
+        self._stop_event = threading.Event()
+
+    def throttle(self, size):
+        self.limiter.throttle(size)
+
+    def wait(self):
+        self.limiter.wait()
+
+    def run(self):
+        while not self._stop_event.wait(THROTTLE_INTERVAL):
+            try:
+                self._adjust()
+            except Exception as e:
+                log.warning(f"Control de carga del respaldo: {e}")
+
+    def _adjust(self):
+        if self.window and not self.deadline_mode and \
+                time.monotonic() - self._start > self.window * WINDOW_MARGIN:
+            # Cerca del fin de la ventana se prioriza terminar el respaldo
+            self.deadline_mode = True
+            self.limiter.set_rate(self.max_rate)
+            self.limiter.resume()
+            log.warning("Ventana de respaldo por agotarse: se desactiva el control de carga")
+        if self.deadline_mode:
+            return
+        sample = self.probe.sample()
+        if sample is None:
+            # Sin métricas de la captura no se mantiene una pausa
+            self.limiter.resume()
+            return
+        overruns, pressure = sample
+        rate = self.limiter.rate
+        if overruns or pressure > self.max_jitter:
+            if rate <= self.min_rate:
+                if not self.limiter.paused:
+                    self.pauses += 1
+                    log.info(f"Respaldo en pausa: {overruns} ciclos excedidos, jitter {pressure:.0%} del periodo")
+                self.limiter.pause()
+            else:
+                self.reductions += 1
+                self.limiter.set_rate(max(self.min_rate, rate / 2))
+                self.lowest_rate = min(self.lowest_rate, self.limiter.rate)
+                log.info(f"Caudal del respaldo reducido a {self.limiter.rate / MIB:.1f} MiB/s")
+        elif self.limiter.paused:
+            self.limiter.resume()
+            log.info("Respaldo reanudado")
+        else:
+            rate += self.step
+            self.limiter.set_rate(min(rate, self.max_rate) if self.max_rate else rate)
+
+    def stop(self):
+        self._stop_event.set()
+        self.limiter.resume()
+        self.join(THROTTLE_INTERVAL + 5)
+
+    def summary(self):
+        """
+        Resumen legible para el log.
+        """
+        return (f"caudal_min={self.lowest_rate / MIB:.1f}MiB/s reducciones={self.reductions} "
+                f"pausas={self.pauses} en_pausa={self.limiter.paused_seconds:.1f}s"
+                + (" ventana_agotada" if self.deadline_mode else ""))
+
+
+def throttled_command(config, program):
+    """
+    Programa precedido de ionice y nice según ``backup_ionice_class`` y
+    ``backup_nice``, para usar con postgres_command (dentro del contenedor,
+    donde pg_dump comprime la salida).
+
+    :return: lista con el programa y sus prefijos
+    """
+    return ['ionice', '-c', str(config.get('backup_ionice_class', 3)),
+            'nice', '-n', str(config.get('backup_nice', 19)), program]
+
+
+def from_config(config):
+    """
+    Controlador configurado desde config.json: métricas de la captura en
+    ``metrics_ports`` (los procesos que no sean de respaldo) y parámetros
+    ``backup_max_rate``/``backup_min_rate`` (MiB/s), ``backup_max_jitter``
+    y ``backup_window`` (segundos).
+    """
+    ports = [port for name, port in config.get('metrics_ports', {}).items() if port]
+    if not ports:
+        log.warning("Sin 'metrics_ports' configurados: el respaldo usa solo el presupuesto de E/S")
+    max_rate = config.get('backup_max_rate')
+    return BackupThrottle(IngestProbe(ports, config.get('metrics_host', '127.0.0.1')),
+                          max_rate=max_rate * MIB if max_rate else None,
+                          min_rate=config.get('backup_min_rate', 1) * MIB,
+                          max_jitter=config.get('backup_max_jitter', 0.1),
+                          window=config.get('backup_window'))
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3.12
+
+# Banco de pruebas de rendimiento de la captura sin el hardware del
+# laboratorio. Levanta servidores Modbus TCP simulados (pymodbus) para APIS1,
+# los cuatro dispositivos APIS2 y APIS3 con los bloques de register_map.json,
+# ejecuta las tuberías de captura (supervisor.py o los tres scripts) contra un
+# PostgreSQL local durante un tiempo fijo y reporta la tasa de muestreo real,
+# el jitter, los percentiles p50/p99 del ciclo y de las lecturas Modbus, y las
+# filas por segundo. Permite inyectar latencia y timeouts Modbus (mediante un
+# proxy TCP delante de cada servidor) y bloqueos de la base de datos.
+#
+# Los resultados se guardan en JSON (--output) para compararlos con una
+# ejecución anterior (--baseline) antes y después de cada cambio.
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import logging                                      # Para registro de eventos e información de depuración
+import psycopg2                                     # Conector para PostgreSQL
+from register_map import load_register_map          # Decodificación declarativa de registros
+import metrics                                      # Lectura de las métricas de los procesos medidos
+import schema_manager                               # Tablas de captura e índices BRIN
+
+try:
+    from pymodbus.server import StartAsyncTcpServer
+    try:
+        from pymodbus.simulator import DataType, SimData, SimDevice
+    except ImportError:                             # pymodbus sin SimDevice: datastore clásico
+        SimDevice = None
+        from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+except ImportError:
+    StartAsyncTcpServer = None
+
+log = logging.getLogger()
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Procesos de captura que se pueden medir y su puerto de métricas
+TARGETS = {
+    'supervisor': {'supervisor': 'supervisor.py'},
+    'scripts': {'apis1': 'capture_apis1.py', 'apis2': 'capture_apis2.py', 'apis3': 'capture_apis3.py'},
+}
+METRICS_BASE_PORT = 9190
+SERVER_BASE_PORT = 15020        # Servidores simulados en 127.0.0.1:<puerto + i>
+
+
+class FaultProxy:
+    """
+    Proxy TCP entre el cliente Modbus y un servidor simulado que retrasa las
+    respuestas (latencia fija más jitter uniforme) y descarta una fracción de
+    ellas para provocar timeouts en el cliente.
+    """
+
+    def __init__(self, listen, upstream, latency=0.0, jitter=0.0, drop_rate=0.0):
+        """
+        :param listen: (host, puerto) donde se conectan los scripts de captura
+        :param upstream: (host, puerto) del servidor simulado
+        :param latency: segundos agregados a cada respuesta
+        :param jitter: segundos adicionales máximos (uniforme) por respuesta
+        :param drop_rate: fracción de respuestas descartadas
+        """
+        self.listen = listen
+        self.upstream = upstream
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.dropped = 0
+
+    async def start(self):
+        return await asyncio.start_server(self._handle, *self.listen)
+
+    async def _handle(self, reader, writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection(*self.upstream)
+        except OSError:
+            writer.close()
+            return
+
+        async def forward_requests():
+            while data := await reader.read(4096):
+                up_writer.write(data)
+                await up_writer.drain()
+            up_writer.close()
+
+        async def forward_responses():
+            while data := await up_reader.read(4096):
+                if self.drop_rate and random.random() < self.drop_rate:
+                    self.dropped += 1
+                    continue
+                delay = self.latency + random.uniform(0, self.jitter)
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+            writer.close()
+
+        try:
+            await asyncio.gather(forward_requests(), forward_responses())
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+            up_writer.close()
+
+
+def simulated_value(address, step):
+    """
+    Valor simulado de un registro: una rampa distinta por dirección que
+    avanza en cada tick, de modo que las lecturas cambian entre ciclos.
+    """
+    return (address * 7 + step) % 1000
+
+
+class SimulatedPlant:
+    """
+    Servidores Modbus TCP simulados, uno por dispositivo del mapa de
+    registros, con los registros de sus bloques variando en cada tick, y un
+    FaultProxy delante de cada uno. Corre en un hilo con su propio event loop.
+    """
+
+    def __init__(self, register_map, modbus_port, latency=0.0, jitter=0.0, drop_rate=0.0, tick=0.1):
+        """
+        :param register_map: diccionario dispositivo -> bloques compilados
+        :param modbus_port: puerto Modbus de los proxies (el de 'modbus_port' en la configuración)
+        :param tick: segundos entre cambios de los valores simulados
+        """
+        if StartAsyncTcpServer is None:
+            raise RuntimeError("pymodbus no está instalado")
+        self.register_map = register_map
+        self.tick = tick
+        self.addresses = {}     # dispositivo -> IP de loopback del proxy
+        self.proxies = []
+        self._datablocks = []   # Solo con el datastore clásico, que se actualiza en cada tick
+        self._step = 0
+        for i, device in enumerate(register_map):
+            ip = f"127.0.0.{2 + i}"
+            self.addresses[device] = ip
+            self.proxies.append(FaultProxy((ip, modbus_port), ('127.0.0.1', SERVER_BASE_PORT + i),
+                                           latency, jitter, drop_rate))
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="simulated-plant", daemon=True)
+
+    def start(self, timeout=10):
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("Los servidores Modbus simulados no iniciaron a tiempo")
+        if self._error is not None:
+            raise RuntimeError(f"No se pudo iniciar la planta simulada: {self._error}")
+        return self
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+
+    async def _main(self):
+        for i, blocks in enumerate(self.register_map.values()):
+            size = max(block.address + block.count for block in blocks)
+            if SimDevice is not None:
+                context = SimDevice(id=0, simdata=[SimData(0, count=size, datatype=DataType.REGISTERS)],
+                                    action=self._action)
+            else:
+                # Bloque de datos con base 1: la dirección Modbus 0 corresponde al primer valor
+                datablock = ModbusSequentialDataBlock(1, [0] * size)
+                self._datablocks.append(datablock)
+                context = ModbusServerContext(ModbusSlaveContext(hr=datablock), single=True)
+            asyncio.create_task(StartAsyncTcpServer(context=context, address=('127.0.0.1', SERVER_BASE_PORT + i)))
+        for proxy in self.proxies:
+            await proxy.start()
+        self._update()
+        await asyncio.sleep(0.5)
+        self._ready.set()
+        while True:
+            await asyncio.sleep(self.tick)
+            self._step += 1
+            self._update()
+
+    async def _action(self, function_code, start_address, address, count, registers, values):
+        # SimDevice: los registros pedidos se calculan al responder
+        for offset in range(address - start_address, address - start_address + count):
+            registers[offset] = simulated_value(start_address + offset, self._step)
+
+    def _update(self):
+        for datablock in self._datablocks:
+            size = len(datablock.values) - 1
+            datablock.setValues(1, [simulated_value(address, self._step) for address in range(size)])
+
+    @property
+    def dropped(self):
+        return sum(proxy.dropped for proxy in self.proxies)
+
+
+class DatabaseStaller(threading.Thread):
+    """
+    Bloqueos periódicos de la base de datos: toma un lock ACCESS EXCLUSIVE
+    sobre las tablas de captura durante ``seconds`` cada ``every`` segundos,
+    de modo que los COPY de los escritores esperan como ante un PostgreSQL saturado.
+    """
+
+    def __init__(self, connect, tables, seconds, every):
+        super().__init__(name="db-staller", daemon=True)
+        self.connect = connect
+        self.tables = tables
+        self.seconds = seconds
+        self.every = every
+        self.stalls = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = self.connect()
+        try:
+            while not self._stop_event.wait(self.every):
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LOCK TABLE {', '.join(self.tables)} IN ACCESS EXCLUSIVE MODE")
+                    self._stop_event.wait(self.seconds)
+                conn.rollback()
+                self.stalls += 1
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(self.seconds + 5)
+
+
+def delta(end, start):
+    return {key: value - start.get(key, 0.0) for key, value in end.items()}
+
+
+def histogram_quantile(q, samples, name, group):
+    """
+    Cuantil de un histograma (interpolación lineal dentro de la cubeta, como
+    histogram_quantile de Prometheus), agrupando las series por la etiqueta ``group``.
+
+    :param samples: muestras (ya restadas entre el inicio y el fin de la medición)
+    :param group: etiqueta de agrupación (None suma todas las series en la clave None)
+    :return: diccionario valor de la etiqueta -> cuantil en segundos
+    """
+    buckets = {}
+    for (metric, labels), value in samples.items():
+        if metric != f"{name}_bucket":
+            continue
+        labels = dict(labels)
+        counts = buckets.setdefault(labels.get(group), {})
+        bound = float(labels['le'])
+        counts[bound] = counts.get(bound, 0.0) + value
+    result = {}
+    for key, counts in buckets.items():
+        pairs = sorted(counts.items())
+        total = pairs[-1][1]
+        if total <= 0:
+            continue
+        rank = q * total
+        previous_bound, previous_count = 0.0, 0.0
+        for bound, count in pairs:
+            if count >= rank:
+                if bound == float('inf'):
+                    result[key] = previous_bound
+                else:
+                    fraction = (rank - previous_count) / (count - previous_count) if count > previous_count else 0
+                    result[key] = previous_bound + (bound - previous_bound) * fraction
+                break
+            previous_bound, previous_count = bound, count
+    return result
+
+
+def series(samples, name, group):
+    """
+    Suma las series de una métrica por el valor de la etiqueta ``group``.
+    """
+    result = {}
+    for (metric, labels), value in samples.items():
+        if metric == name:
+            key = dict(labels).get(group)
+            result[key] = result.get(key, 0.0) + value
+    return result
+
+
+def table_counts(conn, tables):
+    with conn.cursor() as cursor:
+        counts = {}
+        for table in tables:
+            cursor.execute(f"SELECT count(*) FROM {table}")
+            counts[table] = cursor.fetchone()[0]
+    conn.rollback()
+    return counts
+
+
+def settings(args):
+    """
+    Valores de configuración dados con ``-s clave=valor`` (JSON si es válido).
+    """
+    result = {}
+    for item in args.set or []:
+        key, _, value = item.partition('=')
+        try:
+            result[key] = json.loads(value)
+        except json.JSONDecodeError:
+            result[key] = value
+    return result
+
+
+def prepare_database(args, tables):
+    """
+    Crea la base de datos de prueba (si no existe) y las tablas de captura
+    con schema_manager.py, vaciándolas antes de medir. Con ``-s raw_frames=true``
+    crea en su lugar las tablas de tramas crudas y las vistas con las
+    columnas decodificadas (raw_frames.py).
+    """
+    params = dict(host=args.db_host, port=args.db_port, user=args.db_user, password=args.db_password)
+    admin = psycopg2.connect(dbname='postgres', **params)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (args.db_name,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE DATABASE "{args.db_name}"')
+    admin.close()
+
+    connect = lambda: psycopg2.connect(dbname=args.db_name, **params)
+    conn = connect()
+    manager = schema_manager.from_config(settings(args), conn)
+    with conn.cursor() as cursor:
+        for table, block in tables.items():
+            # Una corrida anterior pudo dejar el otro esquema con el mismo nombre
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+            kind = (cursor.fetchone() or [None])[0]
+            if manager.raw and kind == 'r':
+                cursor.execute(f"DROP TABLE {table}")
+            elif not manager.raw and kind == 'v':
+                cursor.execute(f"DROP VIEW {table}")
+            manager.create(block)
+            cursor.execute(f"TRUNCATE {manager.storage_table(table)}")
+    conn.commit()
+    return connect, conn
+
+
+def build_config(args, plant, ports, work_dir):
+    """
+    Configuración de los procesos de captura apuntando a la planta simulada y a la base de prueba.
+    """
+    config = {
+        'db_host': args.db_host,
+        'db_port': args.db_port,
+        'db_name': args.db_name,
+        'db_user': args.db_user,
+        'db_password': args.db_password,
+        'modbus_port': args.modbus_port,
+        'register_map_file': args.register_map,
+        'spool_dir': os.path.join(work_dir, 'spool'),
+        'metrics_ports': ports,
+        'jitter_report_interval': args.duration + args.warmup + 60,
+    }
+    for device, ip in plant.addresses.items():
+        config[f'modbus_ip_{device}'] = ip
+    config.update(settings(args))
+    return config
+
+
+def summarize(start, end, start_counts, end_counts, duration, config):
+    """
+    Resultados de la medición a partir de las métricas y los conteos de filas.
+    """
+    samples = delta(end, start)
+    periods = series(end, 'scada_sample_period_seconds', 'loop')
+    cycles = series(samples, 'scada_cycles_total', 'loop')
+    overruns = series(samples, 'scada_cycle_overruns_total', 'loop')
+    jitter_sum = series(samples, 'scada_cycle_jitter_seconds_sum', 'loop')
+    loops = {}
+    for loop, count in sorted(cycles.items()):
+        period = periods.get(loop)
+        loops[loop] = {
+            'target_hz': 1 / period if period else None,
+            'rate_hz': count / duration,
+            'overruns': int(overruns.get(loop, 0)),
+            'jitter_mean_ms': jitter_sum.get(loop, 0) / count * 1000 if count else 0.0,
+            'jitter_p99_ms': histogram_quantile(0.99, samples, 'scada_cycle_jitter_seconds', 'loop').get(loop, 0) * 1000,
+            'cycle_p50_ms': histogram_quantile(0.50, samples, 'scada_cycle_work_seconds', 'loop').get(loop, 0) * 1000,
+            'cycle_p99_ms': histogram_quantile(0.99, samples, 'scada_cycle_work_seconds', 'loop').get(loop, 0) * 1000,
+        }
+    devices = {}
+    p50 = histogram_quantile(0.50, samples, 'scada_modbus_read_seconds', 'device')
+    p99 = histogram_quantile(0.99, samples, 'scada_modbus_read_seconds', 'device')
+    failures = series(samples, 'scada_modbus_read_failures_total', 'device')
+    for device in sorted(set(p50) | set(failures)):
+        devices[device] = {'read_p50_ms': p50.get(device, 0) * 1000, 'read_p99_ms': p99.get(device, 0) * 1000,
+                           'failures': int(failures.get(device, 0))}
+    rows = {table: end_counts[table] - start_counts[table] for table in end_counts}
+    flush_count = sum(series(samples, 'scada_db_flush_seconds_count', None).values())
+    return {
+        'duration': duration,
+        'config': config,
+        'loops': loops,
+        'devices': devices,
+        'rows_per_second': sum(rows.values()) / duration,
+        'rows': rows,
+        'flush_p50_ms': histogram_quantile(0.50, samples, 'scada_db_flush_seconds', None).get(None, 0) * 1000,
+        'flush_p99_ms': histogram_quantile(0.99, samples, 'scada_db_flush_seconds', None).get(None, 0) * 1000,
+        'flushes': int(flush_count),
+        'spooled_rows': int(sum(series(samples, 'scada_rows_spooled_total', 'table').values())),
+        'queue_dropped': int(sum(series(samples, 'scada_queue_dropped_total', None).values())),
+    }
+
+
+def print_results(results, baseline=None):
+    """
+    Muestra los resultados y, si hay una ejecución anterior, la diferencia.
+    """
+    def compare(value, old, fmt):
+        text = fmt.format(value)
+        if old is not None:
+            text += f" ({value - old:+.2f})"
+        return text
+
+    base_loops = (baseline or {}).get('loops', {})
+    print(f"{'Bucle':<10} {'Objetivo':>9} {'Real':>16} {'Excedidos':>10} {'Jitter':>16} "
+          f"{'Jitter p99':>16} {'Ciclo p50':>16} {'Ciclo p99':>16}")
+    for loop, stats in results['loops'].items():
+        old = base_loops.get(loop, {})
+        target = f"{stats['target_hz']:.2f} Hz" if stats['target_hz'] else '-'
+        print(f"{loop:<10} {target:>9} {compare(stats['rate_hz'], old.get('rate_hz'), '{:.2f} Hz'):>16} "
+              f"{stats['overruns']:>10} {compare(stats['jitter_mean_ms'], old.get('jitter_mean_ms'), '{:.2f} ms'):>16} "
+              f"{compare(stats['jitter_p99_ms'], old.get('jitter_p99_ms'), '{:.2f} ms'):>16} "
+              f"{compare(stats['cycle_p50_ms'], old.get('cycle_p50_ms'), '{:.2f} ms'):>16} "
+              f"{compare(stats['cycle_p99_ms'], old.get('cycle_p99_ms'), '{:.2f} ms'):>16}")
+    base_devices = (baseline or {}).get('devices', {})
+    print(f"\n{'Dispositivo':<12} {'Lectura p50':>18} {'Lectura p99':>18} {'Fallidas':>9}")
+    for device, stats in results['devices'].items():
+        old = base_devices.get(device, {})
+        print(f"{device:<12} {compare(stats['read_p50_ms'], old.get('read_p50_ms'), '{:.2f} ms'):>18} "
+              f"{compare(stats['read_p99_ms'], old.get('read_p99_ms'), '{:.2f} ms'):>18} {stats['failures']:>9}")
+    old_rate = (baseline or {}).get('rows_per_second')
+    print(f"\nFilas/s: {compare(results['rows_per_second'], old_rate, '{:.1f}')}  "
+          f"vaciados: {results['flushes']} (p50 {results['flush_p50_ms']:.2f} ms, p99 {results['flush_p99_ms']:.2f} ms)  "
+          f"al spool: {results['spooled_rows']}  descartadas en cola: {results['queue_dropped']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas de la captura con una planta Modbus simulada.")
+    parser.add_argument('--target', choices=sorted(TARGETS), default='supervisor',
+                        help="procesos a medir: supervisor.py o los tres scripts de captura")
+    parser.add_argument('-d', '--duration', type=float, default=60, help="segundos de medición")
+    parser.add_argument('--warmup', type=float, default=5, help="segundos de arranque antes de medir")
+    parser.add_argument('--register-map', default=os.path.join(SCRIPT_DIR, 'register_map.json'))
+    parser.add_argument('--modbus-port', type=int, default=5020, help="puerto de los dispositivos simulados")
+    parser.add_argument('--latency', type=float, default=0.0, help="ms agregados a cada respuesta Modbus")
+    parser.add_argument('--jitter', type=float, default=0.0, help="ms adicionales máximos por respuesta")
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="fracción de respuestas Modbus descartadas (provoca timeouts)")
+    parser.add_argument('--db-stall', type=float, default=0.0, help="segundos de cada bloqueo de la base de datos")
+    parser.add_argument('--db-stall-every', type=float, default=15.0, help="segundos entre bloqueos")
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5432)
+    parser.add_argument('--db-name', default='scada_bench', help="base de prueba (se crea si no existe)")
+    parser.add_argument('--db-user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--db-password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('-s', '--set', action='append', metavar='CLAVE=VALOR',
+                        help="parámetro adicional de config.json (valor JSON), por ejemplo -s pipelined=true")
+    parser.add_argument('-o', '--output', help="archivo JSON donde guardar los resultados")
+    parser.add_argument('--baseline', help="resultados JSON de una ejecución anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+    register_map = load_register_map(args.register_map)
+    tables = {block.table: block for blocks in register_map.values() for block in blocks}
+    connect, conn = prepare_database(args, tables)
+    plant = SimulatedPlant(register_map, args.modbus_port, latency=args.latency / 1000,
+                           jitter=args.jitter / 1000, drop_rate=args.drop_rate).start()
+
+    processes = []
+    staller = None
+    with tempfile.TemporaryDirectory(prefix='scada_bench_') as work_dir:
+        ports = {name: METRICS_BASE_PORT + i for i, name in enumerate(TARGETS[args.target])}
+        config = build_config(args, plant, ports, work_dir)
+        config_file = os.path.join(work_dir, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f, indent=2)
+        # PGPORT cubre a los scripts que no leen 'db_port' de la configuración
+        env = dict(os.environ, SCADA_CONFIG=config_file, PGPORT=str(args.db_port))
+        try:
+            for name, script in TARGETS[args.target].items():
+                processes.append(subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, script)], env=env,
+                                                  stdout=subprocess.DEVNULL,
+                                                  stderr=open(os.path.join(work_dir, f"{name}.log"), 'w')))
+            time.sleep(args.warmup)
+            if any(p.poll() is not None for p in processes):
+                raise RuntimeError("Un proceso de captura terminó durante el arranque")
+
+            start_metrics, start_counts = metrics.scrape(ports.values()), table_counts(conn, tables)
+            start = time.monotonic()
+            if args.db_stall:
+                staller = DatabaseStaller(connect, list(tables), args.db_stall, args.db_stall_every)
+                staller.start()
+            time.sleep(args.duration)
+            end_metrics = metrics.scrape(ports.values())
+            duration = time.monotonic() - start
+            if staller is not None:
+                staller.stop()
+            # Las filas retenidas en el buffer al final se cuentan tras un vaciado completo
+            time.sleep(config.get('batch_max_latency', 5.0) + 1)
+            end_counts = table_counts(conn, tables)
+        finally:
+            for process in processes:
+                process.send_signal(signal.SIGINT)
+            for process in processes:
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            conn.close()
+
+    config = {key: value for key, value in config.items() if key not in ('db_password', 'metrics_ports')}
+    results = summarize(start_metrics, end_metrics, start_counts, end_counts, duration, config)
+    results['faults'] = {'latency_ms': args.latency, 'jitter_ms': args.jitter, 'drop_rate': args.drop_rate,
+                         'dropped_responses': plant.dropped, 'db_stall': args.db_stall,
+                         'db_stalls': staller.stalls if staller else 0}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"Resultados guardados en {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3.12
+
+# Captura en ráfaga alrededor de eventos. Los bloques con 'burst' en el mapa
+# de registros se leen además en un hilo propio a la máxima tasa del equipo
+# (o cada 'burst_period' segundos), con su propia conexión Modbus. Cada
+# lectura se guarda en un buffer circular de tamaño fijo (arreglos de enteros
+# de 16 bits, sin decodificar) y se evalúan los disparadores del bloque sobre
+# los campos indicados. Al dispararse uno, se toman del buffer las lecturas de
+# la ventana previa ('pre' segundos), se siguen acumulando las de la ventana
+# posterior ('post' segundos, extendida por nuevos disparos) y el evento
+# completo se escribe en bloque con COPY en la tabla de eventos del bloque
+# ('<tabla>_event', creada si no existe). El resto de la captura sigue con su
+# periodo normal.
+#
+# Disparadores ("triggers" del bloque, uno por campo):
+#   {"field": "Status_Conversor", "change": true}          cualquier cambio de valor
+#   {"field": "Freq_System", "below": 59.5, "above": 60.5}  entrada en la excursión
+#   {"field": "P_Total", "delta": 5.0}                      salto entre lecturas mayor que delta
+
+import io                                           # Buffer en memoria para COPY
+import time                                         # Reloj y esperas del bucle de ráfaga
+import queue                                        # Eventos pendientes de escritura
+import threading                                    # Hilos de ráfaga y de escritura
+import logging                                      # Para registro de eventos e información de depuración
+from array import array                             # Buffer circular compacto
+from datetime import datetime
+from psycopg2 import OperationalError, InterfaceError
+from db_writer import copy_line                     # Formato de texto de COPY
+from backoff import Backoff
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+DEFAULT_CAPACITY = 4096         # Lecturas por bloque en el buffer circular
+DEFAULT_PRE = 2.0               # Segundos de la ventana previa al disparo
+DEFAULT_POST = 5.0              # Segundos de la ventana posterior al disparo
+DEFAULT_MAX_LENGTH = 60.0       # Segundos máximos de un evento con disparos repetidos
+DEFAULT_MAX_PENDING = 100       # Eventos en memoria a la espera de PostgreSQL
+
+BURST_SAMPLES = metrics.counter('scada_burst_samples_total', "Lecturas de la captura en ráfaga", ('table',))
+BURST_EVENTS = metrics.counter('scada_burst_events_total', "Eventos disparados en la captura en ráfaga", ('table',))
+BURST_ROWS = metrics.counter('scada_burst_rows_written_total', "Filas escritas en las tablas de eventos", ('table',))
+BURST_DROPPED = metrics.counter('scada_burst_events_dropped_total', "Eventos descartados por la cola llena o un error de datos", ('table',))
+
+
+class RingBuffer:
+    """
+    Buffer circular de lecturas de un bloque sobre arreglos contiguos: los
+    instantes en un arreglo de dobles y los registros en un arreglo de enteros
+    sin signo de 16 bits, ``count`` por lectura. Al llenarse, cada lectura
+    nueva reemplaza a la más antigua, sin reservar memoria.
+    """
+
+    def __init__(self, count, capacity=DEFAULT_CAPACITY):
+        """
+        :param count: registros por lectura
+        :param capacity: lecturas que conserva el buffer
+        """
+        self.count = count
+        self.capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._registers = array('H', bytes(2 * capacity * count))
+        self._next = 0
+        self.size = 0
+
+    def append(self, timestamp, registers):
+        """
+        :param timestamp: instante de la lectura (segundos de time.time())
+        :param registers: lista de ``count`` registros
+        """
+        position = self._next * self.count
+        self._registers[position:position + self.count] = array('H', registers)
+        self._timestamps[self._next] = timestamp
+        self._next = (self._next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def since(self, timestamp):
+        """
+        Lecturas del buffer desde ``timestamp``, de la más antigua a la más reciente.
+
+        :return: lista de tuplas (instante, lista de registros)
+        """
+        frames = []
+        first = (self._next - self.size) % self.capacity
+        for i in range(self.size):
+            slot = (first + i) % self.capacity
+            if self._timestamps[slot] >= timestamp:
+                position = slot * self.count
+                frames.append((self._timestamps[slot], self._registers[position:position + self.count].tolist()))
+        return frames
+
+
+class Trigger:
+    """
+    Disparador sobre un campo del bloque. ``check`` se evalúa con cada
+    lectura y retorna la descripción del disparo o None. Los umbrales se
+    disparan al entrar en la excursión y no mientras se mantiene.
+    """
+
+    def __init__(self, block, spec):
+        """
+        :param block: bloque compilado (register_map.CompiledBlock)
+        :param spec: diccionario del disparador en el mapa de registros
+        """
+        self.field = spec['field']
+        self.decode = block.field_decoder(self.field)
+        self.change = spec.get('change', False)
+        self.delta = spec.get('delta')
+        self.below = spec.get('below')
+        self.above = spec.get('above')
+        if not (self.change or self.delta is not None or self.below is not None or self.above is not None):
+            raise ValueError(f"Bloque {block.device}.{block.name}: el disparador de {self.field} "
+                             "no define 'change', 'delta', 'below' ni 'above'")
+        self._previous = None
+        self._outside = False
+
+    def check(self, registers):
+        value = self.decode(registers)
+        previous, self._previous = self._previous, value
+        outside = (self.below is not None and value < self.below) or \
+                  (self.above is not None and value > self.above)
+        entered, self._outside = outside and not self._outside, outside
+        if previous is None:
+            return None
+        if self.change and value != previous:
+            return f"{self.field} {previous} -> {value}"
+        if self.delta is not None and abs(value - previous) > self.delta:
+            return f"{self.field} salto {previous} -> {value}"
+        if entered:
+            return f"{self.field} = {value} fuera de [{self.below}, {self.above}]"
+        return None
+
+
+class _BlockState:
+    """
+    Buffer, disparadores y evento en curso de un bloque en ráfaga.
+    """
+
+    def __init__(self, block, capacity):
+        spec = block.burst
+        self.block = block
+        self.ring = RingBuffer(block.count, capacity)
+        self.triggers = [Trigger(block, t) for t in spec.get('triggers', [])]
+        self.pre = spec.get('pre', DEFAULT_PRE)
+        self.post = spec.get('post', DEFAULT_POST)
+        self.max_length = spec.get('max', DEFAULT_MAX_LENGTH)
+        self.table = spec.get('table', f"{block.table}_event")
+        self.event = None
+
+
+class BurstCapture(threading.Thread):
+    """
+    Hilo de captura en ráfaga de los bloques de un dispositivo.
+    """
+
+    def __init__(self, device, blocks, recorder, period=0.0, capacity=DEFAULT_CAPACITY):
+        """
+        :param device: device_manager.ModbusDevice con una conexión propia (no la del bucle normal)
+        :param blocks: bloques compilados con configuración 'burst'
+        :param recorder: BurstRecorder que escribe los eventos
+        :param period: segundos mínimos entre lecturas (0 lee tan rápido como responde el equipo)
+        :param capacity: lecturas por bloque en el buffer circular
+        """
+        super().__init__(name=f"{device.name}-burst", daemon=True)
+        self.device = device
+        self.states = [_BlockState(block, capacity) for block in blocks]
+        self.recorder = recorder
+        self.period = period
+        self.samples = 0
+        self.events = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            read = False
+            for state in self.states:
+                registers = self.device.read(state.block.address, state.block.count)
+                if registers is not None:
+                    read = True
+                    self._sample(state, time.time(), registers)
+            # Con el dispositivo caído se espera el backoff en lugar de girar en vacío
+            delay = self.period - (time.monotonic() - start) if read else 0.1
+            if delay > 0:
+                self._stop_event.wait(delay)
+
+    def _sample(self, state, timestamp, registers):
+        state.ring.append(timestamp, registers)
+        self.samples += 1
+        BURST_SAMPLES.inc((state.block.table,))
+        # Todos los disparadores se evalúan para mantener su valor anterior
+        reasons = [reason for reason in (t.check(registers) for t in state.triggers) if reason]
+        event = state.event
+        if event is None:
+            if reasons:
+                state.event = {'time': timestamp, 'trigger': '; '.join(reasons), 'until': timestamp + state.post,
+                               'frames': state.ring.since(timestamp - state.pre)}
+                self.events += 1
+                BURST_EVENTS.inc((state.block.table,))
+                log.info(f"Evento en {state.block.table}: {state.event['trigger']}")
+            return
+        event['frames'].append((timestamp, registers))
+        if reasons:
+            event['until'] = timestamp + state.post
+        if timestamp >= event['until'] or timestamp - event['time'] >= state.max_length:
+            self._close(state)
+
+    def _close(self, state):
+        self.recorder.submit(state.block, state.table, state.event)
+        state.event = None
+
+    def stop(self, timeout=None):
+        """
+        Detiene el hilo y entrega los eventos en curso, aunque su ventana posterior esté incompleta.
+        """
+        self._stop_event.set()
+        self.join(timeout)
+        for state in self.states:
+            if state.event is not None:
+                self._close(state)
+        self.device.close()
+
+    def summary(self):
+        """
+        Resumen legible para el log.
+        """
+        return f"lecturas={self.samples} eventos={self.events}"
+
+
+class BurstRecorder(threading.Thread):
+    """
+    Escritura de los eventos en sus tablas, en un hilo propio para no
+    retrasar la captura en ráfaga. Cada evento se escribe con un único COPY
+    en su propia transacción; si PostgreSQL no está disponible los eventos
+    esperan en memoria (hasta ``max_pending``) y se reintenta con backoff.
+
+    Tabla de eventos: ``event_time`` (instante del disparo), ``trigger``
+    (descripción) y las columnas de la tabla del bloque.
+    """
+
+    def __init__(self, connect, release=None, backoff=None, max_pending=DEFAULT_MAX_PENDING):
+        """
+        :param connect: función sin argumentos que retorna una conexión o None
+        :param release: función que devuelve la conexión a su pool (None la cierra)
+        :param backoff: instancia de Backoff para los reintentos
+        :param max_pending: eventos en memoria a la espera de PostgreSQL
+        """
+        super().__init__(name="burst-recorder", daemon=True)
+        self.connect = connect
+        self.release = release
+        self.backoff = backoff or Backoff()
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+        self._created = set()
+        self._stop_event = threading.Event()
+
+    def submit(self, block, table, event):
+        """
+        Encola un evento cerrado para su escritura.
+        """
+        try:
+            self._queue.put_nowait((block, table, event))
+        except queue.Full:
+            self.dropped += 1
+            BURST_DROPPED.inc((block.table,))
+            log.warning(f"Evento de {table} descartado: {self._queue.maxsize} eventos esperan a PostgreSQL")
+
+    def run(self):
+        pending = None
+        while not (self._stop_event.is_set() and pending is None and self._queue.empty()):
+            if pending is None:
+                try:
+                    pending = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+            if self._write(*pending):
+                pending = None
+                self.backoff.reset()
+            elif self._stop_event.wait(self.backoff.next_delay()):
+                # Al detenerse sin PostgreSQL los eventos pendientes se pierden
+                log.error(f"{self._queue.qsize() + 1} eventos sin escribir al detener la captura en ráfaga")
+                return
+
+    def _write(self, block, table, event):
+        """
+        :return: True si el evento se escribió o se descartó por un error de datos,
+                 False si debe reintentarse (PostgreSQL no disponible)
+        """
+        conn = self.connect()
+        if conn is None:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                if table not in self._created:
+                    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (event_time timestamp NOT NULL, "
+                                   f"trigger text NOT NULL, LIKE {block.table} INCLUDING DEFAULTS)")
+                    self._created.add(table)
+                event_time = datetime.fromtimestamp(event['time'])
+                rows = block.decode_batch([datetime.fromtimestamp(ts) for ts, _ in event['frames']],
+                                          [registers for _, registers in event['frames']])
+                payload = ''.join(copy_line((event_time, event['trigger']) + row) for row in rows)
+                cursor.copy_expert(f"COPY {table} (event_time, trigger, {', '.join(block.columns)}) FROM STDIN",
+                                   io.StringIO(payload))
+            conn.commit()
+            self.written += 1
+            BURST_ROWS.inc((block.table,), len(rows))
+            log.info(f"Evento de {table} escrito: {len(rows)} lecturas desde {rows[0][0]}")
+            return True
+        except (OperationalError, InterfaceError) as e:
+            log.error(f"Conexión perdida al escribir el evento en {table}: {e}")
+            self._created.discard(table)
+            conn.close()
+            return False
+        except Exception as e:
+            # Un error de datos se repetiría en cada intento: el evento se descarta
+            log.error(f"Evento de {table} descartado por un error al escribirlo: {e}")
+            self.dropped += 1
+            BURST_DROPPED.inc((block.table,))
+            self._created.discard(table)
+            conn.rollback()
+            return True
+        finally:
+            if self.release is not None:
+                self.release(conn)
+            else:
+                conn.close()
+
+    def stop(self, timeout=None):
+        """
+        Escribe los eventos pendientes y detiene el hilo.
+        """
+        self._stop_event.set()
+        self.join(timeout)
+
+    def summary(self):
+        """
+        Resumen legible para el log.
+        """
+        return f"eventos_escritos={self.written} descartados={self.dropped} pendientes={self._queue.qsize()}"
+
+
+def start_bursts(devices, open_device, recorder, period=0.0, capacity=DEFAULT_CAPACITY):
+    """
+    Arranca un BurstCapture por cada dispositivo con bloques en ráfaga.
+
+    :param devices: diccionario dispositivo -> bloques compilados
+    :param open_device: función nombre del dispositivo -> ModbusDevice nuevo (conexión propia de la ráfaga)
+    :param recorder: BurstRecorder compartido
+    :return: lista de BurstCapture iniciados
+    """
+    bursts = []
+    for name, blocks in devices.items():
+        blocks = [block for block in blocks if block.burst]
+        if blocks:
+            burst = BurstCapture(open_device(name), blocks, recorder, period=period, capacity=capacity)
+            burst.start()
+            bursts.append(burst)
+            log.info(f"Captura en ráfaga de {name}: {', '.join(b.table for b in blocks)}")
+    return bursts
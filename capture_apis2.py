@@ -1,25 +1,34 @@
 #!/usr/bin/env python3.12
 
 # Importación de librerías necesarias
-from pymodbus.client import ModbusTcpClient         # Cliente Modbus TCP para comunicarse con el dispositivo
 import psycopg2                                     # Conector para PostgreSQL
-from psycopg2 import OperationalError, InterfaceError
 from datetime import datetime                       # Para obtener la fecha y hora actual
 import time                                         # Para controlar los intervalos de muestreo
 import logging                                      # Para registro de eventos e información de depuración
-import json                                         # Para leer archivos de configuración en formato JSON
+import os                                           # Para construir rutas de archivos
+from scada_config import load_config, CONFIG_FILE   # Configuración compartida con los respaldos
+from concurrent.futures import ThreadPoolExecutor   # Para leer los cuatro dispositivos en paralelo
+from db_writer import BufferedWriter                # Escritura en bloque con COPY
+from scheduler import DeadlineScheduler             # Ciclos sobre plazos absolutos
+from device_manager import ModbusDevice, Backoff    # Conexión Modbus por dispositivo con backoff
+from register_map import load_register_map          # Decodificación declarativa de registros
+from spool import Spool, SpoolDrainer               # Cola en disco ante caídas de PostgreSQL
+from pipeline import FrameQueue, WriterThread       # Adquisición y escritura en hilos separados
+from rollup import Rollups                          # Agregados de 1 s, 1 min y 15 min
+from deadband import DeadbandFilter                 # Registro por excepción
+from read_planner import ReadPlan                   # Peticiones Modbus mínimas por ciclo
+from burst import BurstRecorder, start_bursts       # Captura en ráfaga alrededor de eventos
+import metrics                                      # Métricas en formato Prometheus
 
 # Configuración de logging
 logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.INFO)
 
-# Ruta al archivo de configuración externo (JSON)
-CONFIG_FILE = '/home/administrador/scripts/config.json'
-
-# Carga de configuración desde archivo JSON
-with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
+# Carga de configuración desde archivo JSON (ruta en scada_config.py; la
+# variable de entorno SCADA_CONFIG permite usar otro archivo, por ejemplo,
+# desde benchmark.py)
+config = load_config()
 
 # Configuración de la base de datos PostgreSQL
 DB_CONFIG = {
@@ -30,12 +39,76 @@ DB_CONFIG = {
 }
 
 # Configuración de conexión a los dispositivo Modbus
-MODBUS_IP_APIS2_PB = config['modbus_ip_apis2_pb']
-MODBUS_IP_APIS2_LI = config['modbus_ip_apis2_li']
-MODBUS_IP_APIS2_RDX = config['modbus_ip_apis2_rdx']
-MODBUS_IP_APIS2_SC = config['modbus_ip_apis2_sc']
 MODBUS_PORT = config['modbus_port']
 
+# Tolerancia a fallas: timeout Modbus (s), fallos consecutivos que abren el
+# circuito de un dispositivo y límites del backoff exponencial (s)
+MODBUS_TIMEOUT = config.get('modbus_timeout', 3)
+DEVICE_FAILURE_THRESHOLD = config.get('device_failure_threshold', 3)
+BACKOFF_BASE = config.get('backoff_base', 0.5)
+BACKOFF_MAX = config.get('backoff_max', 30)
+
+# Periodo de muestreo (s), política ante ciclos excedidos ('skip' o 'catchup')
+# y segundos entre resúmenes de jitter en el log
+SAMPLE_PERIOD = config.get('period_apis2', 1.0)
+SCHEDULE_POLICY = config.get('schedule_policy', 'skip')
+JITTER_REPORT_INTERVAL = config.get('jitter_report_interval', 60)
+
+# Lectura concurrente de los cuatro dispositivos (True) o secuencial (False)
+CONCURRENT_READS = config.get('concurrent_reads', True)
+
+# Spool en disco para no perder muestras si PostgreSQL no está disponible
+# (spool_dir = null lo desactiva; cada proceso usa su subdirectorio, aquí
+# 'apis2'), uso máximo de disco y registros por segmento
+SPOOL_DIR = config.get('spool_dir', os.path.join(os.path.dirname(CONFIG_FILE), 'spool'))
+SPOOL_MAX_BYTES = config.get('spool_max_bytes', 1024 ** 3)
+SPOOL_SEGMENT_RECORDS = config.get('spool_segment_records', 10000)
+
+# Modo en tubería: la adquisición encola las lecturas y un hilo escritor las
+# guarda; capacidad de la cola y política ante cola llena ('block', 'drop_oldest' o 'spill')
+PIPELINED = config.get('pipelined', False)
+QUEUE_MAX_FRAMES = config.get('queue_max_frames', 300)
+QUEUE_OVERFLOW_POLICY = config.get('queue_overflow_policy', 'spill')
+
+# Actualización de las tablas de agregados en cada escritura (ver rollup.py)
+ROLLUP_ON_WRITE = config.get('rollup_on_write', False)
+
+# Registro por excepción: solo se guardan las lecturas que cambiaron más que la
+# tolerancia de algún campo, o una fila cada 'deadband_heartbeat' segundos
+DEADBAND = config.get('deadband', False)
+DEADBAND_HEARTBEAT = config.get('deadband_heartbeat', 60.0)
+
+# Plan de lecturas Modbus (ver read_planner.py): solo los registros usados por
+# los campos, uniendo rangos cuando el hueco cuesta menos que una petición
+# ('read_request_cost', en registros) y sin leer fuera de los bloques declarados
+READ_PLANNER = config.get('read_planner', False)
+READ_REQUEST_COST = config.get('read_request_cost', 32)
+READ_BRIDGE_UNMAPPED = config.get('read_bridge_unmapped', False)
+
+# Captura en ráfaga (ver burst.py): los bloques con 'burst' en el mapa de
+# registros se leen también a la máxima tasa del equipo ('burst_period' > 0 la
+# limita) y se guardan las ventanas alrededor de cada disparo en '<tabla>_event'
+BURST = config.get('burst', False)
+BURST_PERIOD = config.get('burst_period', 0.0)
+BURST_CAPACITY = config.get('burst_capacity', 4096)
+
+# Almacenamiento como tramas de registros (ver raw_frames.py): cada lectura se
+# escribe sin decodificar en '<tabla>_raw' y la vista '<tabla>' la decodifica
+RAW_FRAMES = config.get('raw_frames', False)
+
+# Límites del buffer de escritura (filas, bytes y segundos de espera)
+BATCH_MAX_ROWS = config.get('batch_max_rows', 40)
+BATCH_MAX_BYTES = config.get('batch_max_bytes', 1024 * 1024)
+BATCH_MAX_LATENCY = config.get('batch_max_latency', 5.0)
+
+# Mapa de registros: dispositivos, bloques, campos y escalas (register_map.json)
+REGISTER_MAP_FILE = config.get('register_map_file',
+                               os.path.join(os.path.dirname(CONFIG_FILE), 'register_map.json'))
+REGISTER_MAP = load_register_map(REGISTER_MAP_FILE)
+# Dispositivos APIS2 del mapa; la IP de cada uno se lee de 'modbus_ip_<dispositivo>'
+APIS2_DEVICES = {device: blocks for device, blocks in REGISTER_MAP.items() if device.startswith('apis2_')}
+MODBUS_IPS = {device: config[f'modbus_ip_{device}'] for device in APIS2_DEVICES}
+
 def connect_postgres():
     """
     Intenta establecer conexión a PostgreSQL.
@@ -49,136 +122,142 @@ def connect_postgres():
         log.error(f"Error al conectar a PostgreSQL: {e}")
         return None
 
-def insert_data(conn, registers, tab):
-    """
-    Inserta datos leídos de Modbus en la tabla especificada de PostgreSQL.
-    
-    :param conn: conexión activa a la base de datos
-    :param registers: lista de registros Modbus leídos
-    :param tab: nombre de la tabla destino
+def run_all(executor, calls):
     """
-    try:
-        timestamp = datetime.now()
-
-        # Construcción de la consulta SQL y transformación de los datos según la tabla
-        if tab == "apis2_pb":
-            insert_query = f"""
-            INSERT INTO {tab} (timestamp, ACTUAL_MODE, STATUS_CONVERSOR, DC_Voltage_of_Inverter, DC_Current_of_Inverter, DC_Power_of_Inverter, Phase_Voltage_R_of_Inverter, Phase_Voltage_S_of_Inverter, Phase_Voltage_T_of_Inverter, Line_Voltage_RS_of_Inverter, Line_Voltage_ST_of_Inverter, Line_Voltage_TR_of_Inverter, Line_Current_R_of_Inverter, Line_Current_S_of_Inverter, Line_Current_T_of_Inverter, Active_Power_Phase_R, Active_Power_Phase_S, Active_Power_Phase_T, Reactive_Power_Phase_R, Reactive_Power_Phase_S, Reactive_Power_Phase_T, Total_Active_Power, Total_Reactive_Power, Total_Apparent_Power, Power_Factor, Freq_System, SOC, VCELL)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-
-            data = (timestamp, registers[0], registers[1], registers[2]/10, registers[3]/10, registers[4]/10, registers[5]/10, registers[6]/10, registers[7]/10, registers[8]/10, registers[9]/10, registers[10]/10, registers[11]/10, registers[12]/10, registers[13]/10, registers[14], registers[15], registers[16], registers[17], registers[18], registers[19], registers[20], registers[21], registers[22], registers[23], registers[24]/10, registers[31], registers[32])
-
-        elif tab == "apis2_li":
-            insert_query = f"""
-            INSERT INTO {tab} (timestamp, ACTUAL_mode, STATUS_CONVERSOR, DC_Voltage_of_Inverter, DC_Current_of_Inverter, DC_Power_of_Inverter, Phase_Voltage_R_of_Inverter, Phase_Voltage_S_of_Inverter, Phase_Voltage_T_of_Inverter, Line_Voltage_RS_of_Inverter, Line_Voltage_ST_of_Inverter, Line_Voltage_TR_of_Inverter, Line_Current_R_of_Inverter, Line_Current_S_of_Inverter, Line_Current_T_of_Inverter, Active_Power_Phase_R, Active_Power_Phase_S, Active_Power_Phase_T, Reactive_Power_Phase_R, Reactive_Power_Phase_S, Reactive_Power_Phase_T, Total_Active_Power, Total_Reactive_Power, Total_Apparent_Power, Power_Factor, Freq_System, SOC, SOH, Sys_Voltage, Sys_Current, Sys_Temp_Min, Sys_Temp_Max)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-
-            data = (timestamp, registers[23], registers[24], registers[25]/10, registers[26]/10, registers[27]/10, registers[28]/10, registers[29]/10, registers[30]/10, registers[31]/10, registers[32]/10, registers[33]/10, registers[34]/10, registers[35]/10, registers[36]/10, registers[37], registers[38], registers[39], registers[40], registers[41], registers[42], registers[43], registers[44], registers[45], registers[46], registers[47]/10, registers[5]/10, registers[6]/10, registers[7]/10, registers[8]/10, registers[9]/100, registers[10]/100)
-
-        elif tab == "apis2_rdx":
-            insert_query = f"""
-            INSERT INTO {tab} (timestamp, P_ACT_L1_GRID_GEN_CLUSTER_A, P_ACT_L2_GRID_GEN_CLUSTER_A, P_ACT_L3_GRID_GEN_CLUSTER_A, P_REACT_L1_GRID_GEN_CLUSTER_A, P_REACT_L2_GRID_GEN_CLUSTER_A, P_REACT_L3_GRID_GEN_CLUSTER_A,  P_ACT_L1_GRID_GEN_CLUSTER_B, P_ACT_L2_GRID_GEN_CLUSTER_B, P_ACT_L3_GRID_GEN_CLUSTER_B, P_REACT_L1_GRID_GEN_CLUSTER_B, P_REACT_L2_GRID_GEN_CLUSTER_B, P_REACT_L3_GRID_GEN_CLUSTER_B, SOC, BAT_VOLT_DC_BUS_A, DC_CHARGE_CURR_DC_BUS_A, DC_DISCHARGE_CURR_DC_BUS_A, MAX_CHARGE_VOLT_INV_DC_BUS_A, MAX_DC_DISCHARGE_CURR_INV_DC_BUS_A, BAT_VOLT_DC_BUS_B, DC_CHARGE_CURR_DC_BUS_B, DC_DISCHARGE_CURR_DC_BUS_B, MAX_CHARGE_VOLT_INV_DC_BUS_B, MAX_DC_DISCHARGE_CURR_INV_DC_BUS_B, REDOX_P_TOT)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-
-            data = (timestamp, registers[4]/10, registers[5]/10, registers[6]/10, registers[10]/10, registers[11]/10, registers[12]/10, registers[19]/100, registers[20]/10, registers[21]/10, registers[26]/10, registers[27]/10, registers[28]/10, registers[39]/10, registers[41]/10, registers[42]/10, registers[43]/10, registers[44], registers[45], registers[48]/10, registers[49]/10, registers[50]/10, registers[51], registers[52], registers[55]/10)
-
-        elif tab == "apis2_sc":
-            insert_query = f"""
-            INSERT INTO {tab} (timestamp, Status_conversor, DC_Voltage_of_Inverter, DC_Current_of_Inverter, DC_Power_of_Inverter, Phase_Voltage_R_of_Inverter, Phase_Voltage_S_of_Inverter, Phase_Voltage_T_of_Inverter, Line_Voltage_RS_of_Inverter, Line_Voltage_ST_of_Inverter, Line_Voltage_TR_of_Inverter, Line_Current_R_of_Inverter, Line_Current_S_of_Inverter, Line_Current_T_of_Inverter, Active_Power_Phase_R, Active_Power_Phase_S, Active_Power_Phase_T, Reactive_Power_Phase_R, Reactive_Power_Phase_S, Reactive_Power_Phase_T, Total_Active_Power, Total_Reactive_Power, Total_Apparent_Power, Power_Factor, Freq_System, SOC, VCap)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-
-            data = (timestamp, registers[1], registers[2]/10, registers[3]/10, registers[4]/10, registers[5]/10, registers[6]/10, registers[7]/10, registers[8]/10, registers[9]/10, registers[10]/10, registers[11]/10, registers[12]/10, registers[13]/10, registers[14], registers[15], registers[16], registers[17], registers[18], registers[19], registers[20], registers[21], registers[22], registers[23], registers[24]/10, registers[31]/10, registers[32]/10)
-
-        # Ejecuta la consulta y guarda los cambios
-        with conn.cursor() as cursor:
-            cursor.execute(insert_query, data)
-        conn.commit()
-            
-    except (InterfaceError, OperationalError) as e:
-        log.error(f"Conexión perdida al insertar en {tab}: {e}")
-        raise
-    except Exception as e:
-        log.error(f"Error general al insertar en {tab}: {e}")
+    Ejecuta una lista de llamadas sin argumentos, en paralelo si hay un pool de
+    hilos disponible o de forma secuencial en caso contrario.
 
+    :param executor: ThreadPoolExecutor o None para el modo secuencial
+    :param calls: lista de funciones sin argumentos
+    :return: lista de resultados en el mismo orden que las llamadas
+    """
+    if executor is None:
+        return [call() for call in calls]
+    futures = [executor.submit(call) for call in calls]
+    # result() propaga la excepción de cualquier llamada fallida
+    return [future.result() for future in futures]
 
 def main():
     """
     Función principal que controla el ciclo de lectura e inserción continua.
     """
-    conn = connect_postgres()
-    apis2_pb = ModbusTcpClient(host=MODBUS_IP_APIS2_PB, port=MODBUS_PORT, timeout=3)
-    apis2_li = ModbusTcpClient(host=MODBUS_IP_APIS2_LI, port=MODBUS_PORT, timeout=3)
-    apis2_rdx = ModbusTcpClient(host=MODBUS_IP_APIS2_RDX, port=MODBUS_PORT, timeout=3)
-    apis2_sc = ModbusTcpClient(host=MODBUS_IP_APIS2_SC, port=MODBUS_PORT, timeout=3)
+    # Métricas por HTTP ('metrics_ports') y/o archivo de texto ('metrics_dir')
+    metrics_exporter = metrics.exporter(config, "apis2").start()
+    scheduler = DeadlineScheduler(SAMPLE_PERIOD, policy=SCHEDULE_POLICY,
+                                  report_every=JITTER_REPORT_INTERVAL, name="APIS2")
+    # El escritor gestiona su conexión a PostgreSQL y, si no está disponible,
+    # guarda las lecturas en el spool; el drainer las carga al volver la conexión
+    tables = {block.table: block for blocks in APIS2_DEVICES.values() for block in blocks}
+    spool = Spool(os.path.join(SPOOL_DIR, 'apis2'), max_bytes=SPOOL_MAX_BYTES,
+                  segment_records=SPOOL_SEGMENT_RECORDS, tables=tables) if SPOOL_DIR else None
+    rollups = Rollups(tables) if ROLLUP_ON_WRITE else None
+    writer = BufferedWriter(max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES,
+                            max_latency=BATCH_MAX_LATENCY, connect=connect_postgres, spool=spool,
+                            backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX), rollups=rollups,
+                            raw_frames=RAW_FRAMES)
+    drainer = None
+    if spool is not None:
+        drainer = SpoolDrainer(spool, tables, connect_postgres,
+                               backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX), rollups=rollups,
+                               raw_frames=RAW_FRAMES)
+        drainer.start()
+    devices = [
+        ModbusDevice(name.upper(), MODBUS_IPS[name], MODBUS_PORT, timeout=MODBUS_TIMEOUT,
+                     failure_threshold=DEVICE_FAILURE_THRESHOLD,
+                     backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX))
+        for name in APIS2_DEVICES
+    ]
+    # Dispositivo y plan de lectura de cada tarea (un cliente no se comparte entre hilos)
+    plans = [ReadPlan(blocks, coalesce=READ_PLANNER, request_cost=READ_REQUEST_COST,
+                      bridge_unmapped=READ_BRIDGE_UNMAPPED) for blocks in APIS2_DEVICES.values()]
+    for device, plan in zip(devices, plans):
+        log.info(f"Plan de lectura {device.name}: {plan.describe()}")
+    reads = list(zip(devices, plans))
+    # Un hilo por dispositivo: la latencia del ciclo queda acotada por el más lento
+    executor = ThreadPoolExecutor(max_workers=len(devices), thread_name_prefix="apis2") if CONCURRENT_READS else None
+    error_backoff = Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)
+
+    # En modo tubería el bucle entrega las lecturas a la cola en lugar del escritor
+    sink, writer_thread = writer, None
+    if PIPELINED:
+        sink = FrameQueue(QUEUE_MAX_FRAMES, policy=QUEUE_OVERFLOW_POLICY, spool=spool, name="APIS2")
+        writer_thread = WriterThread(sink, writer, report_every=JITTER_REPORT_INTERVAL,
+                                     name="APIS2-writer")
+        writer_thread.start()
+    deadband = None
+    if DEADBAND:
+        sink = deadband = DeadbandFilter(sink, heartbeat=DEADBAND_HEARTBEAT)
+
+    # Captura en ráfaga con conexiones Modbus propias; los eventos van a sus tablas
+    recorder, bursts = None, []
+    if BURST:
+        recorder = BurstRecorder(connect_postgres, backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX))
+        recorder.start()
+        bursts = start_bursts(APIS2_DEVICES, lambda name: ModbusDevice(
+            f"{name.upper()}_BURST", MODBUS_IPS[name], MODBUS_PORT, timeout=MODBUS_TIMEOUT,
+            failure_threshold=DEVICE_FAILURE_THRESHOLD, backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)),
+            recorder, period=BURST_PERIOD, capacity=BURST_CAPACITY)
 
     try:
         while True:
-            # Reintenta conexión a PostgreSQL si se perdió
-            if conn is None or conn.closed:
-                log.warning("Conexión a PostgreSQL cerrada, intentando reconectar...")
-                conn = connect_postgres()
-                if conn is None:
-                    time.sleep(5)
-                    continue
-
-            # Verifica la conexión Modbus antes de leer
-            if not all([
-                apis2_pb.connect(),
-                apis2_li.connect(),
-                apis2_rdx.connect(),
-                apis2_sc.connect()
-            ]):
-                log.error("No se pudo conectar al dispositivo Modbus")
-                time.sleep(5)
-                continue
-
             try:
-                # Lectura de registros Modbus
-                response1 = apis2_pb.read_holding_registers(address=0, count=33)
-                response2 = apis2_li.read_holding_registers(address=0, count=48)
-                response3 = apis2_rdx.read_holding_registers(address=0, count=56)
-                response4 = apis2_sc.read_holding_registers(address=0, count=33)
-
-                # Verificación de errores en lectura y almacenamiento en BD
-                if response1.isError():
-                    log.error(f"Error Modbus: {response1}")
-                if response2.isError():
-                    log.error(f"Error Modbus: {response2}")
-                if response3.isError():
-                    log.error(f"Error Modbus: {response3}")
-                if response4.isError():
-                    log.error(f"Error Modbus: {response4}")
-                else:
-                    insert_data(conn, response1.registers, "apis2_pb")
-                    insert_data(conn, response2.registers, "apis2_li")
-                    insert_data(conn, response3.registers, "apis2_rdx")
-                    insert_data(conn, response4.registers, "apis2_sc")
-
-                time.sleep(1)  # Intervalo de lectura (1000ms)
-
-            except (InterfaceError, OperationalError) as db_error:
-                log.error(f"Error en la lectura/inserción. PostgreSQL podría estar caído: {db_error}")
-                conn = None  # Fuerza reconexión
-                time.sleep(5)
+                # Lectura de registros Modbus; las cuatro muestras comparten el
+                # instante de adquisición del ciclo. Cada dispositivo gestiona su
+                # propia reconexión y los que están en falla se omiten sin bloquear
+                timestamp = datetime.now()
+                results = run_all(executor, [
+                    lambda device=device, plan=plan: list(plan.execute(device))
+                    for device, plan in reads
+                ])
+
+                # Solo se almacenan las lecturas exitosas de cada dispositivo
+                for frames in results:
+                    for block, registers in frames:
+                        if registers is not None:
+                            sink.add_frame(block, timestamp, registers)
+
+                # Vacía el buffer si se alcanzó el límite de latencia (o lo pasa
+                # al spool si PostgreSQL no está disponible)
+                sink.maybe_flush()
+                error_backoff.reset()
+
+                scheduler.wait()  # Espera al siguiente plazo (1000 ms)
+
             except Exception as e:
                 log.error(f"Error inesperado: {e}")
-                time.sleep(5)
+                time.sleep(error_backoff.next_delay())
+                scheduler.reset()
 
     except KeyboardInterrupt:
         log.info("Deteniendo el script...")
+        log.info(f"Estadísticas de muestreo: {scheduler.stats.summary()}")
+        for device, plan in reads:
+            log.info(f"Lecturas Modbus {device.name}: {plan.stats.summary()}")
+        for burst in bursts:
+            log.info(f"Captura en ráfaga {burst.device.name}: {burst.summary()}")
+        if recorder is not None:
+            log.info(f"Eventos en ráfaga: {recorder.summary()}")
+        if deadband is not None:
+            log.info(f"Registro por excepción: {deadband.summary()}")
 
     finally:
-        # Cierre de conexiones al salir
-        apis2_pb.close()
-        apis2_li.close()
-        apis2_rdx.close()
-        apis2_sc.close()
-        if conn and not conn.closed:
-            conn.close()
+        # Vaciado final del buffer (a PostgreSQL o al spool) y cierre de conexiones al salir
+        if writer_thread is not None:
+            writer_thread.stop(timeout=30)
+        else:
+            writer.close()
+        if drainer is not None:
+            drainer.stop(timeout=30)
+            spool.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for burst in bursts:
+            burst.stop(timeout=5)
+        if recorder is not None:
+            recorder.stop(timeout=30)
+        for device in devices:
+            device.close()
+        metrics_exporter.stop()
         log.info("Conexiones cerradas")
 
 if __name__ == "__main__":
@@ -1,25 +1,33 @@
 #!/usr/bin/env python3.12
 
 # Importación de librerías necesarias
-from pymodbus.client import ModbusTcpClient         # Cliente Modbus TCP para comunicarse con el dispositivo
 import psycopg2                                     # Conector para PostgreSQL
-from psycopg2 import OperationalError, InterfaceError
 from datetime import datetime                       # Para obtener la fecha y hora actual
 import time                                         # Para controlar los intervalos de muestreo
 import logging                                      # Para registro de eventos e información de depuración
-import json                                         # Para leer archivos de configuración en formato JSON
+import os                                           # Para construir rutas de archivos
+from scada_config import load_config, CONFIG_FILE   # Configuración compartida con los respaldos
+from db_writer import BufferedWriter                # Escritura en bloque con COPY
+from scheduler import DeadlineScheduler             # Ciclos sobre plazos absolutos
+from device_manager import ModbusDevice, Backoff    # Conexión Modbus por dispositivo con backoff
+from register_map import load_register_map          # Decodificación declarativa de registros
+from spool import Spool, SpoolDrainer               # Cola en disco ante caídas de PostgreSQL
+from pipeline import FrameQueue, WriterThread       # Adquisición y escritura en hilos separados
+from rollup import Rollups                          # Agregados de 1 s, 1 min y 15 min
+from deadband import DeadbandFilter                 # Registro por excepción
+from read_planner import ReadPlan                   # Peticiones Modbus mínimas por ciclo
+from burst import BurstRecorder, start_bursts       # Captura en ráfaga alrededor de eventos
+import metrics                                      # Métricas en formato Prometheus
 
 # Configuración básica de logging
 logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.INFO)
 
-# Ruta al archivo de configuración externo (JSON)
-CONFIG_FILE = '/home/administrador/scripts/config.json'
-
-# Carga de configuración desde archivo JSON
-with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
+# Carga de configuración desde archivo JSON (ruta en scada_config.py; la
+# variable de entorno SCADA_CONFIG permite usar otro archivo, por ejemplo,
+# desde benchmark.py)
+config = load_config()
 
 # Configuración de conexión a la base de datos PostgreSQL
 DB_CONFIG = {
@@ -33,6 +41,69 @@ DB_CONFIG = {
 MODBUS_IP_APIS3 = config['modbus_ip_apis3']
 MODBUS_PORT = config['modbus_port']
 
+# Tolerancia a fallas: timeout Modbus (s), fallos consecutivos que abren el
+# circuito de un dispositivo y límites del backoff exponencial (s)
+MODBUS_TIMEOUT = config.get('modbus_timeout', 3)
+DEVICE_FAILURE_THRESHOLD = config.get('device_failure_threshold', 3)
+BACKOFF_BASE = config.get('backoff_base', 0.5)
+BACKOFF_MAX = config.get('backoff_max', 30)
+
+# Periodo de muestreo (s), política ante ciclos excedidos ('skip' o 'catchup')
+# y segundos entre resúmenes de jitter en el log
+SAMPLE_PERIOD = config.get('period_apis3', 0.5)
+SCHEDULE_POLICY = config.get('schedule_policy', 'skip')
+JITTER_REPORT_INTERVAL = config.get('jitter_report_interval', 60)
+
+# Spool en disco para no perder muestras si PostgreSQL no está disponible
+# (spool_dir = null lo desactiva; cada proceso usa su subdirectorio, aquí
+# 'apis3'), uso máximo de disco y registros por segmento
+SPOOL_DIR = config.get('spool_dir', os.path.join(os.path.dirname(CONFIG_FILE), 'spool'))
+SPOOL_MAX_BYTES = config.get('spool_max_bytes', 1024 ** 3)
+SPOOL_SEGMENT_RECORDS = config.get('spool_segment_records', 10000)
+
+# Modo en tubería: la adquisición encola las lecturas y un hilo escritor las
+# guarda; capacidad de la cola y política ante cola llena ('block', 'drop_oldest' o 'spill')
+PIPELINED = config.get('pipelined', False)
+QUEUE_MAX_FRAMES = config.get('queue_max_frames', 300)
+QUEUE_OVERFLOW_POLICY = config.get('queue_overflow_policy', 'spill')
+
+# Actualización de las tablas de agregados en cada escritura (ver rollup.py)
+ROLLUP_ON_WRITE = config.get('rollup_on_write', False)
+
+# Registro por excepción: solo se guardan las lecturas que cambiaron más que la
+# tolerancia de algún campo, o una fila cada 'deadband_heartbeat' segundos
+DEADBAND = config.get('deadband', False)
+DEADBAND_HEARTBEAT = config.get('deadband_heartbeat', 60.0)
+
+# Plan de lecturas Modbus (ver read_planner.py): solo los registros usados por
+# los campos, uniendo rangos cuando el hueco cuesta menos que una petición
+# ('read_request_cost', en registros) y sin leer fuera de los bloques declarados
+READ_PLANNER = config.get('read_planner', False)
+READ_REQUEST_COST = config.get('read_request_cost', 32)
+READ_BRIDGE_UNMAPPED = config.get('read_bridge_unmapped', False)
+
+# Captura en ráfaga (ver burst.py): los bloques con 'burst' en el mapa de
+# registros se leen también a la máxima tasa del equipo ('burst_period' > 0 la
+# limita) y se guardan las ventanas alrededor de cada disparo en '<tabla>_event'
+BURST = config.get('burst', False)
+BURST_PERIOD = config.get('burst_period', 0.0)
+BURST_CAPACITY = config.get('burst_capacity', 4096)
+
+# Almacenamiento como tramas de registros (ver raw_frames.py): cada lectura se
+# escribe sin decodificar en '<tabla>_raw' y la vista '<tabla>' la decodifica
+RAW_FRAMES = config.get('raw_frames', False)
+
+# Límites del buffer de escritura (filas, bytes y segundos de espera)
+BATCH_MAX_ROWS = config.get('batch_max_rows', 40)
+BATCH_MAX_BYTES = config.get('batch_max_bytes', 1024 * 1024)
+BATCH_MAX_LATENCY = config.get('batch_max_latency', 5.0)
+
+# Mapa de registros: dispositivos, bloques, campos y escalas (register_map.json)
+REGISTER_MAP_FILE = config.get('register_map_file',
+                               os.path.join(os.path.dirname(CONFIG_FILE), 'register_map.json'))
+REGISTER_MAP = load_register_map(REGISTER_MAP_FILE)
+APIS3_BLOCKS = REGISTER_MAP['apis3']
+
 def connect_postgres():
     """
     Intenta establecer conexión a PostgreSQL.
@@ -46,93 +117,106 @@ def connect_postgres():
         log.error(f"Error al conectar a PostgreSQL: {e}")
         return None
 
-def insert_data(conn, registers, tab):
-    """
-    Inserta datos leídos de Modbus en la tabla especificada de PostgreSQL.
-    
-    :param conn: conexión activa a la base de datos
-    :param registers: lista de registros Modbus leídos
-    :param tab: nombre de la tabla destino
-    """
-    try:
-        timestamp = datetime.now()
-            
-        # Construcción de la consulta SQL y transformación de los datos según la tabla
-        if tab in ("apis3_motor1", "apis3_motor2"):
-            insert_query = f"""
-            INSERT INTO {tab} (timestamp, Estado_OP_motor, Piloto_filtro, Piloto_exp_gases, Estado_conex, Presion_aceite, Temp_refrigerante, Temp_aceite, Consumo_combustible, Nivel_combustible, V_carga_alternador, V_bat_arranque, Vel_giro_motor, Freq_giro_gen, Compen_I_gen, Fase_rot_gen, Freq_giro_suministro, Compen_I_suministro, Fase_rot_suministro, Freq, Flag_0, Flag_2, V_gen_L1_N, V_gen_L2_N, V_gen_L3_N, V_gen_L1_L2, V_gen_L2_L3, V_gen_L3_L1, I_gen_L1_N, I_gen_L2_N, I_gen_L3_N, I_tierra_gen, P_gen_L1, P_gen_L2, P_gen_L3, V_suministro_L1_N, V_suministro_L2_N, V_suministro_L3_N, V_suministro_L1_L2, V_suministro_L2_L3, V_suministro_L3_L1, I_suministro_L1, I_suministro_L2, I_suministro_L3, I_tierra_suministro, P_suministro_L1, P_suministro_L2, P_suministro_L3, P_Total)
-            VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """
-
-            data = (timestamp, registers[0], registers[1], registers[2], registers[3], registers[4], registers[5], registers[6], registers[7], registers[8], registers[9]/100, registers[10]/100, registers[11], registers[12]/100, registers[13], registers[14], registers[15]/100, registers[16], registers[17], registers[18]/100, registers[19], registers[20], registers[21]/100, registers[23]/100, registers[25]/100, registers[27]/100, registers[29]/100, registers[31]/100, registers[33]/100, registers[35]/100, registers[37]/100, registers[39]/100, registers[41], registers[43], registers[45], registers[47]/100, registers[49]/100, registers[51]/100, registers[53]/100, registers[55]/100, registers[57]/100, registers[59]/100, registers[61]/100, registers[63]/100, registers[65], registers[67], registers[69], registers[71], registers[73])
-
-        # Ejecuta la consulta y guarda los cambios
-        with conn.cursor() as cursor:
-            cursor.execute(insert_query, data)
-        conn.commit()
-    except (InterfaceError, OperationalError) as e:
-        log.error(f"Conexión perdida al insertar en {tab}: {e}")
-        raise
-    except Exception as e:
-        log.error(f"Error general al insertar en {tab}: {e}")
-
-
 def main():
     """
     Función principal que controla el ciclo de lectura e inserción continua.
     """
-    conn = connect_postgres()
-    # Configuración del cliente Modbus
-    apis3 = ModbusTcpClient(host=MODBUS_IP_APIS3, port=MODBUS_PORT, timeout=3)
+    # Métricas por HTTP ('metrics_ports') y/o archivo de texto ('metrics_dir')
+    metrics_exporter = metrics.exporter(config, "apis3").start()
+    scheduler = DeadlineScheduler(SAMPLE_PERIOD, policy=SCHEDULE_POLICY,
+                                  report_every=JITTER_REPORT_INTERVAL, name="APIS3")
+    # El escritor gestiona su conexión a PostgreSQL y, si no está disponible,
+    # guarda las lecturas en el spool; el drainer las carga al volver la conexión
+    tables = {block.table: block for block in APIS3_BLOCKS}
+    spool = Spool(os.path.join(SPOOL_DIR, 'apis3'), max_bytes=SPOOL_MAX_BYTES,
+                  segment_records=SPOOL_SEGMENT_RECORDS, tables=tables) if SPOOL_DIR else None
+    rollups = Rollups(tables) if ROLLUP_ON_WRITE else None
+    writer = BufferedWriter(max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES,
+                            max_latency=BATCH_MAX_LATENCY, connect=connect_postgres, spool=spool,
+                            backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX), rollups=rollups,
+                            raw_frames=RAW_FRAMES)
+    drainer = None
+    if spool is not None:
+        drainer = SpoolDrainer(spool, tables, connect_postgres,
+                               backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX), rollups=rollups,
+                               raw_frames=RAW_FRAMES)
+        drainer.start()
+    # Configuración del dispositivo Modbus
+    apis3 = ModbusDevice("APIS3", MODBUS_IP_APIS3, MODBUS_PORT, timeout=MODBUS_TIMEOUT,
+                         failure_threshold=DEVICE_FAILURE_THRESHOLD,
+                         backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX))
+    plan = ReadPlan(APIS3_BLOCKS, coalesce=READ_PLANNER, request_cost=READ_REQUEST_COST,
+                    bridge_unmapped=READ_BRIDGE_UNMAPPED)
+    log.info(f"Plan de lectura APIS3: {plan.describe()}")
+    error_backoff = Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)
+
+    # En modo tubería el bucle entrega las lecturas a la cola en lugar del escritor
+    sink, writer_thread = writer, None
+    if PIPELINED:
+        sink = FrameQueue(QUEUE_MAX_FRAMES, policy=QUEUE_OVERFLOW_POLICY, spool=spool, name="APIS3")
+        writer_thread = WriterThread(sink, writer, report_every=JITTER_REPORT_INTERVAL,
+                                     name="APIS3-writer")
+        writer_thread.start()
+    deadband = None
+    if DEADBAND:
+        sink = deadband = DeadbandFilter(sink, heartbeat=DEADBAND_HEARTBEAT)
+
+    # Captura en ráfaga con conexiones Modbus propias; los eventos van a sus tablas
+    recorder, bursts = None, []
+    if BURST:
+        recorder = BurstRecorder(connect_postgres, backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX))
+        recorder.start()
+        bursts = start_bursts({'apis3': APIS3_BLOCKS}, lambda name: ModbusDevice(
+            f"{name.upper()}_BURST", MODBUS_IP_APIS3, MODBUS_PORT, timeout=MODBUS_TIMEOUT,
+            failure_threshold=DEVICE_FAILURE_THRESHOLD, backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)),
+            recorder, period=BURST_PERIOD, capacity=BURST_CAPACITY)
 
     try:
         while True:
-            # Reintenta conexión a PostgreSQL si se perdió
-            if conn is None or conn.closed:
-                log.warning("Conexión a PostgreSQL cerrada, intentando reconectar...")
-                conn = connect_postgres()
-                if conn is None:
-                    time.sleep(5)
-                    continue
-
-            # Verifica la conexión Modbus antes de leer
-            if not apis3.connect():
-                log.error("No se pudo conectar al dispositivo Modbus")
-                time.sleep(5)
-                continue
-
             try:
-                # Leer registros Modbus
-                response1 = apis3.read_holding_registers(address=0, count=74)
-                response2 = apis3.read_holding_registers(address=94, count=74)
-
-                if response1.isError():
-                    log.error(f"Error Modbus: {response1}")
-                if response2.isError():
-                    log.error(f"Error Modbus: {response2}")
-                else:
-                    insert_data(conn, response1.registers, "apis3_motor1")
-                    insert_data(conn, response2.registers, "apis3_motor2")
-
-                time.sleep(0.5357)    # Intervalo de lectura (1000ms)
-
-            except (InterfaceError, OperationalError) as db_error:
-                log.error(f"Error en la lectura/inserción. PostgreSQL podría estar caído: {db_error}")
-                conn = None  # Fuerza reconexión
-                time.sleep(5)
+                # Leer registros Modbus según el plan; un bloque fallido se descarta sin afectar al otro
+                for block, registers in plan.execute(apis3):
+                    if registers is not None:
+                        sink.add_frame(block, datetime.now(), registers)
+
+                # Vacía el buffer si se alcanzó el límite de latencia (o lo pasa
+                # al spool si PostgreSQL no está disponible)
+                sink.maybe_flush()
+                error_backoff.reset()
+
+                scheduler.wait()    # Espera al siguiente plazo (500 ms)
+
             except Exception as e:
                 log.error(f"Error inesperado: {e}")
-                time.sleep(5)
+                time.sleep(error_backoff.next_delay())
+                scheduler.reset()
 
     except KeyboardInterrupt:
         log.info("Deteniendo el script...")
+        log.info(f"Estadísticas de muestreo: {scheduler.stats.summary()}")
+        log.info(f"Lecturas Modbus: {plan.stats.summary()}")
+        for burst in bursts:
+            log.info(f"Captura en ráfaga {burst.device.name}: {burst.summary()}")
+        if recorder is not None:
+            log.info(f"Eventos en ráfaga: {recorder.summary()}")
+        if deadband is not None:
+            log.info(f"Registro por excepción: {deadband.summary()}")
 
     finally:
-        # Cierre de conexiones al salir
+        # Vaciado final del buffer (a PostgreSQL o al spool) y cierre de conexiones al salir
+        if writer_thread is not None:
+            writer_thread.stop(timeout=30)
+        else:
+            writer.close()
+        if drainer is not None:
+            drainer.stop(timeout=30)
+            spool.close()
+        for burst in bursts:
+            burst.stop(timeout=5)
+        if recorder is not None:
+            recorder.stop(timeout=30)
         apis3.close()
-        if conn and not conn.closed:
-            conn.close()
+        metrics_exporter.stop()
         log.info("Conexiones cerradas")
 
 if __name__ == "__main__":
@@ -0,0 +1,642 @@
+#!/usr/bin/env python3.12
+
+# Almacenamiento en frío de las lecturas antiguas. Las filas de las tablas de
+# captura con más de 'cold_age_days' días se mueven a archivos de segmento
+# columnares comprimidos, uno por tabla y día, y se eliminan de PostgreSQL, de
+# modo que la base, sus respaldos y sus restauraciones solo cargan los datos
+# recientes. Los segmentos se leen por rango de tiempo (ColdStore.read o
+# 'cold_storage.py read') o se vuelven a cargar en PostgreSQL cuando se
+# necesitan ('cold_storage.py import').
+#
+# Formato de un segmento (<cold_dir>/<tabla>/<tabla>-AAAAMMDD[-n].col):
+#   firma | grupos de filas | índice (JSON) | largo del índice (uint64) | firma
+# Cada grupo guarda hasta 'cold_chunk_rows' filas columna por columna, cada
+# columna comprimida por separado. Los valores se guardan como enteros: los
+# instantes en microsegundos y los campos escalados multiplicados por su
+# divisor del mapa de registros (el valor crudo del registro), codificados
+# como diferencias entre filas consecutivas en el entero más angosto que las
+# contiene (8, 16, 32 o 64 bits), que la compresión reduce a casi nada en las
+# señales lentas. Una columna con algún valor que no es exacto con su escala
+# se guarda como double. El índice registra, por grupo, el primer y el último
+# instante, las filas y la ubicación de cada columna: leer un rango solo
+# descomprime los grupos y las columnas necesarios.
+
+import io                                           # Buffer en memoria para COPY
+import os
+import re
+import sys
+import csv
+import gzip
+import json
+import math
+import time
+import heapq                                        # Mezcla ordenada de los segmentos de un mismo día
+import struct
+import argparse
+import itertools
+import logging                                      # Para registro de eventos e información de depuración
+from array import array                             # Columnas como arreglos de enteros o doubles
+from datetime import datetime, timedelta
+from scada_config import load_config, capture_blocks, format_bytes, CONFIG_FILE
+from backup_dbscada import write_metrics
+from incremental_backup import connect_config, parse_compression
+from spool import EPOCH, ONE_MICROSECOND
+from db_writer import copy_line
+
+try:
+    import zstandard                                # Compresión zstd (opcional)
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame                                # Compresión lz4 (opcional)
+except ImportError:
+    lz4 = None
+
+log = logging.getLogger()
+
+SEGMENT_MAGIC = b'SCADACOL'
+TRAILER = struct.Struct('<Q8s')     # Largo del índice y firma, al final del segmento
+SEGMENT_SUFFIX = '.col'
+FORMAT_VERSION = 1
+SEGMENT_NAME = re.compile(r'^(.+)-(\d{8})(?:-\d+)?\.col$')
+
+DEFAULT_CHUNK_ROWS = 65536
+DEFAULT_AGE_DAYS = 365
+
+# Tipos de arreglo para las diferencias, del más angosto al más ancho, con su límite
+DELTA_TYPES = (('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63))
+
+# Codificación de una columna
+ENCODING_DELTA = 'delta'        # Enteros crudos como diferencias sucesivas
+ENCODING_FLOAT = 'float'        # Doubles sin transformar
+
+
+def to_micros(ts):
+    return (ts - EPOCH) // ONE_MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def compress(data, method, level=None):
+    if method == 'gzip':
+        return gzip.compress(data, compresslevel=level or 6)
+    if method == 'zstd':
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    if method == 'lz4':
+        return lz4.frame.compress(data, compression_level=level or 0)
+    return data
+
+
+def decompress(data, method):
+    if method == 'gzip':
+        return gzip.decompress(data)
+    if method == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if method == 'lz4':
+        return lz4.frame.decompress(data)
+    return data
+
+
+def _to_bytes(values):
+    # Los segmentos se escriben siempre en little-endian
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _integers(values, divisor):
+    """
+    Valores de la columna como enteros crudos, o None si alguno no se
+    recupera exactamente al dividirlo por la escala. Los nulos repiten el
+    valor anterior (diferencia cero).
+    """
+    integers = []
+    previous = 0
+    for value in values:
+        if value is None:
+            integers.append(previous)
+            continue
+        if isinstance(value, datetime):
+            raw = to_micros(value)
+        elif isinstance(value, float) and not math.isfinite(value):
+            return None
+        elif divisor:
+            raw = round(value * divisor)
+            if raw / divisor != value:
+                return None
+        elif isinstance(value, float) and not value.is_integer():
+            return None
+        else:
+            raw = int(value)
+        integers.append(raw)
+        previous = raw
+    return integers
+
+
+def encode_column(values, divisor=None):
+    """
+    Codifica una columna de un grupo de filas.
+
+    :param values: valores de la columna (instantes, números o None)
+    :param divisor: divisor de escala del campo en el mapa de registros (None sin escala)
+    :return: (descriptor, bytes sin comprimir)
+    """
+    nulls = [i for i, value in enumerate(values) if value is None]
+    integers = _integers(values, divisor)
+    if integers is not None:
+        deltas = [b - a for a, b in zip(integers, integers[1:])]
+        low, high = (min(deltas), max(deltas)) if deltas else (0, 0)
+        typecode = next((code for code, limit in DELTA_TYPES if -limit <= low and high < limit), None)
+        if typecode is not None:
+            return ({'encoding': ENCODING_DELTA, 'type': typecode, 'first': integers[0], 'nulls': nulls},
+                    _to_bytes(array(typecode, deltas)))
+    data = array('d', (math.nan if value is None else float(value) for value in values))
+    return {'encoding': ENCODING_FLOAT, 'nulls': nulls}, _to_bytes(data)
+
+
+def decode_column(descriptor, data, divisor=None, timestamps=False):
+    """
+    Decodifica una columna de un grupo de filas (inversa de encode_column).
+
+    :param timestamps: True para la columna de instantes
+    :return: lista de valores
+    """
+    if descriptor['encoding'] == ENCODING_FLOAT:
+        values = _from_bytes('d', data).tolist()
+    else:
+        values = list(itertools.accumulate(_from_bytes(descriptor['type'], data), initial=descriptor['first']))
+        if timestamps:
+            values = [from_micros(value) for value in values]
+        elif divisor:
+            values = [value / divisor for value in values]
+    for i in descriptor['nulls']:
+        values[i] = None
+    return values
+
+
+class SegmentWriter:
+    """
+    Escritura de un segmento columnar. Las filas deben llegar ordenadas por
+    instante, con el instante en la primera columna.
+    """
+
+    def __init__(self, path, table, columns, divisors, compression='gzip', chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        :param path: ruta del archivo
+        :param table: tabla de origen
+        :param columns: nombres de las columnas ('timestamp' primero)
+        :param divisors: divisor de escala de cada columna (None sin escala)
+        :param compression: 'método[:nivel]' de compresión de cada columna
+        :param chunk_rows: filas por grupo
+        """
+        self.path = path
+        self.method, self.level = parse_compression(compression)
+        self.divisors = list(divisors)
+        self.chunk_rows = chunk_rows
+        self.index = {'version': FORMAT_VERSION, 'table': table, 'columns': list(columns),
+                      'divisors': self.divisors, 'compression': self.method, 'rows': 0, 'chunks': []}
+        self._pending = []
+        self._file = open(path, 'wb')
+        self._file.write(SEGMENT_MAGIC)
+
+    @property
+    def rows(self):
+        return self.index['rows'] + len(self._pending)
+
+    def write(self, rows):
+        self._pending.extend(rows)
+        while len(self._pending) >= self.chunk_rows:
+            self._write_chunk(self._pending[:self.chunk_rows])
+            del self._pending[:self.chunk_rows]
+
+    def _write_chunk(self, rows):
+        chunk = {'rows': len(rows), 'start': to_micros(rows[0][0]), 'end': to_micros(rows[-1][0]), 'columns': []}
+        for values, divisor in zip(zip(*rows), self.divisors):
+            descriptor, data = encode_column(values, divisor)
+            data = compress(data, self.method, self.level)
+            descriptor.update(offset=self._file.tell(), size=len(data))
+            self._file.write(data)
+            chunk['columns'].append(descriptor)
+        self.index['chunks'].append(chunk)
+        self.index['rows'] += len(rows)
+
+    def close(self):
+        """
+        Escribe el último grupo y el índice, y sincroniza el archivo con el disco.
+        """
+        if self._pending:
+            self._write_chunk(self._pending)
+            self._pending = []
+        index = json.dumps(self.index, separators=(',', ':')).encode()
+        self._file.write(index)
+        self._file.write(TRAILER.pack(len(index), SEGMENT_MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        """
+        Cierra y elimina el archivo incompleto.
+        """
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SegmentReader:
+    """
+    Lectura de un segmento columnar a partir de su índice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"{path} no es un segmento columnar")
+            f.seek(-TRAILER.size, os.SEEK_END)
+            length, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"{path}: segmento incompleto (sin índice)")
+            f.seek(-TRAILER.size - length, os.SEEK_END)
+            self.index = json.loads(f.read(length))
+        self.table = self.index['table']
+        self.columns = tuple(self.index['columns'])
+        self.divisors = self.index['divisors']
+        self.rows = self.index['rows']
+        chunks = self.index['chunks']
+        self.start = from_micros(chunks[0]['start']) if chunks else None
+        self.end = from_micros(chunks[-1]['end']) if chunks else None
+        self.size = os.path.getsize(path)
+
+    def read(self, start=None, end=None, columns=None):
+        """
+        Filas del segmento con instante en [start, end), en orden.
+
+        :param columns: columnas a leer además del instante (None lee todas)
+        :return: generador de tuplas (instante, valores...)
+        """
+        wanted = [0] + [self.columns.index(c) for c in columns if c != self.columns[0]] if columns \
+            else list(range(len(self.columns)))
+        low = to_micros(start) if start else None
+        high = to_micros(end) if end else None
+        with open(self.path, 'rb') as f:
+            for chunk in self.index['chunks']:
+                # Índice de tiempo: se omiten los grupos fuera del rango
+                if (low is not None and chunk['end'] < low) or (high is not None and chunk['start'] >= high):
+                    continue
+                values = []
+                for i in wanted:
+                    descriptor = chunk['columns'][i]
+                    f.seek(descriptor['offset'])
+                    data = decompress(f.read(descriptor['size']), self.index['compression'])
+                    values.append(decode_column(descriptor, data, self.divisors[i], timestamps=i == 0))
+                for row in zip(*values):
+                    if (start and row[0] < start) or (end and row[0] >= end):
+                        continue
+                    yield row
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+class ColdStore:
+    """
+    Directorio de segmentos en frío: exportación desde las tablas de captura,
+    lectura por rango y carga de vuelta en PostgreSQL.
+    """
+
+    def __init__(self, directory, compression='gzip', chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        :param directory: directorio raíz de los segmentos (un subdirectorio por tabla)
+        :param compression: 'método[:nivel]' de compresión de los segmentos nuevos
+        :param chunk_rows: filas por grupo de los segmentos nuevos
+        """
+        self.directory = directory
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        parse_compression(compression)
+
+    def segments(self, table, start=None, end=None):
+        """
+        Segmentos de la tabla que pueden tener filas en [start, end), por día.
+
+        :return: lista de SegmentReader
+        """
+        directory = os.path.join(self.directory, table)
+        if not os.path.isdir(directory):
+            return []
+        readers = []
+        for name in sorted(os.listdir(directory)):
+            match = SEGMENT_NAME.match(name)
+            if match is None or match.group(1) != table:
+                continue
+            day = datetime.strptime(match.group(2), '%Y%m%d')
+            if (end and day >= end) or (start and day + timedelta(days=1) <= start):
+                continue
+            readers.append(SegmentReader(os.path.join(directory, name)))
+        return readers
+
+    def read(self, table, start=None, end=None, columns=None):
+        """
+        Filas de la tabla con instante en [start, end), en orden. Los
+        segmentos adicionales de un mismo día (filas llegadas después de
+        exportarlo) se mezclan por instante; un instante repetido se entrega
+        una sola vez.
+
+        :return: generador de tuplas (instante, valores...)
+        """
+        rows = heapq.merge(*(reader.read(start, end, columns) for reader in self.segments(table, start, end)),
+                           key=lambda row: row[0])
+        last = None
+        for row in rows:
+            if row[0] != last:
+                last = row[0]
+                yield row
+
+    def _segment_path(self, table, day):
+        directory = os.path.join(self.directory, table)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{table}-{day:%Y%m%d}{SEGMENT_SUFFIX}")
+        n = 0
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(directory, f"{table}-{day:%Y%m%d}-{n}{SEGMENT_SUFFIX}")
+        return path
+
+    def export(self, conn, block, cutoff):
+        """
+        Mueve a segmentos las filas de la tabla del bloque anteriores a
+        ``cutoff``, un segmento por día. Cada día se exporta y se elimina en
+        una única transacción REPEATABLE READ: el DELETE ve la misma
+        instantánea que la lectura, de modo que solo elimina las filas
+        escritas en el segmento. El segmento se renombra antes de confirmar;
+        si el proceso se interrumpe entre ambos pasos, la siguiente exportación
+        repite esas filas en otro segmento del día y la lectura las descarta.
+
+        :param conn: conexión psycopg2 dedicada (se cambia su nivel de aislamiento)
+        :param block: bloque compilado de la tabla (columnas y escalas)
+        :param cutoff: instante límite (exclusivo)
+        :return: diccionario con 'rows', 'bytes', 'raw_bytes' y 'segments'
+        """
+        table = block.table
+        columns = ', '.join(block.columns)
+        divisors = [None] + [f.divisor for f in block.fields]
+        stats = {'rows': 0, 'bytes': 0, 'raw_bytes': 0, 'segments': 0}
+        conn.set_session(isolation_level='REPEATABLE READ')
+        day = self._next_day(conn, table, None, cutoff)
+        while day is not None:
+            end = min(day + timedelta(days=1), cutoff)
+            path = self._segment_path(table, day)
+            writer = SegmentWriter(f"{path}.tmp", table, block.columns, divisors,
+                                   compression=self.compression, chunk_rows=self.chunk_rows)
+            try:
+                with conn.cursor(name=f"cold_{table}") as cursor:
+                    cursor.itersize = self.chunk_rows
+                    cursor.execute(f"SELECT {columns} FROM {table} "
+                                   f"WHERE timestamp >= %s AND timestamp < %s ORDER BY timestamp", (day, end))
+                    while batch := cursor.fetchmany(self.chunk_rows):
+                        writer.write(batch)
+                rows = writer.rows
+                with conn.cursor() as cursor:
+                    # Tamaño aproximado en la tabla: una fila (más su cabecera) por la cantidad
+                    cursor.execute(f"SELECT pg_column_size(t.*) + 28 FROM {table} t "
+                                   f"WHERE timestamp >= %s AND timestamp < %s LIMIT 1", (day, end))
+                    row_size = cursor.fetchone()[0]
+                    cursor.execute(f"DELETE FROM {table} WHERE timestamp >= %s AND timestamp < %s", (day, end))
+                    if cursor.rowcount != rows:
+                        raise RuntimeError(f"{table} {day:%Y-%m-%d}: se exportaron {rows} filas "
+                                           f"pero se eliminarían {cursor.rowcount}")
+                size = writer.close()
+                os.replace(writer.path, path)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                writer.abort()
+                raise
+            stats['rows'] += rows
+            stats['bytes'] += size
+            stats['raw_bytes'] += rows * row_size
+            stats['segments'] += 1
+            log.info(f"{table} {day:%Y-%m-%d}: {rows} filas en {os.path.basename(path)} ({format_bytes(size)})")
+            day = self._next_day(conn, table, end, cutoff)
+        return stats
+
+    def _next_day(self, conn, table, after, cutoff):
+        """
+        Día de la primera fila en [after, cutoff), o None si no hay más filas que exportar.
+        """
+        with conn.cursor() as cursor:
+            if after is None:
+                cursor.execute(f"SELECT min(timestamp) FROM {table} WHERE timestamp < %s", (cutoff,))
+            else:
+                cursor.execute(f"SELECT min(timestamp) FROM {table} WHERE timestamp >= %s AND timestamp < %s",
+                               (after, cutoff))
+            first = cursor.fetchone()[0]
+        conn.rollback()
+        return datetime(first.year, first.month, first.day) if first is not None else None
+
+    def restore(self, conn, table, start=None, end=None, into=None):
+        """
+        Carga en PostgreSQL las filas de los segmentos con instante en
+        [start, end), omitiendo los instantes que ya están en la tabla destino.
+        Por defecto van a ``<tabla>_cold`` (creada con la estructura de la
+        tabla de captura si no existe), para consultarlas sin que la siguiente
+        exportación las vuelva a mover. Con ``into`` igual a la tabla de
+        captura las filas vuelven a la base de forma permanente: el rango debe
+        cubrir los segmentos completos, que se eliminan al confirmar.
+
+        :return: filas insertadas
+        """
+        into = into or f"{table}_cold"
+        readers = self.segments(table, start, end)
+        if not readers:
+            return 0
+        permanent = into == table
+        if permanent:
+            partial = [os.path.basename(r.path) for r in readers
+                       if (start and r.start < start) or (end and r.end >= end)]
+            if partial:
+                raise ValueError(f"El rango no cubre por completo los segmentos {', '.join(partial)}")
+        columns = ', '.join(readers[0].columns)
+        staging = f"cold_{table}"
+        first = last = None
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {into} (LIKE {table} INCLUDING DEFAULTS)")
+            cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+            for batch in _batches(self.read(table, start, end), self.chunk_rows):
+                first = first or batch[0][0]
+                last = batch[-1][0]
+                cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN",
+                                   io.StringIO(''.join(copy_line(row) for row in batch)))
+            inserted = 0
+            if first is not None:
+                cursor.execute(f"""
+                    INSERT INTO {into} ({columns})
+                    SELECT {columns} FROM {staging} s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {into} t
+                        WHERE t.timestamp = s.timestamp AND t.timestamp BETWEEN %s AND %s
+                    )
+                    ORDER BY s.timestamp
+                """, (first, last))
+                inserted = cursor.rowcount
+        conn.commit()
+        if permanent:
+            for reader in readers:
+                os.remove(reader.path)
+        log.info(f"{inserted} filas de {table} cargadas en {into}")
+        return inserted
+
+
+def store_from_config(config):
+    """
+    Almacén configurado desde config.json: ``cold_dir`` (por defecto, 'cold'
+    junto a config.json), ``cold_compression`` y ``cold_chunk_rows``.
+    """
+    return ColdStore(config.get('cold_dir', os.path.join(os.path.dirname(CONFIG_FILE), 'cold')),
+                     compression=config.get('cold_compression', 'gzip'),
+                     chunk_rows=config.get('cold_chunk_rows', DEFAULT_CHUNK_ROWS))
+
+
+def export_tables(config, store, tables, age_days):
+    """
+    Mueve a segmentos las filas anteriores a la medianoche de hace ``age_days`` días.
+
+    :return: diccionario tabla -> estadísticas de ColdStore.export
+    """
+    blocks = capture_blocks(config)
+    limit = datetime.now() - timedelta(days=age_days)
+    cutoff = datetime(limit.year, limit.month, limit.day)
+    conn = connect_config(config)()
+    try:
+        results = {}
+        for table in tables:
+            start = time.monotonic()
+            results[table] = store.export(conn, blocks[table], cutoff)
+            results[table]['seconds'] = time.monotonic() - start
+        return results
+    finally:
+        conn.close()
+
+
+def print_export_report(results):
+    print(f"{'Tabla':<16} {'Filas':>12} {'Segmentos':>10} {'En tabla':>12} {'En frío':>12}")
+    for table, stats in results.items():
+        print(f"{table:<16} {stats['rows']:>12} {stats['segments']:>10} "
+              f"{format_bytes(stats['raw_bytes']):>12} {format_bytes(stats['bytes']):>12}")
+
+
+def print_segments(store, tables):
+    print(f"{'Segmento':<34} {'Desde':<26} {'Hasta':<26} {'Filas':>10} {'Tamaño':>10} {'B/fila':>7}")
+    for table in tables:
+        for reader in store.segments(table):
+            print(f"{os.path.basename(reader.path):<34} {str(reader.start):<26} {str(reader.end):<26} "
+                  f"{reader.rows:>10} {format_bytes(reader.size):>10} {reader.size / max(reader.rows, 1):>7.2f}")
+
+
+def write_csv(store, table, start, end, columns, output):
+    """
+    Escribe en CSV (con encabezado) las filas de la tabla en [start, end).
+
+    :return: filas escritas
+    """
+    readers = store.segments(table, start, end)
+    writer = csv.writer(output)
+    if readers:
+        writer.writerow([readers[0].columns[0]] + list(columns) if columns else readers[0].columns)
+    rows = 0
+    for row in store.read(table, start, end, columns):
+        writer.writerow((row[0].isoformat(sep=' '),) + row[1:])
+        rows += 1
+    return rows
+
+
+def parse_args(config, tables, argv=None):
+    parser = argparse.ArgumentParser(description="Almacenamiento en frío de las lecturas antiguas de las tablas de captura.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="mueve a segmentos las filas anteriores a la antigüedad configurada")
+    export.add_argument('-t', '--tables', nargs='+', metavar='TABLA', choices=tables, default=tables,
+                        help="tablas a exportar (por defecto, todas las tablas de captura)")
+    export.add_argument('--age-days', type=int, default=config.get('cold_age_days', DEFAULT_AGE_DAYS),
+                        help="días que las filas permanecen en PostgreSQL")
+    listing = commands.add_parser('list', help="muestra los segmentos, su rango de tiempo y su tamaño")
+    listing.add_argument('-t', '--tables', nargs='+', metavar='TABLA', choices=tables, default=tables)
+    for name, description in (('read', "escribe en CSV las filas de un rango de tiempo"),
+                              ('import', "carga en PostgreSQL las filas de un rango de tiempo")):
+        command = commands.add_parser(name, help=description)
+        command.add_argument('table', metavar='TABLA', choices=tables)
+        command.add_argument('--from', dest='start', type=datetime.fromisoformat, help="instante inicial (inclusivo)")
+        command.add_argument('--to', dest='end', type=datetime.fromisoformat, help="instante final (exclusivo)")
+    commands.choices['read'].add_argument('-c', '--columns', nargs='+', help="columnas a leer además del instante")
+    commands.choices['read'].add_argument('-o', '--output', help="archivo CSV de salida (por defecto, la salida estándar)")
+    commands.choices['import'].add_argument('--into', metavar='TABLA',
+                                            help="tabla destino (por defecto <tabla>_cold; la tabla de "
+                                                 "captura devuelve las filas a la base y elimina los segmentos)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+    try:
+        config = load_config()
+        tables = sorted(capture_blocks(config))
+        args = parse_args(config, tables, argv)
+        store = store_from_config(config)
+        if args.command == 'export':
+            start = time.monotonic()
+            try:
+                results = export_tables(config, store, args.tables, args.age_days)
+            except BaseException:
+                write_metrics(config, 'archive', 'columnar', failed=True)
+                raise
+            print_export_report(results)
+            write_metrics(config, 'archive', 'columnar', time.monotonic() - start,
+                          size=sum(stats['bytes'] for stats in results.values()), tables=results)
+        elif args.command == 'list':
+            print_segments(store, args.tables)
+        elif args.command == 'read':
+            if args.output:
+                with open(args.output, 'w', newline='') as f:
+                    rows = write_csv(store, args.table, args.start, args.end, args.columns, f)
+            else:
+                rows = write_csv(store, args.table, args.start, args.end, args.columns, sys.stdout)
+            print(f"{rows} filas de {args.table}", file=sys.stderr)
+        else:
+            conn = connect_config(config)()
+            try:
+                store.restore(conn, args.table, args.start, args.end, into=args.into)
+            finally:
+                conn.close()
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3.12
+
+# Pool de conexiones a PostgreSQL para el supervisor de captura. El escritor y
+# el SpoolDrainer toman sus conexiones del pool en lugar de abrir las propias,
+# de modo que todos los dispositivos comparten un número acotado de backends.
+
+import threading                                    # Sincronización entre hilos
+import logging                                      # Para registro de eventos e información de depuración
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+log = logging.getLogger()
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones, con el mismo contrato que las funciones
+    ``connect_postgres`` de los scripts: ``connect()`` retorna una conexión o
+    None, nunca lanza excepciones. Las conexiones se devuelven con
+    ``release()``; las cerradas o rotas se descartan y las que quedaron en una
+    transacción se revierten antes de reutilizarse.
+    """
+
+    def __init__(self, connect, max_connections=2):
+        """
+        :param connect: función sin argumentos que retorna una conexión nueva o None
+        :param max_connections: conexiones abiertas como máximo (en uso más libres)
+        """
+        self._connect = connect
+        self.max_connections = max_connections
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.opened = 0         # Conexiones abiertas desde el inicio (reconexiones incluidas)
+
+    def connect(self):
+        """
+        Entrega una conexión libre o abre una nueva si no se alcanzó el máximo.
+
+        :return: conexión psycopg2, o None si el pool está agotado o PostgreSQL no responde
+        """
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    self._in_use += 1
+                    return conn
+            if self._in_use >= self.max_connections:
+                log.warning(f"Pool de PostgreSQL agotado ({self.max_connections} conexiones en uso)")
+                return None
+            self._in_use += 1
+        conn = self._connect()
+        with self._lock:
+            if conn is None:
+                self._in_use -= 1
+            else:
+                self.opened += 1
+        return conn
+
+    def release(self, conn):
+        """
+        Devuelve una conexión al pool.
+        """
+        if not conn.closed:
+            status = conn.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                conn.close()
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    conn.close()
+        with self._lock:
+            self._in_use -= 1
+            if not conn.closed:
+                self._idle.append(conn)
+
+    def close(self):
+        """
+        Cierra las conexiones libres. Las que siguen en uso las cierra quien las tiene.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def summary(self):
+        """
+        Resumen legible para el log.
+        """
+        return f"en_uso={self._in_use} libres={len(self._idle)} abiertas={self.opened} maximo={self.max_connections}"
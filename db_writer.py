@@ -0,0 +1,469 @@
+#!/usr/bin/env python3.12
+
+# Escritor con buffer para PostgreSQL compartido por los scripts de captura.
+# En lugar de ejecutar un INSERT y un commit por cada muestra, las filas se
+# acumulan por tabla y se envían en bloque mediante COPY ... FROM STDIN
+# (decodificadas, o como tramas de registros con 'raw_frames', ver raw_frames.py).
+
+import io                                           # Buffer en memoria para COPY
+import time                                         # Para medir la latencia máxima del buffer
+import logging                                      # Para registro de eventos e información de depuración
+from datetime import datetime
+from psycopg2 import OperationalError, InterfaceError
+from backoff import Backoff
+from raw_frames import pack_frame, raw_table, RAW_COLUMNS
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+FLUSH_SECONDS = metrics.histogram('scada_db_flush_seconds', "Duración de cada vaciado (COPY de todas las tablas y commit)")
+DECODE_SECONDS = metrics.histogram('scada_decode_seconds', "Duración de la decodificación por lotes", ('table',))
+ROWS_WRITTEN = metrics.counter('scada_rows_written_total', "Filas escritas en PostgreSQL", ('table',))
+ROWS_SPOOLED = metrics.counter('scada_rows_spooled_total', "Lecturas guardadas en el spool en disco", ('table',))
+ROWS_REJECTED = metrics.counter('scada_rows_rejected_total', "Filas descartadas por errores de datos", ('table',))
+FLUSH_ERRORS = metrics.counter('scada_db_flush_errors_total', "Vaciados fallidos por pérdida de conexión o error de datos", ('reason',))
+DB_CONNECTS = metrics.counter('scada_db_connects_total', "Intentos de conexión a PostgreSQL del escritor", ('result',))
+
+# Límites por defecto para el vaciado del buffer
+DEFAULT_MAX_ROWS = 500              # Filas acumuladas (todas las tablas)
+DEFAULT_MAX_BYTES = 1024 * 1024     # Bytes de texto COPY acumulados
+DEFAULT_MAX_LATENCY = 2.0           # Segundos máximos que una fila espera en memoria
+
+
+def copy_value(value):
+    """
+    Convierte un valor de Python a su representación en formato texto de COPY.
+
+    :param value: valor a convertir (None, número, cadena o datetime)
+    :return: cadena lista para insertarse en una línea de COPY
+    """
+    if value is None:
+        return r'\N'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, bytes):
+        # bytea en hexadecimal; la barra se duplica por el escape de COPY
+        return '\\\\x' + value.hex()
+    text = str(value)
+    # Escapa los caracteres especiales del formato texto de COPY
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_line(row):
+    """
+    Construye una línea de COPY (separada por tabuladores) a partir de una fila.
+
+    :param row: tupla de valores de la fila
+    :return: línea terminada en salto de línea
+    """
+    return '\t'.join(copy_value(v) for v in row) + '\n'
+
+
+class _TableBuffer:
+    """
+    Filas pendientes de una tabla: líneas COPY ya codificadas y/o lecturas
+    Modbus sin decodificar de un bloque del mapa de registros. Con ``raw``
+    las lecturas se escriben como tramas en <tabla>_raw, sin decodificar.
+    """
+
+    def __init__(self, tab, columns, block=None, raw=False):
+        self.columns = tuple(columns)
+        self.copy_sql = block.copy_sql if block is not None \
+            else f"COPY {tab} ({', '.join(self.columns)}) FROM STDIN"
+        if raw:
+            self.copy_sql = f"COPY {raw_table(tab)} ({', '.join(RAW_COLUMNS)}) FROM STDIN"
+        self.block = block
+        self.raw = raw
+        self.lines = []
+        self.timestamps = []
+        self.frames = []
+
+    def payload(self):
+        """
+        Texto COPY de todas las filas pendientes. Las lecturas sin decodificar
+        se decodifican aquí en un solo lote.
+        """
+        lines = self.lines
+        if self.frames and self.raw:
+            lines = lines + [copy_line((ts, pack_frame(r))) for ts, r in zip(self.timestamps, self.frames)]
+        elif self.frames:
+            with DECODE_SECONDS.time((self.block.table,)):
+                rows = self.block.decode_batch(self.timestamps, self.frames)
+            lines = lines + [copy_line(row) for row in rows]
+        return self.copy_sql, ''.join(lines)
+
+    @property
+    def rows(self):
+        return len(self.lines) + len(self.frames)
+
+    def row_payload(self, index):
+        """
+        Texto COPY de una sola fila pendiente (la lectura se decodifica sola),
+        para aislar las filas con errores de datos.
+        """
+        if index < len(self.lines):
+            return self.lines[index]
+        index -= len(self.lines)
+        timestamp, registers = self.timestamps[index], self.frames[index]
+        if self.raw:
+            return copy_line((timestamp, pack_frame(registers)))
+        return ''.join(copy_line(row) for row in self.block.decode_batch([timestamp], [registers]))
+
+    def clear(self):
+        self.lines.clear()
+        self.timestamps.clear()
+        self.frames.clear()
+
+
+class BufferedWriter:
+    """
+    Acumula filas por tabla y las escribe en bloque con COPY ... FROM STDIN.
+
+    El buffer se vacía cuando se alcanza el número máximo de filas, el tamaño
+    máximo en bytes o la latencia máxima desde la fila más antigua. Todas las
+    tablas se escriben en una sola transacción, de modo que un vaciado implica
+    un único commit. Ante un error de datos (por ejemplo, un valor fuera de
+    rango) cada tabla se reintenta en su propia transacción y, en la que
+    vuelve a fallar, fila por fila: solo se descartan las filas con errores.
+
+    Si se indica una función ``connect``, el escritor gestiona su propia
+    conexión: ante una falla la descarta y reintenta con backoff sin bloquear
+    la captura. Con un ``spool`` configurado, las lecturas que no pueden
+    escribirse se guardan en disco y, mientras el spool tenga datos, las nuevas
+    también, para que el SpoolDrainer las cargue en orden. Sin spool, las filas
+    permanecen en memoria (hasta ``max_pending_rows``) y se reintentan con la
+    siguiente conexión.
+
+    Con ``rollups`` (rollup.Rollups), en la misma transacción de cada vaciado
+    se recalculan los agregados de los intervalos que contienen las lecturas
+    escritas.
+
+    Con ``raw_frames`` las lecturas de los bloques se escriben como tramas
+    de registros en <tabla>_raw (ver raw_frames.py), sin decodificarlas.
+
+    Con ``release`` (por ejemplo, db_pool.ConnectionPool.release) la conexión
+    se devuelve en lugar de cerrarse al detener el escritor; ante una falla se
+    cierra y también se devuelve.
+    """
+
+    def __init__(self, conn=None, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                 max_latency=DEFAULT_MAX_LATENCY, connect=None, spool=None, backoff=None,
+                 max_pending_rows=None, rollups=None, release=None, raw_frames=False):
+        """
+        :param conn: conexión activa a la base de datos (puede asignarse después)
+        :param max_rows: número de filas que dispara un vaciado
+        :param max_bytes: tamaño en bytes que dispara un vaciado
+        :param max_latency: segundos máximos que una fila puede esperar en memoria
+        :param connect: función sin argumentos que retorna una conexión nueva o None
+        :param spool: instancia de spool.Spool para las lecturas que no pueden escribirse
+        :param backoff: instancia de Backoff para los reintentos de conexión
+        :param max_pending_rows: filas máximas retenidas en memoria sin conexión ni spool
+        :param rollups: instancia de rollup.Rollups para actualizar los agregados al escribir
+        :param release: función que recibe la conexión obtenida con ``connect`` al dejar de usarla
+        :param raw_frames: escribe las lecturas como tramas de registros en <tabla>_raw
+        """
+        self.conn = conn
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.connect = connect
+        self.spool = spool
+        self.backoff = backoff or Backoff()
+        self.max_pending_rows = max_pending_rows or 100 * max_rows
+        self.rollups = rollups
+        self.release = release
+        self.raw_frames = raw_frames
+        self._retry_at = 0.0
+        self._tables = {}       # tabla -> _TableBuffer
+        self._rows = 0
+        self._bytes = 0
+        self._oldest = None     # Instante (monotónico) de la fila más antigua
+
+    def set_connection(self, conn):
+        """
+        Asigna una nueva conexión, por ejemplo tras una reconexión.
+        """
+        self.conn = conn
+
+    @property
+    def pending_rows(self):
+        """
+        Número de filas pendientes de escribir.
+        """
+        return self._rows
+
+    def add(self, tab, columns, row):
+        """
+        Agrega una fila ya decodificada al buffer de la tabla y vacía el buffer si corresponde.
+
+        :param tab: nombre de la tabla destino
+        :param columns: secuencia con los nombres de columnas
+        :param row: tupla con los valores, en el mismo orden que las columnas
+        """
+        line = copy_line(row)
+        buffer = self._tables.get(tab)
+        if buffer is None:
+            buffer = self._tables[tab] = _TableBuffer(tab, columns)
+        buffer.lines.append(line)
+        self._added(len(line))
+
+    def add_frame(self, block, timestamp, registers):
+        """
+        Agrega una lectura Modbus sin decodificar de un bloque del mapa de
+        registros. La decodificación se hace por lotes al vaciar el buffer.
+
+        :param block: bloque compilado (register_map.CompiledBlock)
+        :param timestamp: instante de adquisición de la lectura
+        :param registers: lista de registros leídos del bloque
+        """
+        buffer = self._tables.get(block.table)
+        if buffer is None:
+            buffer = self._tables[block.table] = _TableBuffer(block.table, block.columns, block, self.raw_frames)
+        buffer.timestamps.append(timestamp)
+        buffer.frames.append(registers)
+        # Tamaño aproximado: dos bytes por registro más el instante
+        self._added(2 * len(registers) + 8)
+
+    def _added(self, size):
+        self._rows += 1
+        self._bytes += size
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self.maybe_flush()
+
+    def due(self):
+        """
+        Indica si alguno de los límites de vaciado fue alcanzado.
+        """
+        if not self._rows:
+            return False
+        return (self._rows >= self.max_rows
+                or self._bytes >= self.max_bytes
+                or time.monotonic() - self._oldest >= self.max_latency)
+
+    def maybe_flush(self):
+        """
+        Vacía el buffer solo si se alcanzó algún límite. Pensado para llamarse
+        en cada ciclo de lectura, aunque no se hayan agregado filas.
+        """
+        if self.due():
+            self.flush()
+
+    def flush(self):
+        """
+        Escribe todas las filas pendientes con COPY en una única transacción.
+
+        Si no hay conexión, las lecturas pasan al spool (si existe). Sin spool
+        ni función ``connect``, se propaga la excepción y las filas quedan en el
+        buffer para el siguiente intento.
+        """
+        if not self._rows:
+            return
+        if self.spool is not None and self.spool.active:
+            # Hay lecturas anteriores en disco: las nuevas se encolan detrás
+            self._spill()
+            return
+        if not self._ensure_connection():
+            self._hold("Sin conexión a PostgreSQL para vaciar el buffer")
+            return
+
+        start = time.monotonic()
+        try:
+            with self.conn.cursor() as cursor:
+                for tab, buffer in self._tables.items():
+                    if not buffer.lines and not buffer.frames:
+                        continue
+                    copy_sql, payload = buffer.payload()
+                    cursor.copy_expert(copy_sql, io.StringIO(payload))
+                    self._refresh_rollups(cursor, tab, buffer)
+            self.conn.commit()
+        except (InterfaceError, OperationalError) as e:
+            self._connection_lost(e)
+            return
+        except Exception as e:
+            # Error de datos: se reintenta por tabla para descartar solo las filas con errores
+            log.error(f"Error de datos al vaciar el buffer ({self._rows} filas), se reintenta por tabla: {e}")
+            FLUSH_ERRORS.inc(('data',))
+            self._rollback()
+            try:
+                self._flush_tables()
+            except (InterfaceError, OperationalError) as e:
+                self._connection_lost(e)
+            return
+
+        FLUSH_SECONDS.observe(time.monotonic() - start)
+        for tab, buffer in self._tables.items():
+            if buffer.lines or buffer.frames:
+                ROWS_WRITTEN.inc((tab,), len(buffer.lines) + len(buffer.frames))
+        log.debug(f"Buffer vaciado: {self._rows} filas, {self._bytes} bytes")
+        self._clear()
+
+    def _flush_tables(self):
+        """
+        Escribe cada tabla pendiente en su propia transacción; en la tabla que
+        falla, fila por fila. Las tablas escritas salen del buffer a medida que
+        se confirman, de modo que ante una pérdida de conexión solo se
+        conservan las pendientes.
+        """
+        for tab, buffer in self._tables.items():
+            if not buffer.rows:
+                continue
+            try:
+                with self.conn.cursor() as cursor:
+                    copy_sql, payload = buffer.payload()
+                    cursor.copy_expert(copy_sql, io.StringIO(payload))
+                    self._refresh_rollups(cursor, tab, buffer)
+                self.conn.commit()
+                written = buffer.rows
+            except (InterfaceError, OperationalError):
+                raise
+            except Exception as e:
+                log.error(f"Error de datos en {tab}, se escribe fila por fila: {e}")
+                self._rollback()
+                written = self._write_rows(tab, buffer)
+            ROWS_WRITTEN.inc((tab,), written)
+            buffer.clear()
+            self._recount()
+
+    def _write_rows(self, tab, buffer):
+        """
+        Escribe las filas de una tabla de a una, cada una tras un savepoint, y
+        descarta las que fallan.
+
+        :return: filas escritas
+        """
+        written = 0
+        with self.conn.cursor() as cursor:
+            for index in range(buffer.rows):
+                cursor.execute("SAVEPOINT buffered_row")
+                try:
+                    line = buffer.row_payload(index)
+                    cursor.copy_expert(buffer.copy_sql, io.StringIO(line))
+                except (InterfaceError, OperationalError):
+                    raise
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT buffered_row")
+                    log.error(f"Fila descartada en {tab}: {e}")
+                    ROWS_REJECTED.inc((tab,))
+                else:
+                    written += 1
+                cursor.execute("RELEASE SAVEPOINT buffered_row")
+            if written:
+                self._refresh_rollups(cursor, tab, buffer)
+        self.conn.commit()
+        return written
+
+    def _refresh_rollups(self, cursor, tab, buffer):
+        if self.rollups is not None and buffer.timestamps:
+            self.rollups.refresh(cursor, tab, min(buffer.timestamps), max(buffer.timestamps))
+
+    def _rollback(self):
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+
+    def _connection_lost(self, error):
+        log.error(f"Conexión perdida al vaciar el buffer ({self._rows} filas pendientes): {error}")
+        FLUSH_ERRORS.inc(('connection',))
+        self._drop_connection()
+        self._hold(error)
+
+    def close(self):
+        """
+        Vaciado final al detener el script. No propaga errores de conexión
+        para permitir el cierre ordenado del resto de recursos.
+        """
+        try:
+            self.flush()
+        except (InterfaceError, OperationalError):
+            pass
+        if self._rows:
+            log.error(f"No se pudieron escribir {self._rows} filas pendientes al cerrar")
+        if self.connect is not None:
+            self._drop_connection(keep=True)
+
+    def _ensure_connection(self):
+        """
+        Verifica la conexión y, si el escritor la gestiona, reconecta cuando
+        vence el backoff. Nunca espera: retorna False si no hay conexión.
+        """
+        if self.conn is not None and not self.conn.closed:
+            return True
+        if self.connect is None or time.monotonic() < self._retry_at:
+            return False
+        self.conn = self.connect()
+        if self.conn is None:
+            DB_CONNECTS.inc(('error',))
+            self._retry_at = time.monotonic() + self.backoff.next_delay()
+            return False
+        DB_CONNECTS.inc(('ok',))
+        self.backoff.reset()
+        return True
+
+    def _drop_connection(self, keep=False):
+        """
+        Descarta la conexión actual; con ``keep`` (cierre ordenado) y una
+        función ``release`` se devuelve sin cerrarla.
+        """
+        if self.conn is not None:
+            if not keep or self.release is None:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+            if self.release is not None:
+                self.release(self.conn)
+        self.conn = None
+        if self.connect is not None:
+            self._retry_at = time.monotonic() + self.backoff.next_delay()
+
+    def _hold(self, reason):
+        """
+        Conserva las filas que no pudieron escribirse: en el spool si existe;
+        si no, en memoria (acotado) cuando el escritor gestiona la conexión, o
+        propagando el error en caso contrario.
+        """
+        if self.spool is not None:
+            self._spill()
+            return
+        if self.connect is None:
+            raise reason if isinstance(reason, Exception) else InterfaceError(reason)
+        if self._rows > self.max_pending_rows:
+            log.error(f"Sin conexión a PostgreSQL: se descartan {self._rows} filas retenidas en memoria")
+            self._clear()
+
+    def _spill(self):
+        """
+        Mueve las lecturas pendientes al spool en disco. Las filas ya
+        decodificadas (``add``) no pueden guardarse en el spool y permanecen en memoria.
+        """
+        try:
+            for buffer in self._tables.values():
+                if buffer.frames:
+                    self.spool.append_frames(buffer.block, buffer.timestamps, buffer.frames)
+                    ROWS_SPOOLED.inc((buffer.block.table,), len(buffer.frames))
+                    buffer.timestamps.clear()
+                    buffer.frames.clear()
+        except OSError as e:
+            log.error(f"No se pudo escribir en el spool: {e}")
+        self._recount()
+
+    def _recount(self):
+        self._rows = sum(b.rows for b in self._tables.values())
+        self._bytes = sum(len(line) for b in self._tables.values() for line in b.lines) + \
+            sum(2 * len(r) + 8 for b in self._tables.values() for r in b.frames)
+        if not self._rows:
+            self._oldest = None
+
+    def _clear(self):
+        for buffer in self._tables.values():
+            buffer.clear()
+        self._rows = 0
+        self._bytes = 0
+        self._oldest = None
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3.12
+
+# Registro por excepción (deadband) para los scripts de captura. Una lectura
+# solo se guarda si algún campo se alejó del último valor guardado más que su
+# tolerancia (``deadband`` del campo en register_map.json; sin tolerancia,
+# cualquier cambio se guarda), o si pasó el intervalo de heartbeat desde la
+# última fila guardada. Los campos de estado que casi nunca cambian dejan de
+# generar una fila completa en cada ciclo, sin perder sus transiciones.
+
+import logging                                      # Para registro de eventos e información de depuración
+
+log = logging.getLogger()
+
+DEFAULT_HEARTBEAT = 60.0        # Segundos máximos sin guardar una fila por tabla
+
+
+class DeadbandFilter:
+    """
+    Filtro entre el bucle de captura y el escritor (BufferedWriter o
+    FrameQueue), con la misma interfaz ``add_frame``/``maybe_flush``.
+
+    La comparación se hace contra la última lectura entregada al escritor y
+    no contra la anterior, de modo que una deriva lenta también se registra
+    al superar la tolerancia.
+    """
+
+    def __init__(self, sink, heartbeat=DEFAULT_HEARTBEAT):
+        """
+        :param sink: destino de las lecturas guardadas (BufferedWriter o FrameQueue)
+        :param heartbeat: segundos máximos entre filas guardadas de una tabla
+                          (un bloque puede definir su propio ``heartbeat`` en el mapa)
+        """
+        self.sink = sink
+        self.heartbeat = heartbeat
+        self.stored = 0
+        self.suppressed = 0
+        self._last = {}         # tabla -> (instante, valores decodificados)
+
+    def add_frame(self, block, timestamp, registers):
+        """
+        Entrega la lectura al escritor si cambió más que la tolerancia o si venció el heartbeat.
+
+        :param block: bloque compilado (register_map.CompiledBlock)
+        :param timestamp: instante de adquisición
+        :param registers: lista de registros leídos
+        """
+        values = block.decode(timestamp, registers)[1:]
+        last = self._last.get(block.table)
+        if last is not None:
+            last_timestamp, last_values = last
+            heartbeat = block.heartbeat or self.heartbeat
+            if (timestamp - last_timestamp).total_seconds() < heartbeat and all(
+                    abs(value - previous) <= tolerance
+                    for value, previous, tolerance in zip(values, last_values, block.tolerances)):
+                self.suppressed += 1
+                return
+        self._last[block.table] = (timestamp, values)
+        self.stored += 1
+        self.sink.add_frame(block, timestamp, registers)
+
+    def maybe_flush(self):
+        self.sink.maybe_flush()
+
+    def summary(self):
+        """
+        Resumen legible para el log.
+        """
+        total = self.stored + self.suppressed
+        ratio = self.suppressed / total * 100 if total else 0.0
+        return f"guardadas={self.stored} omitidas={self.suppressed} ({ratio:.1f}%)"
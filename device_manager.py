@@ -0,0 +1,118 @@
+#!/usr/bin/env python3.12
+
+# Gestión de conexiones Modbus por dispositivo compartida por los scripts de captura.
+# Cada dispositivo mantiene su propio estado de salud, reintentos con backoff
+# exponencial y jitter, y un cortacircuitos que evita bloquear el ciclo de
+# muestreo con un dispositivo caído mientras los demás siguen leyéndose.
+
+import time                                         # Reloj monotónico
+import logging                                      # Para registro de eventos e información de depuración
+from pymodbus.client import ModbusTcpClient         # Cliente Modbus TCP para comunicarse con el dispositivo
+from backoff import Backoff                         # Esperas exponenciales con jitter
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+RECONNECTS = metrics.counter('scada_modbus_reconnects_total', "Recuperaciones de un dispositivo tras una falla", ('device',))
+DEVICE_UP = metrics.gauge('scada_modbus_device_up', "1 si el circuito del dispositivo está cerrado, 0 si está abierto", ('device',))
+
+# Estados del cortacircuitos
+STATE_CLOSED = 'closed'         # Dispositivo sano, se lee en cada ciclo
+STATE_OPEN = 'open'             # Dispositivo en falla, no se intenta hasta que venza el backoff
+STATE_HALF_OPEN = 'half_open'   # Backoff vencido, se permite un intento de prueba
+
+
+class ModbusDevice:
+    """
+    Envoltura de un ModbusTcpClient con estado de salud propio.
+
+    ``read()`` nunca lanza excepciones: retorna la lista de registros o None si
+    la lectura falló o si el circuito está abierto. Tras ``failure_threshold``
+    fallos consecutivos el circuito se abre y el dispositivo no se vuelve a
+    contactar hasta que vence su backoff; entonces se permite un único intento
+    de prueba que lo cierra (éxito) o lo reabre con una espera mayor (fallo).
+    """
+
+    def __init__(self, name, host, port, timeout=3, failure_threshold=3, backoff=None):
+        """
+        :param name: nombre del dispositivo para los mensajes de log
+        :param host: dirección IP del dispositivo
+        :param port: puerto Modbus TCP
+        :param timeout: tiempo máximo de espera por operación en segundos
+        :param failure_threshold: fallos consecutivos que abren el circuito
+        :param backoff: instancia de Backoff (por defecto, una nueva con valores estándar)
+        """
+        self.name = name
+        self.client = ModbusTcpClient(host=host, port=port, timeout=timeout)
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff or Backoff()
+        self.state = STATE_CLOSED
+        self.failures = 0           # Fallos consecutivos
+        self.reconnects = 0         # Reconexiones exitosas tras una falla
+        self._retry_at = 0.0
+        DEVICE_UP.set(1, (name,))
+
+    @property
+    def healthy(self):
+        return self.state == STATE_CLOSED
+
+    def available(self):
+        """
+        Indica si el dispositivo puede contactarse en este ciclo.
+        """
+        if self.state == STATE_OPEN:
+            if time.monotonic() < self._retry_at:
+                return False
+            self.state = STATE_HALF_OPEN
+        return True
+
+    def read(self, address, count):
+        """
+        Lee registros holding del dispositivo.
+
+        :param address: dirección inicial
+        :param count: cantidad de registros
+        :return: lista de registros, o None si el dispositivo no está disponible o la lectura falló
+        """
+        if not self.available():
+            return None
+        try:
+            if not self.client.connected and not self.client.connect():
+                self._record_failure("no se pudo conectar")
+                return None
+            response = self.client.read_holding_registers(address=address, count=count)
+            if response.isError():
+                self._record_failure(f"error de lectura en {address}/{count}: {response}")
+                return None
+        except Exception as e:
+            self._record_failure(f"excepción en {address}/{count}: {e}")
+            return None
+        self._record_success()
+        return response.registers
+
+    def close(self):
+        self.client.close()
+
+    def _record_success(self):
+        if self.state != STATE_CLOSED or self.failures:
+            log.info(f"[{self.name}] Dispositivo recuperado tras {self.failures} fallos")
+            self.reconnects += 1
+            RECONNECTS.inc((self.name,))
+            DEVICE_UP.set(1, (self.name,))
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.backoff.reset()
+
+    def _record_failure(self, reason):
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+            delay = self.backoff.next_delay()
+            self._retry_at = time.monotonic() + delay
+            if self.state != STATE_OPEN:
+                log.error(f"[{self.name}] Circuito abierto ({reason}); reintento en {delay:.1f} s")
+                DEVICE_UP.set(0, (self.name,))
+            self.state = STATE_OPEN
+            # Cierra el socket para forzar una conexión nueva en el siguiente intento
+            self.client.close()
+        else:
+            log.warning(f"[{self.name}] Fallo {self.failures}/{self.failure_threshold}: {reason}")
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3.12
+
+# Respaldo incremental de las tablas de captura. Las tablas solo reciben
+# inserciones, por lo que cada respaldo exporta únicamente las filas
+# insertadas desde la marca de agua del respaldo anterior, con
+# COPY (SELECT ... WHERE ingested_at >= ...) TO STDOUT, en archivos de
+# segmento comprimidos. La marca de agua es el instante de inserción
+# (columna ingested_at, con DEFAULT now()) y no el de la muestra: las
+# lecturas que llegan tarde con instantes antiguos (por ejemplo, al vaciarse
+# el spool tras horas sin PostgreSQL) entran en el siguiente incremento.
+# ingested_at se respalda y se restaura con las filas, de modo que una base
+# restaurada no vuelve a entrar en el siguiente incremento. Un manifiesto
+# registra la cadena de respaldos: una base (todas las filas) seguida de
+# incrementos ordenados; la restauración reproduce la base y luego cada
+# incremento de la cadena.
+#
+# Estructura del directorio:
+#   manifest.json
+#   <id>/schema.sql                  (solo en la base)
+#   <id>/<tabla>-<n>.copy[.gz|.zst|.lz4]
+
+import os
+import gzip
+import json
+import hashlib
+import shutil
+import logging                                      # Para registro de eventos e información de depuración
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+
+try:
+    import zstandard                                # Compresión zstd (opcional)
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame                                # Compresión lz4 (opcional)
+except ImportError:
+    lz4 = None
+
+log = logging.getLogger()
+
+MANIFEST = 'manifest.json'
+SCHEMA_FILE = 'schema.sql'
+TYPE_BASE = 'base'
+TYPE_INCREMENTAL = 'incremental'
+
+# Columna con el instante de inserción de cada fila (el de inicio de la
+# transacción que la insertó), que usa la marca de agua; la agregan
+# schema_manager.py y raw_frames.py
+INGEST_COLUMN = 'ingested_at'
+INGEST_DEFINITION = f"{INGEST_COLUMN} timestamptz NOT NULL DEFAULT now()"
+
+# Extensión de los segmentos según el método de compresión
+EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+DEFAULT_SEGMENT_ROWS = 1000000
+DEFAULT_SETTLE_SECONDS = 300
+
+
+def parse_compression(spec):
+    """
+    Separa una especificación 'método[:nivel]'.
+
+    :return: (método, nivel o None)
+    """
+    method, _, level = spec.partition(':')
+    if method not in EXTENSIONS:
+        raise ValueError(f"Compresión desconocida: {spec}")
+    if method == 'zstd' and zstandard is None:
+        raise ValueError("La compresión zstd requiere el paquete 'zstandard'")
+    if method == 'lz4' and lz4 is None:
+        raise ValueError("La compresión lz4 requiere el paquete 'lz4'")
+    return method, int(level) if level else None
+
+
+def open_segment(path, method, level=None, mode='rb'):
+    """
+    Abre un archivo de segmento comprimido para lectura ('rb') o escritura ('wb').
+    """
+    if method == 'gzip':
+        return gzip.open(path, mode, compresslevel=level or 6)
+    if method == 'zstd':
+        if mode == 'wb':
+            return zstandard.ZstdCompressor(level=level or 3).stream_writer(open(path, 'wb'))
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    if method == 'lz4':
+        return lz4.frame.open(path, mode, compression_level=level or 0)
+    return open(path, mode)
+
+
+class _SegmentWriter:
+    """
+    Destino de un COPY ... TO STDOUT que reparte las filas en segmentos
+    comprimidos de a lo sumo ``segment_rows`` filas. La primera columna es el
+    timestamp y las filas llegan ordenadas, por lo que cada segmento registra
+    su primer y último instante, además del SHA-256 de sus filas sin
+    comprimir (verify_backup.py). Con ``throttle`` cada bloque recibido pasa
+    por el limitador de caudal del respaldo (backup_throttle.py).
+    """
+
+    def __init__(self, directory, prefix, method, level, segment_rows, throttle=None):
+        self.directory = directory
+        self.throttle = throttle
+        self.prefix = prefix
+        self.method = method
+        self.level = level
+        self.segment_rows = segment_rows
+        self.segments = []
+        self._file = None
+        self._rows = 0
+        self._first = self._last = None
+        self._hash = None
+        self._tail = b''
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self.throttle is not None:
+            self.throttle.throttle(len(data))
+        data = self._tail + data
+        end = data.rfind(b'\n') + 1
+        self._tail = data[end:]
+        data = data[:end]
+        while data:
+            if self._file is None:
+                self._open()
+            room = self.segment_rows - self._rows
+            lines = data.count(b'\n')
+            if lines <= room:
+                chunk, data = data, b''
+            else:
+                pos = 0
+                for _ in range(room):
+                    pos = data.index(b'\n', pos) + 1
+                chunk, data = data[:pos], data[pos:]
+                lines = room
+            if self._first is None:
+                self._first = chunk.split(b'\t', 1)[0]
+            last_line = chunk[chunk.rfind(b'\n', 0, len(chunk) - 1) + 1:]
+            self._last = last_line.split(b'\t', 1)[0].rstrip(b'\n')
+            self._file.write(chunk)
+            self._hash.update(chunk)
+            self._rows += lines
+            if self._rows >= self.segment_rows:
+                self._close_segment()
+
+    def close(self):
+        """
+        Cierra el segmento en curso y retorna la lista de segmentos escritos.
+        """
+        if self._tail:
+            raise ValueError("La salida de COPY terminó con una fila incompleta")
+        self._close_segment()
+        return self.segments
+
+    def _open(self):
+        name = f"{self.prefix}-{len(self.segments) + 1:04d}.copy{EXTENSIONS[self.method]}"
+        self._path = os.path.join(self.directory, name)
+        self._file = open_segment(self._path, self.method, self.level, 'wb')
+        self._rows = 0
+        self._first = self._last = None
+        self._hash = hashlib.sha256()
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self.segments.append({
+            'file': os.path.basename(self._path),
+            'rows': self._rows,
+            'bytes': os.path.getsize(self._path),
+            'first': self._first.decode(),
+            'last': self._last.decode(),
+            'sha256': self._hash.hexdigest(),
+        })
+        self._file = None
+
+
+def file_sha256(path):
+    """
+    SHA-256 del contenido de un archivo.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(directory):
+    """
+    Lee el manifiesto del directorio de respaldos incrementales.
+    """
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'version': 1, 'tables': {}, 'backups': []}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    """
+    Escribe el manifiesto de forma atómica (archivo temporal y reemplazo).
+    """
+    path = os.path.join(directory, MANIFEST)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+class IncrementalBackup:
+    """
+    Respaldo incremental por marca de agua de las tablas de captura.
+
+    Cada ejecución exporta, por tabla, las filas con ingested_at en
+    [marca anterior, corte), cualquiera sea su timestamp. El corte es el
+    menor entre el instante actual del servidor menos ``settle_seconds`` y el
+    inicio de la transacción de escritura más antigua en curso: una
+    transacción sin confirmar solo puede insertar filas con ingested_at igual
+    o posterior a su inicio, que quedan para el siguiente respaldo. Así cada
+    fila entra en exactamente un respaldo de la cadena.
+    """
+
+    def __init__(self, directory, connect, blocks, compression='gzip', segment_rows=DEFAULT_SEGMENT_ROWS,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, keep_chains=2, throttle=None):
+        """
+        :param directory: directorio de los respaldos incrementales
+        :param connect: función sin argumentos que retorna una conexión psycopg2
+        :param blocks: diccionario tabla -> bloque compilado (columnas de cada tabla)
+        :param compression: método y nivel de compresión ('gzip', 'gzip:1', 'zstd:3', 'lz4', 'none')
+        :param segment_rows: filas máximas por archivo de segmento
+        :param settle_seconds: segundos de margen entre el instante actual y el corte
+        :param keep_chains: cadenas (base + incrementos) que se conservan al crear una base
+        :param throttle: backup_throttle.BackupThrottle que limita el caudal y pausa entre tablas (opcional)
+        """
+        self.directory = directory
+        self.connect = connect
+        self.blocks = blocks
+        self.method, self.level = parse_compression(compression)
+        self.segment_rows = segment_rows
+        self.settle_seconds = settle_seconds
+        self.keep_chains = keep_chains
+        self.throttle = throttle
+        os.makedirs(directory, exist_ok=True)
+
+    def run(self, base=False, jobs=1, write_schema=None):
+        """
+        Ejecuta un respaldo. Si no existe una base, se crea una aunque ``base`` sea False.
+
+        :param base: fuerza una base nueva (todas las filas) que inicia otra cadena
+        :param jobs: tablas exportadas en paralelo
+        :param write_schema: función que recibe un archivo binario y escribe en él el esquema (solo para bases)
+        :return: entrada del manifiesto del respaldo creado
+        """
+        manifest = load_manifest(self.directory)
+        base = base or not manifest['backups']
+        created = datetime.now()
+        cutoff = self._cutoff()
+        backup_id = created.strftime('%Y%m%dT%H%M%S_%f')
+        path = os.path.join(self.directory, backup_id)
+        os.makedirs(path)
+
+        entry = {'id': backup_id, 'type': TYPE_BASE if base else TYPE_INCREMENTAL,
+                 'created': created.isoformat(' '), 'compression': self.method, 'tables': {}}
+        try:
+            if base and write_schema:
+                with open(os.path.join(path, SCHEMA_FILE), 'wb') as f:
+                    write_schema(f)
+                entry['schema'] = SCHEMA_FILE
+                entry['schema_sha256'] = file_sha256(os.path.join(path, SCHEMA_FILE))
+
+            def export(table):
+                since = None if base else manifest['tables'].get(table)
+                return table, self._export_table(path, table, since, cutoff)
+
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                for table, stats in executor.map(export, self.blocks):
+                    entry['tables'][table] = stats
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+        # La marca de agua solo avanza cuando todos los segmentos están en disco
+        manifest['backups'].append(entry)
+        manifest['tables'] = {table: stats['to'] for table, stats in entry['tables'].items()}
+        save_manifest(self.directory, manifest)
+        if base:
+            self._prune(manifest)
+        return entry
+
+    def _cutoff(self):
+        """
+        Corte del respaldo según el reloj del servidor (ver ``ingest_cutoff``).
+        """
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cutoff = ingest_cutoff(cursor, self.settle_seconds)
+                missing = []
+                for table in self.blocks:
+                    cursor.execute("SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) "
+                                   "AND attname = %s AND NOT attisdropped", (table, INGEST_COLUMN))
+                    if cursor.fetchone() is None:
+                        missing.append(table)
+            conn.rollback()
+        finally:
+            conn.close()
+        if missing:
+            raise ValueError(f"Falta la columna {INGEST_COLUMN} en {', '.join(missing)}: "
+                             "ejecutar schema_manager.py --apply")
+        return cutoff
+
+    def _export_table(self, path, table, since, cutoff):
+        if self.throttle is not None:
+            self.throttle.wait()
+        columns = list(self.blocks[table].columns) + [INGEST_COLUMN]
+        conditions, params = [f'{INGEST_COLUMN} < %s'], [cutoff]
+        if since is not None:
+            conditions.insert(0, f'{INGEST_COLUMN} >= %s')
+            params.insert(0, since)
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                query = cursor.mogrify(f"SELECT {', '.join(columns)} FROM {table} "
+                                       f"WHERE {' AND '.join(conditions)} ORDER BY timestamp",
+                                       params).decode()
+                writer = _SegmentWriter(path, table, self.method, self.level, self.segment_rows, self.throttle)
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT", writer)
+                segments = writer.close()
+            conn.rollback()
+        finally:
+            conn.close()
+        rows = sum(s['rows'] for s in segments)
+        log.info(f"Respaldo incremental de {table}: {rows} filas en {len(segments)} segmentos")
+        return {'columns': columns, 'from': since, 'to': cutoff.isoformat(' '),
+                'rows': rows, 'segments': segments}
+
+    def _prune(self, manifest):
+        """
+        Elimina las cadenas más antiguas, conservando ``keep_chains``.
+        """
+        bases = [i for i, b in enumerate(manifest['backups']) if b['type'] == TYPE_BASE]
+        if not self.keep_chains or len(bases) <= self.keep_chains:
+            return
+        first_kept = bases[-self.keep_chains]
+        removed, manifest['backups'] = manifest['backups'][:first_kept], manifest['backups'][first_kept:]
+        save_manifest(self.directory, manifest)
+        for backup in removed:
+            shutil.rmtree(os.path.join(self.directory, backup['id']), ignore_errors=True)
+            log.info(f"Respaldo incremental {backup['id']} eliminado (cadena antigua)")
+
+
+def restore_chain(directory, backup_id=None):
+    """
+    Cadena de respaldos a reproducir: la última base anterior o igual a
+    ``backup_id`` (o al último respaldo) y los incrementos que le siguen.
+    Verifica que las marcas de agua de cada incremento continúen la anterior.
+
+    :return: lista de entradas del manifiesto, en orden de aplicación
+    """
+    backups = load_manifest(directory)['backups']
+    if backup_id is not None:
+        ids = [b['id'] for b in backups]
+        if backup_id not in ids:
+            raise ValueError(f"El respaldo {backup_id} no está en el manifiesto")
+        backups = backups[:ids.index(backup_id) + 1]
+    bases = [i for i, b in enumerate(backups) if b['type'] == TYPE_BASE]
+    if not bases:
+        raise ValueError(f"No hay un respaldo base en {directory}")
+    chain = backups[bases[-1]:]
+
+    for previous, backup in zip(chain, chain[1:]):
+        for table, stats in backup['tables'].items():
+            expected = previous['tables'].get(table, {}).get('to')
+            if stats['from'] != expected:
+                raise ValueError(f"Cadena rota en {backup['id']}/{table}: comienza en {stats['from']}, "
+                                 f"el respaldo anterior termina en {expected}")
+    return chain
+
+
+def restore_incremental(directory, connect, backup_id=None, tables=None, jobs=1, replace=False):
+    """
+    Restaura una base y su cadena de incrementos. Cada tabla se carga en una
+    única transacción, varias tablas en paralelo.
+
+    :param directory: directorio de los respaldos incrementales
+    :param connect: función sin argumentos que retorna una conexión psycopg2
+    :param backup_id: último respaldo a aplicar (por defecto, el más reciente)
+    :param tables: tablas a restaurar (por defecto, todas)
+    :param jobs: tablas restauradas en paralelo
+    :param replace: vacía cada tabla antes de cargarla
+    :return: diccionario tabla -> filas cargadas
+    """
+    chain = restore_chain(directory, backup_id)
+    names = tables or sorted({t for backup in chain for t in backup['tables']})
+
+    def load(table):
+        conn = connect()
+        rows = 0
+        try:
+            with conn.cursor() as cursor:
+                if replace:
+                    cursor.execute(f"TRUNCATE {table}")
+                for backup in chain:
+                    stats = backup['tables'].get(table)
+                    if stats is None:
+                        continue
+                    sql = f"COPY {table} ({', '.join(stats['columns'])}) FROM STDIN"
+                    for segment in stats['segments']:
+                        path = os.path.join(directory, backup['id'], segment['file'])
+                        with open_segment(path, backup['compression']) as f:
+                            cursor.copy_expert(sql, f)
+                        if cursor.rowcount != segment['rows']:
+                            raise ValueError(f"{path}: se cargaron {cursor.rowcount} filas, "
+                                             f"el manifiesto indica {segment['rows']}")
+                        rows += segment['rows']
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        log.info(f"Restauración incremental de {table}: {rows} filas")
+        return table, rows
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return dict(executor.map(load, names))
+
+
+def ingest_cutoff(cursor, settle_seconds):
+    """
+    Instante de inserción hasta el cual ya no pueden aparecer filas nuevas: el
+    menor entre el reloj del servidor menos ``settle_seconds`` y el inicio de
+    la transacción de escritura más antigua en curso (ingested_at es el now()
+    de la transacción que inserta la fila). Solo se ven las transacciones de
+    otras sesiones del mismo usuario (o con pg_read_all_stats); las demás
+    quedan cubiertas por ``settle_seconds``.
+    """
+    cursor.execute("SELECT least(now() - make_interval(secs => %s), "
+                   "(SELECT min(xact_start) FROM pg_stat_activity "
+                   " WHERE backend_xid IS NOT NULL AND datname = current_database()))",
+                   (settle_seconds,))
+    return cursor.fetchone()[0]
+
+
+def connect_config(config):
+    """
+    Función de conexión a PostgreSQL a partir del archivo de configuración.
+    """
+    db_config = {
+        'host': config['db_host'],
+        'port': config.get('db_port', 5432),
+        'database': config['db_name'],
+        'user': config['db_user'],
+        'password': config['db_password'],
+    }
+    return lambda: psycopg2.connect(**db_config)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3.12
+
+# Métricas de los scripts de captura, respaldo y restauración en el formato de
+# texto de Prometheus, sin dependencias externas. Cada módulo registra sus
+# contadores, indicadores e histogramas en el registro global; los scripts los
+# exponen por HTTP (metrics_ports) o los escriben en un archivo de texto para
+# el textfile collector de node_exporter (metrics_dir), desde donde Grafana
+# los consulta a través de Prometheus.
+
+import os
+import time
+import urllib.request
+import threading                                    # Sincronización y hilos de exportación
+import logging                                      # Para registro de eventos e información de depuración
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger()
+
+# Límites de los histogramas de latencia, en segundos
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None, const=()):
+    pairs = list(const) + [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Base de las métricas: valores por combinación de etiquetas, protegidos por un lock.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _check(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name}: se esperaban las etiquetas {self.labels}, se recibieron {labels}")
+
+    def render(self, const=()):
+        """
+        Líneas de texto de la métrica.
+
+        :param const: etiquetas constantes ya formateadas ('nombre="valor"') agregadas a cada muestra
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._snapshot(labels, value) for labels, value in self._values.items())
+        for labels, value in items:
+            lines.extend(self._samples(labels, value, const))
+        return lines
+
+    def _snapshot(self, labels, value):
+        return labels, value
+
+    def _samples(self, labels, value, const):
+        return [f"{self.name}{_format_labels(self.labels, labels, const=const)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """
+    Contador monótono (por ejemplo, filas escritas o reconexiones).
+    """
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Indicador que puede subir o bajar (por ejemplo, duración del último respaldo).
+    """
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    Histograma acumulado con límites fijos, suma y cantidad de observaciones.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, labels=()):
+        self._check(labels)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, labels=()):
+        """
+        Contexto que observa la duración del bloque ``with``.
+        """
+        return _Timer(self, labels)
+
+    def _snapshot(self, labels, state):
+        # Copia bajo el lock: las cubetas se modifican en su lugar
+        return labels, (tuple(state[0]), state[1], state[2])
+
+    def _samples(self, labels, state, const):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            le = ('le', _format_value(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le, const)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, labels, const=const)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, labels, const=const)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, self.labels)
+
+
+class Registry:
+    """
+    Conjunto de métricas del proceso. Registrar dos veces el mismo nombre
+    retorna la métrica existente, de modo que los módulos pueden declararlas al importarse.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError(f"La métrica {name} ya existe con otro tipo o etiquetas")
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self, process=None):
+        """
+        Todas las métricas en el formato de texto de Prometheus.
+
+        :param process: valor de la etiqueta ``process`` agregada a cada muestra, para que
+                        los archivos de varios procesos no repitan series en el textfile collector
+        """
+        const = (f'process="{_escape(process)}"',) if process else ()
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return '\n'.join(line for metric in metrics for line in metric.render(const)) + '\n'
+
+    def write_textfile(self, path, process=None):
+        """
+        Escribe las métricas en ``path`` de forma atómica (archivo temporal y
+        renombrado), como espera el textfile collector de node_exporter.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.render(process))
+        os.replace(tmp, path)
+
+
+# Registro global del proceso
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f"Métricas: {format % args}")
+
+
+class MetricsExporter:
+    """
+    Exportación de las métricas de un proceso: servidor HTTP en
+    ``/metrics`` y/o escritura periódica de ``<directorio>/<nombre>.prom``.
+    """
+
+    def __init__(self, name, port=None, directory=None, interval=15.0, host='', registry=REGISTRY):
+        """
+        :param name: nombre del proceso (archivo de texto y etiqueta de los logs)
+        :param port: puerto HTTP (None desactiva el servidor)
+        :param directory: directorio del textfile collector (None desactiva el archivo)
+        :param interval: segundos entre escrituras del archivo
+        :param host: interfaz del servidor HTTP (todas por defecto)
+        """
+        self.name = name
+        self.registry = registry
+        self.path = os.path.join(directory, f"{name}.prom") if directory else None
+        self.interval = interval
+        self._server = None
+        self._stop_event = threading.Event()
+        self._threads = []
+        if port:
+            handler = type('Handler', (_Handler,), {'registry': registry})
+            self._server = ThreadingHTTPServer((host, port), handler)
+            self._threads.append(threading.Thread(target=self._server.serve_forever,
+                                                  name=f"{name}-metrics-http", daemon=True))
+            log.info(f"Métricas de {name} en http://{host or '0.0.0.0'}:{port}/metrics")
+        if self.path:
+            self._threads.append(threading.Thread(target=self._write_loop,
+                                                  name=f"{name}-metrics-file", daemon=True))
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _write_loop(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """
+        Escribe el archivo de texto de inmediato (por ejemplo, al terminar un respaldo).
+        """
+        if self.path is None:
+            return
+        try:
+            self.registry.write_textfile(self.path, process=self.name)
+        except OSError as e:
+            log.error(f"No se pudo escribir el archivo de métricas {self.path}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self.write()
+
+
+def exporter(config, name):
+    """
+    Exportador configurado desde config.json: puerto de ``metrics_ports[name]``
+    y directorio ``metrics_dir``.
+    """
+    return MetricsExporter(name, port=config.get('metrics_ports', {}).get(name),
+                           directory=config.get('metrics_dir'),
+                           interval=config.get('metrics_interval', 15.0))
+
+
+def parse_text(text):
+    """
+    Interpreta el formato de texto de Prometheus.
+
+    :return: diccionario (nombre, etiquetas ordenadas) -> valor
+    """
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        pairs = sorted(tuple(pair.split('=', 1)) for pair in labels.rstrip('}').split(',') if pair)
+        samples[(name, tuple((k, v.strip('"')) for k, v in pairs))] = float(value)
+    return samples
+
+
+def scrape(ports, host='127.0.0.1', timeout=5):
+    """
+    Lee y suma las métricas expuestas por varios procesos en ``/metrics``.
+    Los procesos que no responden se omiten.
+
+    :param ports: puertos HTTP de los procesos
+    :return: diccionario (nombre, etiquetas ordenadas) -> valor
+    """
+    samples = {}
+    for port in ports:
+        try:
+            with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=timeout) as response:
+                text = response.read().decode()
+        except OSError as e:
+            log.debug(f"No se pudieron leer las métricas de {host}:{port}: {e}")
+            continue
+        for key, value in parse_text(text).items():
+            samples[key] = samples.get(key, 0.0) + value
+    return samples
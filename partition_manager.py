@@ -0,0 +1,352 @@
+#!/usr/bin/env python3.12
+
+# Particionado nativo por rango de tiempo de las tablas de captura.
+# Cada tabla se convierte (una sola vez, con --convert) en una tabla
+# particionada por RANGE (timestamp): la tabla original pasa a ser la partición
+# histórica <tabla>_legacy y las filas nuevas van a particiones por día, semana
+# o mes (<tabla>_pAAAAMM o <tabla>_pAAAAMMDD). Pensado para ejecutarse desde
+# cron: crea por adelantado las particiones futuras y aplica la retención
+# (eliminar, archivar o desacoplar las particiones vencidas), de modo que las
+# consultas por rango de tiempo solo recorren las particiones necesarias y la
+# retención no requiere DELETE masivos. Las particiones nuevas se crean con
+# los parámetros de almacenamiento de schema_manager.py.
+
+import os
+import re
+import sys
+import json
+import argparse
+import logging                                      # Para registro de eventos e información de depuración
+from datetime import datetime, timedelta
+from scada_config import load_config, capture_blocks, CONFIG_FILE
+from incremental_backup import connect_config, open_segment, parse_compression, EXTENSIONS
+from schema_manager import storage_clause, storage_parameters
+import raw_frames
+
+log = logging.getLogger()
+
+# Tamaño de cada partición
+INTERVAL_DAY = 'day'
+INTERVAL_WEEK = 'week'
+INTERVAL_MONTH = 'month'
+INTERVALS = (INTERVAL_DAY, INTERVAL_WEEK, INTERVAL_MONTH)
+
+# Acción sobre las particiones vencidas
+ACTION_DROP = 'drop'            # Se elimina la partición
+ACTION_ARCHIVE = 'archive'      # Se exporta a un archivo comprimido y luego se elimina
+ACTION_DETACH = 'detach'        # Se desacopla y queda como tabla independiente
+ACTIONS = (ACTION_DROP, ACTION_ARCHIVE, ACTION_DETACH)
+
+# Límites de una partición según pg_get_expr(relpartbound)
+BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def period_start(ts, interval):
+    """
+    Inicio del periodo (día, semana desde el lunes o mes) que contiene a ``ts``.
+    """
+    if interval == INTERVAL_MONTH:
+        return datetime(ts.year, ts.month, 1)
+    day = datetime(ts.year, ts.month, ts.day)
+    if interval == INTERVAL_WEEK:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_end(start, interval):
+    """
+    Fin (exclusivo) del periodo que comienza en ``start``.
+    """
+    if interval == INTERVAL_MONTH:
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=7 if interval == INTERVAL_WEEK else 1)
+
+
+def partition_name(table, start, interval):
+    return f"{table}_p{start:%Y%m}" if interval == INTERVAL_MONTH else f"{table}_p{start:%Y%m%d}"
+
+
+def parse_bound(value):
+    """
+    Convierte un límite de partición ('2026-01-01 00:00:00' o MINVALUE/MAXVALUE) a datetime o None.
+    """
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+class Partition:
+    """
+    Partición existente: nombre y límites [lower, upper); None indica sin límite.
+    """
+
+    def __init__(self, name, lower=None, upper=None, default=False):
+        self.name = name
+        self.lower = lower
+        self.upper = upper
+        self.default = default
+
+    def overlaps(self, start, end):
+        return not self.default and (self.lower is None or self.lower < end) \
+            and (self.upper is None or self.upper > start)
+
+
+class PartitionManager:
+    """
+    Mantenimiento de las particiones de las tablas de captura.
+
+    Cada operación se confirma en su propia transacción, de modo que los
+    bloqueos sobre la tabla duran lo mínimo y los scripts de captura siguen
+    insertando durante el mantenimiento.
+    """
+
+    def __init__(self, conn, interval=INTERVAL_MONTH, premake=3, retention=None, action=ACTION_DROP,
+                 archive_dir=None, compression='gzip', storage=None, dry_run=False):
+        """
+        :param conn: conexión psycopg2
+        :param interval: tamaño de cada partición ('day', 'week' o 'month')
+        :param premake: particiones futuras que se crean por adelantado
+        :param retention: timedelta de retención (None conserva todo)
+        :param action: acción sobre las particiones vencidas ('drop', 'archive' o 'detach')
+        :param archive_dir: directorio de los archivos de la acción 'archive'
+        :param compression: compresión de los archivos de la acción 'archive'
+        :param storage: parámetros de almacenamiento de las particiones nuevas
+        :param dry_run: solo registra las sentencias, sin ejecutarlas
+        """
+        if interval not in INTERVALS:
+            raise ValueError(f"Intervalo de partición desconocido: {interval}")
+        if action not in ACTIONS:
+            raise ValueError(f"Acción de retención desconocida: {action}")
+        if action == ACTION_ARCHIVE and not archive_dir:
+            raise ValueError("La acción 'archive' requiere un directorio de archivo")
+        self.conn = conn
+        self.interval = interval
+        self.premake = premake
+        self.retention = retention
+        self.action = action
+        self.archive_dir = archive_dir
+        self.compression = parse_compression(compression)
+        self.storage = storage_clause(storage)
+        self.dry_run = dry_run
+        self.actions = []
+
+    def _execute(self, *statements):
+        """
+        Ejecuta las sentencias (sql, parámetros) en una única transacción.
+        """
+        with self.conn.cursor() as cursor:
+            for sql, params in statements:
+                text = cursor.mogrify(sql, params).decode()
+                self.actions.append(text)
+                log.info(text)
+                if not self.dry_run:
+                    cursor.execute(text)
+        self.conn.commit()
+
+    def _query(self, sql, params=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        self.conn.rollback()
+        return rows
+
+    def is_partitioned(self, table):
+        rows = self._query("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        if not rows:
+            raise ValueError(f"La tabla {table} no existe")
+        return rows[0][0] == 'p'
+
+    def partitions(self, table):
+        """
+        Particiones de la tabla, ordenadas por su límite inferior.
+        """
+        rows = self._query("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+        """, (table,))
+        partitions = []
+        for name, bound in rows:
+            if bound == 'DEFAULT':
+                partitions.append(Partition(name, default=True))
+                continue
+            lower, upper = BOUND.search(bound).groups()
+            partitions.append(Partition(name, parse_bound(lower), parse_bound(upper)))
+        return sorted(partitions, key=lambda p: (not p.default, p.lower or datetime.min))
+
+    def convert(self, table, now=None):
+        """
+        Convierte una tabla normal en particionada. La tabla original pasa a
+        ser la partición <tabla>_legacy, que cubre todo el historial hasta el
+        fin del periodo siguiente; la restricción CHECK que lo garantiza se
+        valida antes, sin bloquear las inserciones, para que el ATTACH no
+        tenga que recorrer la tabla.
+        """
+        now = now or datetime.now()
+        upper = period_end(period_end(period_start(now, self.interval), self.interval), self.interval)
+        legacy = f"{table}_legacy"
+        check = f"{table}_legacy_bound"
+        self._execute((f"ALTER TABLE {table} ADD CONSTRAINT {check} "
+                       f"CHECK (timestamp IS NOT NULL AND timestamp < %s) NOT VALID", (upper,)))
+        self._execute((f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}", None))
+        self._execute(
+            (f"ALTER TABLE {table} RENAME TO {legacy}", None),
+            (f"CREATE TABLE {table} (LIKE {legacy} INCLUDING ALL EXCLUDING CONSTRAINTS) "
+             f"PARTITION BY RANGE (timestamp)", None),
+            (f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)", (upper,)),
+            (f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT{self.storage}", None),
+        )
+
+    def create_future(self, table, now=None):
+        """
+        Crea las particiones del periodo actual y de los ``premake`` siguientes.
+        Si la partición por defecto tiene filas de un periodo nuevo, se mueven
+        a la partición creada en la misma transacción.
+        """
+        now = now or datetime.now()
+        partitions = self.partitions(table)
+        default = next((p.name for p in partitions if p.default), None)
+        if default is None:
+            self._execute((f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT{self.storage}", None))
+            default = f"{table}_default"
+
+        start = period_start(now, self.interval)
+        for _ in range(self.premake + 1):
+            end = period_end(start, self.interval)
+            if not any(p.overlaps(start, end) for p in partitions):
+                name = partition_name(table, start, self.interval)
+                pending = self._query(f"SELECT count(*) FROM {default} WHERE timestamp >= %s AND timestamp < %s",
+                                      (start, end))[0][0]
+                if pending:
+                    log.warning(f"{pending} filas de {name} en la partición por defecto, se mueven a {name}")
+                    self._execute(
+                        (f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                         f"{self.storage}", None),
+                        (f"WITH moved AS (DELETE FROM {default} WHERE timestamp >= %s AND timestamp < %s "
+                         f"RETURNING *) INSERT INTO {name} SELECT * FROM moved", (start, end)),
+                        (f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end)),
+                    )
+                else:
+                    self._execute((f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)"
+                                   f"{self.storage}", (start, end)))
+                partitions.append(Partition(name, start, end))
+            start = end
+
+    def expire(self, table, now=None):
+        """
+        Aplica la retención a las particiones cuyo límite superior es anterior
+        al instante actual menos la retención.
+        """
+        if self.retention is None:
+            return
+        cutoff = (now or datetime.now()) - self.retention
+        for partition in self.partitions(table):
+            if partition.default or partition.upper is None or partition.upper > cutoff:
+                continue
+            if self.action == ACTION_ARCHIVE:
+                self._archive(table, partition.name)
+            statements = [(f"ALTER TABLE {table} DETACH PARTITION {partition.name}", None)]
+            if self.action != ACTION_DETACH:
+                statements.append((f"DROP TABLE {partition.name}", None))
+            self._execute(*statements)
+
+    def _archive(self, table, name):
+        """
+        Exporta una partición a <archive_dir>/<tabla>/<partición>.csv[.gz] con encabezado de columnas.
+        """
+        method, level = self.compression
+        directory = os.path.join(self.archive_dir, table)
+        path = os.path.join(directory, f"{name}.csv{EXTENSIONS[method]}")
+        log.info(f"Archivando {name} en {path}")
+        self.actions.append(f"COPY {name} TO {path}")
+        if self.dry_run:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open_segment(f"{path}.tmp", method, level, 'wb') as f:
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        self.conn.rollback()
+        os.replace(f"{path}.tmp", path)
+
+    def maintain(self, table, convert=False, now=None):
+        """
+        Mantenimiento completo de una tabla: conversión (si se pide), particiones futuras y retención.
+
+        :return: True si la tabla está particionada
+        """
+        if not self.is_partitioned(table):
+            if not convert:
+                log.warning(f"La tabla {table} no está particionada (usar --convert)")
+                return False
+            self.convert(table, now)
+            if self.dry_run:
+                return True
+        self.create_future(table, now)
+        self.expire(table, now)
+        return True
+
+
+def parse_args(config, tables, argv=None):
+    parser = argparse.ArgumentParser(description="Mantenimiento de las particiones de las tablas de captura.")
+    parser.add_argument('-t', '--tables', nargs='+', metavar='TABLA', choices=tables, default=tables,
+                        help="tablas a mantener (por defecto, todas las tablas de captura)")
+    parser.add_argument('--convert', action='store_true',
+                        help="convierte en particionadas las tablas que aún no lo están")
+    parser.add_argument('--interval', choices=INTERVALS, default=config.get('partition_interval', INTERVAL_MONTH),
+                        help="tamaño de cada partición")
+    parser.add_argument('--premake', type=int, default=config.get('partition_premake', 3),
+                        help="particiones futuras creadas por adelantado")
+    parser.add_argument('--retention-days', type=int, default=config.get('partition_retention_days'),
+                        help="días de retención (por defecto se conserva todo)")
+    parser.add_argument('--action', choices=ACTIONS, default=config.get('partition_retention_action', ACTION_DROP),
+                        help="acción sobre las particiones vencidas")
+    parser.add_argument('--dry-run', action='store_true', help="muestra las sentencias sin ejecutarlas")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        config = load_config()
+        blocks = capture_blocks(config)
+        args = parse_args(config, sorted(blocks), argv)
+        conn = connect_config(config)()
+        manager = PartitionManager(
+            conn, interval=args.interval, premake=args.premake,
+            retention=timedelta(days=args.retention_days) if args.retention_days else None,
+            action=args.action, dry_run=args.dry_run,
+            archive_dir=config.get('partition_archive_dir', os.path.join(os.path.dirname(CONFIG_FILE), 'archive')),
+            compression=config.get('partition_archive_compression', 'gzip'),
+            storage=storage_parameters(config))
+        try:
+            for table in args.tables:
+                if config.get('raw_frames', False):
+                    # Se particiona la tabla de tramas; la vista se recrea porque
+                    # la conversión la deja apuntando a la partición <tabla>_raw_legacy
+                    frames = raw_frames.RawFrames(conn, dry_run=args.dry_run)
+                    frames.check(blocks[table])
+                    if manager.maintain(raw_frames.raw_table(table), convert=args.convert) and args.convert:
+                        frames.create(blocks[table])
+                else:
+                    manager.maintain(table, convert=args.convert)
+        finally:
+            conn.close()
+        print(f"Mantenimiento de particiones completado: {len(manager.actions)} operaciones.")
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3.12
+
+# Modo en tubería (pipeline) para los scripts de captura: el hilo de adquisición
+# solo lee Modbus y encola las lecturas sin decodificar en una cola acotada en
+# memoria; un hilo escritor separado las vacía hacia PostgreSQL. Así la latencia
+# de la base de datos no retrasa el siguiente ciclo de muestreo.
+
+import time                                         # Reloj monotónico
+import threading                                    # Hilo escritor y sincronización
+import logging                                      # Para registro de eventos e información de depuración
+from collections import deque                       # Cola acotada
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+QUEUE_DEPTH = metrics.gauge('scada_queue_depth', "Lecturas en la cola entre adquisición y escritura", ('source',))
+QUEUE_DROPPED = metrics.counter('scada_queue_dropped_total', "Lecturas descartadas con la cola llena", ('source',))
+QUEUE_SPILLED = metrics.counter('scada_queue_spilled_total', "Lecturas pasadas al spool con la cola llena", ('source',))
+
+# Políticas ante una cola llena
+OVERFLOW_BLOCK = 'block'                # La adquisición espera a que haya espacio
+OVERFLOW_DROP_OLDEST = 'drop_oldest'    # Se descarta la lectura más antigua
+OVERFLOW_SPILL = 'spill'                # La lectura más antigua pasa al spool en disco
+
+
+class FrameQueue:
+    """
+    Cola acotada de lecturas (bloque, instante, registros) entre el hilo de
+    adquisición y el hilo escritor, con métricas de profundidad.
+
+    Expone ``add_frame`` y ``maybe_flush`` con la misma firma que
+    BufferedWriter, de modo que el bucle de captura puede usar indistintamente
+    el escritor directo o la cola.
+    """
+
+    def __init__(self, maxsize, policy=OVERFLOW_BLOCK, spool=None, block_timeout=None, name='captura'):
+        """
+        :param maxsize: cantidad máxima de lecturas en cola
+        :param policy: política ante cola llena ('block', 'drop_oldest' o 'spill')
+        :param spool: instancia de spool.Spool, requerida por la política 'spill'
+        :param block_timeout: segundos máximos de espera en 'block' antes de descartar (None espera siempre)
+        :param name: origen de las lecturas, etiqueta 'source' de las métricas de la cola
+        """
+        if policy not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL):
+            raise ValueError(f"Política de cola desconocida: {policy}")
+        if policy == OVERFLOW_SPILL and spool is None:
+            log.warning("Política 'spill' sin spool configurado, se usa 'drop_oldest'")
+            policy = OVERFLOW_DROP_OLDEST
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spool = spool
+        self.block_timeout = block_timeout
+        self.name = name
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Métricas
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked_time = 0.0
+        self.high_water = 0
+
+    @property
+    def depth(self):
+        """
+        Lecturas actualmente en cola.
+        """
+        return len(self._items)
+
+    def metrics(self):
+        """
+        Diccionario con las métricas de la cola.
+        """
+        return {
+            'depth': self.depth,
+            'high_water': self.high_water,
+            'capacity': self.maxsize,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'blocked_seconds': self.blocked_time,
+        }
+
+    def add_frame(self, block, timestamp, registers):
+        """
+        Encola una lectura aplicando la política de desborde si la cola está llena.
+
+        :param block: bloque compilado (register_map.CompiledBlock)
+        :param timestamp: instante de adquisición
+        :param registers: lista de registros leídos
+        """
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.policy == OVERFLOW_BLOCK:
+                    start = time.monotonic()
+                    self._cond.wait_for(lambda: len(self._items) < self.maxsize or self._closed,
+                                        self.block_timeout)
+                    self.blocked_time += time.monotonic() - start
+                    if len(self._items) >= self.maxsize:
+                        self.dropped += 1
+                        QUEUE_DROPPED.inc((self.name,))
+                        log.warning(f"Cola llena tras {self.block_timeout} s, se descarta la lectura de {block.table}")
+                        return
+                else:
+                    old_block, old_timestamp, old_registers = self._items.popleft()
+                    if self.policy == OVERFLOW_SPILL:
+                        try:
+                            self.spool.append_frames(old_block, [old_timestamp], [old_registers])
+                            self.spilled += 1
+                            QUEUE_SPILLED.inc((self.name,))
+                        except OSError as e:
+                            log.error(f"No se pudo pasar la lectura al spool: {e}")
+                            self.dropped += 1
+                            QUEUE_DROPPED.inc((self.name,))
+                    else:
+                        self.dropped += 1
+                        QUEUE_DROPPED.inc((self.name,))
+            self._items.append((block, timestamp, registers))
+            self.enqueued += 1
+            self.high_water = max(self.high_water, len(self._items))
+            self._cond.notify_all()
+
+    def maybe_flush(self):
+        """
+        Sin efecto: el vaciado lo realiza el hilo escritor.
+        """
+
+    def get_batch(self, max_items, timeout):
+        """
+        Extrae hasta ``max_items`` lecturas, esperando a lo sumo ``timeout`` segundos.
+
+        :return: lista de tuplas (bloque, instante, registros), posiblemente vacía
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            batch = []
+            while self._items and len(batch) < max_items:
+                batch.append(self._items.popleft())
+            if batch:
+                self._cond.notify_all()
+            return batch
+
+    def close(self):
+        """
+        Marca la cola como cerrada; el hilo escritor termina al vaciarla.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class WriterThread(threading.Thread):
+    """
+    Hilo escritor: vacía la FrameQueue hacia un BufferedWriter y hace el
+    vaciado final del escritor cuando la cola se cierra.
+    """
+
+    def __init__(self, queue, writer, report_every=None, name='writer'):
+        """
+        :param queue: FrameQueue de la que se leen las lecturas
+        :param writer: BufferedWriter que escribe en PostgreSQL (o en el spool)
+        :param report_every: segundos entre registros de métricas de la cola (None desactiva)
+        :param name: nombre del hilo para los mensajes de log
+        """
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.writer = writer
+        self.report_every = report_every
+
+    def run(self):
+        last_report = time.monotonic()
+        # Espera máxima por lote: la latencia de vaciado del escritor sigue vigente
+        timeout = min(0.5, self.writer.max_latency)
+        while not (self.queue.closed and self.queue.depth == 0):
+            try:
+                for block, timestamp, registers in self.queue.get_batch(self.writer.max_rows, timeout):
+                    self.writer.add_frame(block, timestamp, registers)
+                self.writer.maybe_flush()
+            except Exception as e:
+                log.error(f"[{self.name}] Error inesperado en el hilo escritor: {e}")
+                time.sleep(timeout)
+
+            QUEUE_DEPTH.set(self.queue.depth, (self.queue.name,))
+            now = time.monotonic()
+            if self.report_every and now - last_report >= self.report_every:
+                log.info(f"[{self.name}] Cola: {self.queue.metrics()}")
+                last_report = now
+        self.writer.close()
+
+    def stop(self, timeout=None):
+        """
+        Cierra la cola y espera a que el hilo escriba las lecturas pendientes.
+        """
+        self.queue.close()
+        self.join(timeout)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3.12
+
+# Almacenamiento compacto de las lecturas como tramas de registros. En lugar
+# de una fila con una columna double por campo, cada lectura se guarda como su
+# instante y los registros de 16 bits del bloque tal como llegan por Modbus
+# (bytea big-endian, dos bytes por registro) en <tabla>_raw. Una vista con el
+# nombre original (<tabla>) decodifica las tramas al consultarla, con la
+# escala, el signo y el orden de palabras del mapa de registros y las mismas
+# columnas de antes, de modo que Grafana, los agregados (rollup.py), el
+# almacenamiento en frío y las consultas existentes siguen funcionando. Un
+# trigger INSTEAD OF INSERT acepta filas decodificadas en la vista (COPY de
+# las restauraciones, importaciones desde el almacenamiento en frío) y las
+# codifica de vuelta a tramas.
+#
+# Con 'raw_frames' en config.json el escritor (db_writer.py) y el spool
+# escriben las tramas directamente en <tabla>_raw. raw_frames.py --create crea
+# las tablas y vistas en una base nueva; --convert transforma las tablas
+# existentes y verifica que las vistas reproduzcan exactamente sus valores.
+
+import sys
+import json
+import argparse
+import logging                                      # Para registro de eventos e información de depuración
+from array import array                             # Tramas como arreglos de registros de 16 bits
+from incremental_backup import connect_config, INGEST_DEFINITION
+import scada_config                                 # Configuración y mapa de registros
+from register_map import WORD_ORDER_BIG
+
+log = logging.getLogger()
+
+RAW_SUFFIX = '_raw'
+RAW_COLUMNS = ('timestamp', 'frame')
+RAW_DEFINITION = f"timestamp timestamp NOT NULL, frame bytea NOT NULL, {INGEST_DEFINITION}"
+
+
+def raw_table(table):
+    """
+    Tabla de tramas de una tabla de captura.
+    """
+    return f"{table}{RAW_SUFFIX}"
+
+
+def pack_frame(registers):
+    """
+    Trama de una lectura: los registros en big-endian, dos bytes cada uno.
+    """
+    frame = array('H', registers)
+    if sys.byteorder == 'little':
+        frame.byteswap()
+    return frame.tobytes()
+
+
+def _word_offsets(field):
+    """
+    Posiciones de la palabra alta y baja de un campo de 32 bits.
+    """
+    if field.word_order == WORD_ORDER_BIG:
+        return field.offset, field.offset + 1
+    return field.offset + 1, field.offset
+
+
+def _register_sql(offset):
+    return f"(get_byte(frame, {2 * offset}) << 8 | get_byte(frame, {2 * offset + 1}))"
+
+
+def field_sql(field):
+    """
+    Expresión SQL que decodifica el campo a partir de la columna ``frame``,
+    equivalente a Field.expression (el resultado es double precision, como
+    las columnas de las tablas de captura).
+    """
+    if field.words == 2:
+        hi, lo = _word_offsets(field)
+        expr = f"({_register_sql(hi)}::bigint << 16 | {_register_sql(lo)})"
+        if field.signed:
+            expr = f"(({expr} # 2147483648) - 2147483648)"
+    else:
+        expr = _register_sql(field.offset)
+        if field.signed:
+            expr = f"(({expr} # 32768) - 32768)"
+    if field.divisor:
+        return f"{expr} / {float(field.divisor)!r}::double precision"
+    return f"{expr}::double precision"
+
+
+def frame_sql(block, prefix=''):
+    """
+    Expresión SQL que codifica los valores decodificados de una fila en su
+    trama (inversa de field_sql). Los registros sin campo y los valores nulos
+    se guardan como cero.
+
+    :param prefix: prefijo de las columnas (por ejemplo 'NEW.' en un trigger)
+    """
+    registers = [None] * block.count
+    for field in block.fields:
+        scaled = f"{prefix}{field.name} * {float(field.divisor)!r}" if field.divisor else f"{prefix}{field.name}"
+        raw = f"coalesce(round({scaled}), 0)::bigint"
+        if field.words == 2:
+            hi, lo = _word_offsets(field)
+            registers[hi] = f"({raw} >> 16) & 65535"
+            registers[lo] = f"{raw} & 65535"
+        else:
+            registers[field.offset] = f"{raw} & 65535"
+    return ' || '.join(r"'\x0000'::bytea" if register is None
+                       else f"int2send(((({register}) # 32768) - 32768)::smallint)" for register in registers)
+
+
+def view_sql(block):
+    """
+    Vista de decodificación de un bloque y trigger de inserción sobre ella.
+
+    :return: lista de sentencias SQL
+    """
+    table, raw = block.table, raw_table(block.table)
+    columns = ''.join(f",\n    {field_sql(field)} AS {field.name}" for field in block.fields)
+    return [
+        f"CREATE OR REPLACE VIEW {table} AS\nSELECT timestamp{columns}\nFROM {raw}",
+        f"CREATE OR REPLACE FUNCTION {table}_encode() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        f"BEGIN\n"
+        f"    INSERT INTO {raw} (timestamp, frame) VALUES (NEW.timestamp, {frame_sql(block, 'NEW.')});\n"
+        f"    RETURN NEW;\n"
+        f"END $$",
+        f"CREATE OR REPLACE TRIGGER {table}_encode INSTEAD OF INSERT ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION {table}_encode()",
+    ]
+
+
+def schema_sql(block):
+    """
+    Tabla de tramas, índice BRIN por instante (las filas llegan en orden), vista y trigger de un bloque.
+
+    :return: lista de sentencias SQL
+    """
+    raw = raw_table(block.table)
+    return [f"CREATE TABLE IF NOT EXISTS {raw} ({RAW_DEFINITION})",
+            f"CREATE INDEX IF NOT EXISTS {raw}_timestamp_brin ON {raw} USING brin (timestamp)"] + view_sql(block)
+
+
+def storage_tables(config, blocks):
+    """
+    Tablas que guardan los datos de los bloques: <tabla>_raw con 'raw_frames', o las tablas de captura.
+
+    :return: diccionario tabla de almacenamiento -> objeto con ``columns``
+    """
+    if not config.get('raw_frames', False):
+        return blocks
+    return {raw_table(table): RawTable(block) for table, block in blocks.items()}
+
+
+class RawTable:
+    """
+    Tabla de tramas de un bloque, con las columnas que usan los respaldos incrementales.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        self.table = raw_table(block.table)
+        self.columns = RAW_COLUMNS
+
+
+class RawFrames:
+    """
+    Creación y conversión de las tablas de tramas. Cada tabla se convierte en
+    su propia transacción.
+    """
+
+    def __init__(self, conn, dry_run=False):
+        """
+        :param conn: conexión psycopg2
+        :param dry_run: solo registra las sentencias, sin ejecutarlas
+        """
+        self.conn = conn
+        self.dry_run = dry_run
+        self.actions = []
+
+    def _execute(self, statements):
+        with self.conn.cursor() as cursor:
+            for sql in statements:
+                self.actions.append(sql)
+                log.info(sql if len(sql) < 200 else f"{sql[:200]}...")
+                if not self.dry_run:
+                    cursor.execute(sql)
+
+    def _relkind(self, table):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def check(self, block):
+        """
+        Verifica que la tabla de captura de un bloque no exista o sea ya la vista de sus tramas.
+        """
+        if self._relkind(block.table) not in (None, 'v'):
+            raise ValueError(f"La tabla {block.table} ya existe con columnas por campo (usar --convert)")
+
+    def create(self, block):
+        """
+        Crea la tabla de tramas y la vista de un bloque sin tabla de captura
+        (o actualiza la vista tras cambiar el mapa de registros).
+        """
+        self.check(block)
+        self._execute(schema_sql(block))
+        self.conn.commit()
+
+    def convert(self, block, keep_wide=False):
+        """
+        Convierte la tabla de captura de un bloque: la tabla pasa a llamarse
+        <tabla>_wide, sus filas se codifican en <tabla>_raw y se crea la vista.
+        Antes de confirmar se verifica que la vista reproduzca exactamente
+        todas las filas; si no, la conversión se revierte.
+
+        :param keep_wide: conserva <tabla>_wide en lugar de eliminarla
+        :return: filas convertidas
+        """
+        table, raw, wide = block.table, raw_table(block.table), f"{block.table}_wide"
+        kind = self._relkind(table)
+        if kind == 'v':
+            log.info(f"{table} ya guarda tramas en {raw}")
+            return 0
+        if kind is None:
+            raise ValueError(f"La tabla {table} no existe (usar --create)")
+        if kind == 'p':
+            raise ValueError(f"La tabla {table} está particionada: convertirla antes de particionar "
+                             f"(partition_manager.py particiona {raw} con 'raw_frames')")
+        columns = ', '.join(block.columns)
+        try:
+            self._execute([f"ALTER TABLE {table} RENAME TO {wide}"] + schema_sql(block)[:2] +
+                          [f"INSERT INTO {raw} (timestamp, frame) SELECT timestamp, {frame_sql(block)} "
+                           f"FROM {wide} ORDER BY timestamp"] + view_sql(block))
+            rows = 0
+            if not self.dry_run:
+                with self.conn.cursor() as cursor:
+                    cursor.execute(f"SELECT count(*) FROM {wide}")
+                    rows = cursor.fetchone()[0]
+                    cursor.execute(f"SELECT count(*) FROM (SELECT {columns} FROM {wide} "
+                                   f"EXCEPT ALL SELECT {columns} FROM {table}) differences")
+                    differences = cursor.fetchone()[0]
+                if differences:
+                    raise ValueError(f"{differences} filas de {table} no se reproducen exactamente desde "
+                                     "sus registros (valores nulos o fuera de la escala del mapa)")
+            if not keep_wide:
+                self._execute([f"DROP TABLE {wide}"])
+            # Estadísticas para el planificador (y para --report) de la tabla recién cargada
+            self._execute([f"ANALYZE {raw}"])
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        log.info(f"{table}: {rows} filas convertidas a tramas en {raw}")
+        return rows
+
+    def report(self, blocks):
+        """
+        Tamaño total (con índices y TOAST) y bytes por fila de cada tabla, según
+        el almacenamiento que usa.
+
+        :return: lista de (tabla, almacenamiento, filas estimadas, bytes)
+        """
+        report = []
+        for table, block in blocks.items():
+            storage = raw_table(table) if self._relkind(table) == 'v' else table
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT greatest(reltuples, 0)::bigint, pg_total_relation_size(oid) "
+                               "FROM pg_class WHERE oid = to_regclass(%s)", (storage,))
+                row = cursor.fetchone()
+            if row is not None:
+                report.append((table, storage) + row)
+        self.conn.rollback()
+        return report
+
+
+def parse_args(tables, argv=None):
+    parser = argparse.ArgumentParser(description="Almacenamiento de las lecturas como tramas de registros.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--create', action='store_true',
+                        help="crea las tablas de tramas y las vistas (base nueva) o actualiza las vistas")
+    action.add_argument('--convert', action='store_true',
+                        help="convierte las tablas de captura existentes a tramas")
+    action.add_argument('--report', action='store_true', help="muestra el tamaño de cada tabla y sus bytes por fila")
+    parser.add_argument('-t', '--tables', nargs='+', metavar='TABLA', choices=tables, default=tables,
+                        help="tablas a procesar (por defecto, todas las tablas de captura)")
+    parser.add_argument('--keep-wide', action='store_true',
+                        help="con --convert, conserva las tablas originales como <tabla>_wide")
+    parser.add_argument('--dry-run', action='store_true', help="muestra las sentencias sin ejecutarlas")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        config = scada_config.load_config()
+        blocks = scada_config.capture_blocks(config)
+        args = parse_args(sorted(blocks), argv)
+        conn = connect_config(config)()
+        manager = RawFrames(conn, dry_run=args.dry_run)
+        try:
+            if args.report:
+                print(f"{'Tabla':<16} {'Almacenamiento':<20} {'Filas':>12} {'Tamaño':>12} {'B/fila':>8}")
+                for table, storage, rows, size in manager.report({t: blocks[t] for t in args.tables}):
+                    print(f"{table:<16} {storage:<20} {rows:>12} {scada_config.format_bytes(size):>12} "
+                          f"{size / rows if rows else 0:>8.1f}")
+            else:
+                for table in args.tables:
+                    if args.create:
+                        manager.create(blocks[table])
+                    else:
+                        manager.convert(blocks[table], keep_wide=args.keep_wide)
+                print(f"Tablas de tramas: {len(manager.actions)} sentencias.")
+        finally:
+            conn.close()
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{scada_config.CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{scada_config.CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
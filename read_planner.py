@@ -0,0 +1,273 @@
+#!/usr/bin/env python3.12
+
+# Planificador de lecturas Modbus. En lugar de leer cada bloque del mapa de
+# registros completo con su propia petición, calcula a partir de los campos
+# realmente usados el conjunto de peticiones de menor costo por dispositivo:
+# une rangos cuando leer el hueco intermedio cuesta menos que una petición
+# más, y divide en el límite de 125 registros por petición de Modbus.
+#
+# Como script, muestra el plan de cada dispositivo del mapa y, con --measure,
+# ejecuta ciclos contra los equipos e informa peticiones por ciclo y RTT.
+
+import os
+import sys
+import json
+import time                                         # Reloj monotónico para el RTT
+import argparse
+import logging                                      # Para registro de eventos e información de depuración
+from register_map import load_register_map          # Decodificación declarativa de registros
+from device_manager import ModbusDevice             # Conexión Modbus por dispositivo con backoff
+from scada_config import load_config, CONFIG_FILE  # Configuración compartida con los respaldos
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+MAX_REGISTERS = 125             # Registros máximos por petición de lectura (límite de la PDU)
+DEFAULT_REQUEST_COST = 32       # Costo de una petición adicional, en registros leídos equivalentes
+
+READ_SECONDS = metrics.histogram('scada_modbus_read_seconds', "Tiempo de ida y vuelta de cada petición Modbus", ('device',))
+READ_FAILURES = metrics.counter('scada_modbus_read_failures_total', "Peticiones Modbus fallidas u omitidas con el circuito abierto", ('device',))
+REGISTERS_READ = metrics.counter('scada_modbus_registers_read_total', "Registros leídos", ('device',))
+REQUESTS_PER_CYCLE = metrics.gauge('scada_modbus_requests_per_cycle', "Peticiones Modbus por ciclo según el plan", ('device',))
+
+
+class ReadStats:
+    """
+    Estadísticas acumuladas de las lecturas de un plan: peticiones y
+    registros por ciclo y tiempo de ida y vuelta (RTT) de cada petición.
+    """
+
+    def __init__(self):
+        self.cycles = 0
+        self.requests = 0
+        self.registers = 0
+        self.failures = 0
+        self.rtt_total = 0.0
+        self.rtt_max = 0.0
+        self.bus_max = 0.0      # Tiempo máximo de lectura de un ciclo completo
+
+    def add(self, count, rtt, ok):
+        self.requests += 1
+        self.registers += count
+        self.rtt_total += rtt
+        self.rtt_max = max(self.rtt_max, rtt)
+        if not ok:
+            self.failures += 1
+
+    def summary(self):
+        """
+        Resumen legible de las estadísticas para el log.
+        """
+        cycles = self.cycles or 1
+        requests = self.requests or 1
+        return (f"peticiones/ciclo={self.requests / cycles:.2f} registros/ciclo={self.registers / cycles:.1f} "
+                f"fallidas={self.failures} rtt_medio={self.rtt_total / requests * 1000:.2f}ms "
+                f"rtt_max={self.rtt_max * 1000:.2f}ms bus/ciclo={self.rtt_total / cycles * 1000:.2f}ms "
+                f"bus_max={self.bus_max * 1000:.2f}ms")
+
+
+def plan_ranges(needed, readable=None, max_count=MAX_REGISTERS, request_cost=DEFAULT_REQUEST_COST):
+    """
+    Calcula las peticiones de menor costo que cubren las direcciones necesarias.
+
+    El costo de un plan es ``request_cost`` por petición más los registros
+    leídos; se minimiza por programación dinámica sobre las direcciones
+    ordenadas, de modo que un hueco solo se lee si cuesta menos que una
+    petición adicional y ninguna petición supera ``max_count`` registros.
+
+    :param needed: direcciones Modbus que deben leerse
+    :param readable: direcciones que pueden leerse sin error (None permite leer cualquier hueco)
+    :param max_count: registros máximos por petición
+    :param request_cost: costo de una petición, en registros equivalentes
+    :return: lista ordenada de tuplas (dirección, cantidad)
+    """
+    addresses = sorted(set(needed))
+    n = len(addresses)
+    best = [0.0] + [float('inf')] * n
+    start = [0] * (n + 1)
+    for j in range(1, n + 1):
+        last = addresses[j - 1]
+        for i in range(j - 1, -1, -1):
+            first = addresses[i]
+            span = last - first + 1
+            if span > max_count:
+                break
+            # Un hueco entre direcciones necesarias solo se lee si es legible
+            if i < j - 1 and readable is not None and addresses[i + 1] - first > 1 and \
+                    not all(a in readable for a in range(first + 1, addresses[i + 1])):
+                break
+            cost = best[i] + request_cost + span
+            if cost < best[j]:
+                best[j], start[j] = cost, i
+    ranges = []
+    j = n
+    while j > 0:
+        i = start[j]
+        ranges.append((addresses[i], addresses[j - 1] - addresses[i] + 1))
+        j = i
+    return ranges[::-1]
+
+
+class ReadPlan:
+    """
+    Plan de lectura de los bloques de un dispositivo.
+
+    ``execute`` realiza las peticiones del plan y entrega cada bloque, con la
+    lista de registros de tamaño ``block.count`` que espera su decodificación,
+    en cuanto terminan las peticiones que lo cubren. Los registros que ningún
+    campo usa y no se leyeron quedan en cero.
+
+    Sin ``coalesce`` el plan es el de los scripts originales: una petición por
+    bloque completo (dividida si supera el límite), con las mismas estadísticas.
+    """
+
+    def __init__(self, blocks, coalesce=True, request_cost=DEFAULT_REQUEST_COST,
+                 bridge_unmapped=False, max_count=MAX_REGISTERS):
+        """
+        :param blocks: lista de bloques compilados de un dispositivo
+        :param coalesce: True para leer solo los registros usados, uniendo y dividiendo rangos
+        :param request_cost: costo de una petición adicional, en registros equivalentes
+        :param bridge_unmapped: permite leer huecos fuera de los bloques declarados
+                                (algunos equipos responden con error a direcciones no mapeadas)
+        :param max_count: registros máximos por petición
+        """
+        self.blocks = list(blocks)
+        if coalesce:
+            needed = {block.address + offset for block in self.blocks
+                      for f in block.fields for offset in range(f.offset, f.offset + f.words)}
+            readable = None if bridge_unmapped else \
+                {a for block in self.blocks for a in range(block.address, block.address + block.count)}
+            self.requests = plan_ranges(needed, readable, max_count, request_cost)
+        else:
+            self.requests = [(block.address + offset, min(max_count, block.count - offset))
+                             for block in self.blocks for offset in range(0, block.count, max_count)]
+
+        # Por bloque: tramos (petición, origen, destino, largo) que copian los
+        # registros leídos a la lista del bloque, y la última petición que lo cubre
+        self._segments = []
+        for block in self.blocks:
+            segments = []
+            for index, (address, count) in enumerate(self.requests):
+                lower = max(address, block.address)
+                upper = min(address + count, block.address + block.count)
+                if lower < upper:
+                    segments.append((index, lower - address, lower - block.address, upper - lower))
+            self._segments.append(segments)
+        self._ready = {}        # índice de la última petición -> bloques que completa
+        for position, segments in enumerate(self._segments):
+            last = max((s[0] for s in segments), default=-1)
+            self._ready.setdefault(last, []).append(position)
+        self.stats = ReadStats()
+
+    @property
+    def registers(self):
+        """
+        Registros leídos por ciclo.
+        """
+        return sum(count for _, count in self.requests)
+
+    def execute(self, device):
+        """
+        Realiza las peticiones de un ciclo.
+
+        :param device: device_manager.ModbusDevice
+        :return: generador de tuplas (bloque, registros o None si alguna petición del bloque falló)
+        """
+        results = []
+        labels = (device.name,)
+        REQUESTS_PER_CYCLE.set(len(self.requests), labels)
+        cycle_start = time.monotonic()
+        for position in self._ready.get(-1, []):
+            yield self.blocks[position], [0] * self.blocks[position].count
+        for index, (address, count) in enumerate(self.requests):
+            start = time.monotonic()
+            registers = device.read(address, count)
+            rtt = time.monotonic() - start
+            self.stats.add(count, rtt, registers is not None)
+            if registers is None:
+                READ_FAILURES.inc(labels)
+            else:
+                READ_SECONDS.observe(rtt, labels)
+                REGISTERS_READ.inc(labels, count)
+            results.append(registers)
+            for position in self._ready.get(index, []):
+                yield self.blocks[position], self._assemble(position, results)
+        self.stats.cycles += 1
+        self.stats.bus_max = max(self.stats.bus_max, time.monotonic() - cycle_start)
+
+    def _assemble(self, position, results):
+        block = self.blocks[position]
+        frame = [0] * block.count
+        for index, source, target, length in self._segments[position]:
+            registers = results[index]
+            if registers is None:
+                return None
+            frame[target:target + length] = registers[source:source + length]
+        return frame
+
+    def describe(self):
+        """
+        Descripción legible del plan: peticiones y registros frente a una lectura por bloque.
+        """
+        original = sum(-(-block.count // MAX_REGISTERS) for block in self.blocks)
+        requests = ', '.join(f"{address}/{count}" for address, count in self.requests)
+        return (f"{len(self.requests)} peticiones ({original} por bloque), "
+                f"{self.registers} registros ({sum(b.count for b in self.blocks)} por bloque): {requests}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plan de lecturas Modbus de los dispositivos del mapa de registros.")
+    parser.add_argument('-d', '--devices', nargs='+', metavar='DISPOSITIVO',
+                        help="dispositivos a planificar (por defecto, todos los del mapa)")
+    parser.add_argument('--request-cost', type=int,
+                        help="costo de una petición adicional en registros equivalentes")
+    parser.add_argument('--bridge-unmapped', action='store_true',
+                        help="permite leer huecos fuera de los bloques declarados")
+    parser.add_argument('--measure', type=int, default=0, metavar='CICLOS',
+                        help="ejecuta los ciclos indicados contra los equipos, con y sin el plan, e informa el RTT")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+    try:
+        config = load_config()
+        register_map = load_register_map(config.get('register_map_file',
+                                                     os.path.join(os.path.dirname(CONFIG_FILE), 'register_map.json')))
+        request_cost = args.request_cost or config.get('read_request_cost', DEFAULT_REQUEST_COST)
+        bridge = args.bridge_unmapped or config.get('read_bridge_unmapped', False)
+        for name in args.devices or register_map:
+            blocks = register_map[name]
+            plan = ReadPlan(blocks, request_cost=request_cost, bridge_unmapped=bridge)
+            print(f"{name}: {plan.describe()}")
+            if not args.measure:
+                continue
+            device = ModbusDevice(name.upper(), config[f'modbus_ip_{name}'], config['modbus_port'],
+                                  timeout=config.get('modbus_timeout', 3))
+            try:
+                for label, candidate in (("por bloque", ReadPlan(blocks, coalesce=False)), ("plan", plan)):
+                    for _ in range(args.measure):
+                        for _ in candidate.execute(device):
+                            pass
+                    print(f"  {label}: {candidate.stats.summary()}")
+            finally:
+                device.close()
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración o en el mapa de registros.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3.12
+
+# Motor de decodificación declarativo para los bloques de registros Modbus.
+# El mapa de registros (register_map.json) describe, por dispositivo y bloque,
+# la tabla destino y cada campo: desplazamiento, divisor de escala, signo y
+# emparejamiento de dos palabras de 16 bits (y, opcionalmente, la tolerancia
+# del registro por excepción, ver deadband.py, y las reglas de la captura en
+# ráfaga del bloque, ver burst.py). Al iniciar, cada bloque se compila
+# una sola vez en una función de decodificación y en las sentencias SQL de
+# inserción, de modo que agregar un campo o un dispositivo implica editar datos
+# y no código.
+
+import json                                         # Para leer el mapa de registros
+import logging                                      # Para registro de eventos e información de depuración
+
+try:
+    import numpy as np                              # Decodificación vectorizada de lotes (opcional)
+except ImportError:
+    np = None
+
+log = logging.getLogger()
+
+# Orden de palabras para los campos de 32 bits
+WORD_ORDER_BIG = 'big'          # Palabra alta primero (registro N = bits 31..16)
+WORD_ORDER_LITTLE = 'little'    # Palabra baja primero
+
+
+def _s16(value):
+    """
+    Interpreta un registro de 16 bits como entero con signo (complemento a dos).
+    """
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def _s32(value):
+    """
+    Interpreta un valor de 32 bits como entero con signo (complemento a dos).
+    """
+    return value - 0x100000000 if value & 0x80000000 else value
+
+
+class Field:
+    """
+    Definición de un campo dentro de un bloque de registros.
+    """
+
+    def __init__(self, name, offset, divisor=None, signed=False, words=1, word_order=WORD_ORDER_BIG,
+                 deadband=None):
+        """
+        :param name: nombre de la columna destino
+        :param offset: posición del (primer) registro dentro del bloque
+        :param divisor: divisor de escala (None deja el valor entero sin escalar)
+        :param signed: True si el valor se interpreta en complemento a dos
+        :param words: 1 para valores de 16 bits, 2 para valores de 32 bits
+        :param word_order: 'big' o 'little' para los valores de 32 bits
+        :param deadband: tolerancia absoluta, en unidades escaladas, del registro por excepción (None registra cualquier cambio)
+        """
+        if words not in (1, 2):
+            raise ValueError(f"Campo {name}: 'words' debe ser 1 o 2")
+        if word_order not in (WORD_ORDER_BIG, WORD_ORDER_LITTLE):
+            raise ValueError(f"Campo {name}: 'word_order' desconocido: {word_order}")
+        self.name = name
+        self.offset = offset
+        self.divisor = divisor
+        self.signed = signed
+        self.words = words
+        self.word_order = word_order
+        self.deadband = deadband
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['offset'], divisor=data.get('divisor'),
+                   signed=data.get('signed', False), words=data.get('words', 1),
+                   word_order=data.get('word_order', WORD_ORDER_BIG), deadband=data.get('deadband'))
+
+    @property
+    def last_offset(self):
+        return self.offset + self.words - 1
+
+    def expression(self):
+        """
+        Expresión de Python que decodifica el campo a partir de la lista ``r``.
+        """
+        if self.words == 2:
+            hi, lo = (self.offset, self.offset + 1) if self.word_order == WORD_ORDER_BIG \
+                else (self.offset + 1, self.offset)
+            expr = f"((r[{hi}] << 16) | r[{lo}])"
+            if self.signed:
+                expr = f"_s32{expr}"
+        else:
+            expr = f"r[{self.offset}]"
+            if self.signed:
+                expr = f"_s16({expr})"
+        if self.divisor:
+            expr = f"{expr}/{self.divisor}"
+        return expr
+
+
+class CompiledBlock:
+    """
+    Bloque de registros compilado: dirección Modbus, tabla destino, columnas,
+    sentencias SQL preparadas y función de decodificación generada una sola vez.
+    """
+
+    def __init__(self, device, name, table, address, count, fields, heartbeat=None, burst=None):
+        """
+        :param device: clave del dispositivo en el mapa (por ejemplo 'apis2_pb')
+        :param name: nombre del bloque dentro del dispositivo
+        :param table: tabla destino en PostgreSQL
+        :param address: dirección Modbus inicial del bloque
+        :param count: cantidad de registros a leer
+        :param fields: lista de objetos Field
+        :param heartbeat: segundos máximos sin guardar una fila en el registro por excepción (None usa el valor general)
+        :param burst: configuración de la captura en ráfaga del bloque (ventanas y disparadores, ver burst.py)
+        """
+        for field in fields:
+            if field.offset < 0 or field.last_offset >= count:
+                raise ValueError(f"Bloque {device}.{name}: el campo {field.name} "
+                                 f"(offset {field.offset}) está fuera del bloque de {count} registros")
+        self.device = device
+        self.name = name
+        self.table = table
+        self.address = address
+        self.count = count
+        self.fields = fields
+        self.columns = ('timestamp',) + tuple(f.name for f in fields)
+        self.heartbeat = heartbeat
+        self.burst = burst
+        self.tolerances = tuple(f.deadband or 0 for f in fields)
+
+        # Sentencias SQL precalculadas
+        column_list = ', '.join(self.columns)
+        self.copy_sql = f"COPY {table} ({column_list}) FROM STDIN"
+        self.insert_sql = (f"INSERT INTO {table} ({column_list}) "
+                           f"VALUES ({', '.join(['%s'] * len(self.columns))})")
+
+        # Función de decodificación generada: lambda ts, r: (ts, r[0], r[1]/10, ...)
+        source = f"lambda ts, r: (ts, {', '.join(f.expression() for f in fields)})"
+        self.decode = eval(compile(source, f"<register_map {device}.{name}>", 'eval'),
+                           {'_s16': _s16, '_s32': _s32})
+
+        if np is not None:
+            self._compile_vectorized()
+
+    def field_decoder(self, name):
+        """
+        Función que decodifica un único campo a partir de la lista de registros.
+
+        :param name: nombre del campo
+        :return: función r -> valor escalado
+        """
+        field = next((f for f in self.fields if f.name == name), None)
+        if field is None:
+            raise ValueError(f"Bloque {self.device}.{self.name}: no existe el campo {name}")
+        return eval(compile(f"lambda r: {field.expression()}", f"<register_map {self.device}.{self.name}.{name}>",
+                            'eval'), {'_s16': _s16, '_s32': _s32})
+
+    def _compile_vectorized(self):
+        """
+        Precalcula los índices y escalas usados por la decodificación por lotes.
+        """
+        fields = self.fields
+        first, second = [], []
+        for f in fields:
+            if f.words == 2 and f.word_order == WORD_ORDER_LITTLE:
+                first.append(f.offset + 1)
+                second.append(f.offset)
+            else:
+                first.append(f.offset)
+                second.append(f.offset + 1 if f.words == 2 else f.offset)
+        self._idx_hi = np.array(first, dtype=np.intp)
+        self._idx_lo = np.array(second, dtype=np.intp)
+        self._wide = np.array([f.words == 2 for f in fields])
+        self._signed16 = np.array([f.signed and f.words == 1 for f in fields])
+        self._signed32 = np.array([f.signed and f.words == 2 for f in fields])
+        self._scaled = np.array([bool(f.divisor) for f in fields])
+        self._divisors = np.array([f.divisor or 1 for f in fields], dtype=np.float64)
+
+    def decode_batch(self, timestamps, frames):
+        """
+        Decodifica un lote de lecturas del bloque.
+
+        Con NumPy disponible se hace una única selección de columnas y escalado
+        vectorizado sobre la matriz de lecturas; sin NumPy se aplica la función
+        compilada a cada lectura.
+
+        :param timestamps: secuencia de instantes de adquisición
+        :param frames: secuencia de listas de registros (o matriz N x count)
+        :return: lista de tuplas (timestamp, valores...) en el orden de las columnas
+        """
+        if np is None or len(timestamps) == 0:
+            return [self.decode(ts, r) for ts, r in zip(timestamps, frames)]
+
+        matrix = np.asarray(frames, dtype=np.int64)
+        raw = matrix[:, self._idx_hi]
+        if self._wide.any():
+            raw = np.where(self._wide, (raw << 16) | matrix[:, self._idx_lo], raw)
+        if self._signed16.any():
+            raw = np.where(self._signed16 & (raw >= 0x8000), raw - 0x10000, raw)
+        if self._signed32.any():
+            raw = np.where(self._signed32 & (raw >= 0x80000000), raw - 0x100000000, raw)
+
+        # Las columnas sin escala conservan enteros; las escaladas pasan a float
+        values = raw.astype(object)
+        if self._scaled.any():
+            values[:, self._scaled] = (raw[:, self._scaled] / self._divisors[self._scaled]).astype(object)
+        return [(ts, *row) for ts, row in zip(timestamps, values.tolist())]
+
+
+def load_register_map(path):
+    """
+    Lee y compila el mapa de registros.
+
+    :param path: ruta al archivo JSON del mapa de registros
+    :return: diccionario dispositivo -> lista de CompiledBlock, en el orden del archivo
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    layouts = {name: [Field.from_dict(d) for d in fields]
+               for name, fields in data.get('layouts', {}).items()}
+
+    devices = {}
+    for device, spec in data['devices'].items():
+        blocks = []
+        for block in spec['blocks']:
+            if 'layout' in block:
+                fields = layouts[block['layout']]
+            else:
+                fields = [Field.from_dict(d) for d in block['fields']]
+            blocks.append(CompiledBlock(device, block['name'], block['table'],
+                                        block['address'], block['count'], fields,
+                                        heartbeat=block.get('heartbeat'), burst=block.get('burst')))
+        devices[device] = blocks
+    log.debug(f"Mapa de registros cargado: {sum(len(b) for b in devices.values())} bloques")
+    return devices
@@ -1,47 +1,498 @@
 #!/usr/bin/env python3.12
 
-import os
-import json
+# Restauración de los respaldos generados por backup_dbscada.py.
+#   - plain: carga el archivo .sql completo con psql (comportamiento original).
+#   - custom/directory: pg_restore con varios procesos en paralelo (-j) en tres
+#     etapas: definiciones, datos y, al final, índices y restricciones.
+#   - Restauración selectiva (custom/directory): solo las tablas indicadas y,
+#     opcionalmente, solo las filas de un rango de tiempo. Cada tabla se carga
+#     en su propia transacción y varias tablas se cargan en paralelo.
+#   - incremental: reproduce la base y la cadena de incrementos generados por
+#     backup_dbscada.py --format incremental (ver incremental_backup.py).
+#   - --stream: carga en flujo, desde la entrada estándar (plugin bpipe de
+#     Bacula) o una FIFO, el respaldo generado por backup_dbscada.py --stream.
+#   - --tune: al terminar, ajusta las tablas de captura con schema_manager.py
+#     (tablas faltantes, parámetros de almacenamiento, índices BRIN y
+#     estadísticas, que la restauración no recalcula).
+
 import sys
+import json
+import time
+import argparse
+import subprocess
+import contextlib
+import os
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from scada_config import load_config, capture_blocks, format_bytes, CONFIG_FILE
+from backup_dbscada import (postgres_command, connection_string, postgres_env, write_metrics, open_stream, copy_stream,
+                            FORMATS, FORMAT_PLAIN, FORMAT_CUSTOM, FORMAT_DIRECTORY, FORMAT_INCREMENTAL, STREAM_CHUNK)
+from incremental_backup import restore_chain, restore_incremental, connect_config
+import schema_manager
+
+# Etapas de pg_restore: la carga de datos se hace antes de crear índices y restricciones
+SECTIONS = ('pre-data', 'data', 'post-data')
+
+# Directorio de respaldos dentro del contenedor de PostgreSQL (docker-compose.yml)
+CONTAINER_BACKUP_DIR = '/backups'
+
+# Primeros bytes de un flujo de respaldo: archivo custom de pg_dump, o .sql
+# comprimido por pg_dump con el descompresor que lo lee
+CUSTOM_MAGIC = b'PGDMP'
+DECOMPRESSORS = (
+    (b'\x1f\x8b', ['gzip', '-dc']),
+    (b'\x28\xb5\x2f\xfd', ['zstd', '-dc']),
+    (b'\x04\x22\x4d\x18', ['lz4', '-dc']),
+)
+
+# Índices y restricciones de una tabla, para eliminarlos antes de recargarla y
+# recrearlos al final. Cada fila: orden de eliminación, orden de creación. Con
+# search_path vacío los nombres salen calificados con su esquema, igual que en
+# la salida de pg_restore.
+DEFERRED_OBJECTS_SQL = """
+SET search_path = '';
+SELECT format('ALTER TABLE %s DROP CONSTRAINT %I;', conrelid::regclass, conname),
+       format('ALTER TABLE %s ADD CONSTRAINT %I %s;', conrelid::regclass, conname, pg_get_constraintdef(oid))
+FROM pg_constraint
+WHERE conrelid = '{table}'::regclass AND contype IN ('p', 'u', 'x', 'f')
+UNION ALL
+SELECT format('DROP INDEX %s;', indexrelid::regclass), pg_get_indexdef(indexrelid) || ';'
+FROM pg_index
+WHERE indrelid = '{table}'::regclass
+  AND indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = '{table}'::regclass)
+"""
+
+
+def run_psql(config, sql):
+    """
+    Ejecuta una consulta con psql y retorna las filas como listas de columnas.
+    """
+    command = postgres_command(config, 'psql', '-d', connection_string(config), '-X', '-q',
+                               '-At', '-F', '\t', '-v', 'ON_ERROR_STOP=1', '-c', sql)
+    result = subprocess.run(command, capture_output=True, text=True, env=postgres_env(config))
+    if result.returncode != 0:
+        raise RuntimeError(f"psql falló: {result.stderr.strip()}")
+    return [line.split('\t') for line in result.stdout.splitlines() if line]
+
+
+def restore_plain(config, input_file):
+    """
+    Carga un respaldo .sql completo con psql, leyendo el archivo en flujo.
+    """
+    with open(input_file, 'rb') as f:
+        result = subprocess.run(postgres_command(config, 'psql', '-d', connection_string(config)),
+                                stdin=f, env=postgres_env(config))
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, 'psql')
+
+
+def restore_stream(config, source, clean=False):
+    """
+    Restauración desde un flujo generado por backup_dbscada.py --stream, sin
+    escribirlo en el disco local. El formato se reconoce por los primeros
+    bytes: un archivo custom se carga con pg_restore (en un solo proceso, un
+    flujo no admite -j) y un .sql, comprimido o no, con psql a través del
+    descompresor correspondiente.
+
+    :param config: diccionario de configuración
+    :param source: '-' para la entrada estándar, o ruta de la FIFO
+    :param clean: archivo custom: elimina los objetos existentes antes de recrearlos
+    :return: diccionario con la duración y los bytes leídos
+    """
+    start = time.monotonic()
+    with open_stream(source, 'rb') as stream:
+        head = stream.read(STREAM_CHUNK)
+        if head.startswith(CUSTOM_MAGIC):
+            args = ['-d', connection_string(config), '--exit-on-error']
+            if clean:
+                args += ['--clean', '--if-exists']
+            commands = [('pg_restore', postgres_command(config, 'pg_restore', *args))]
+        else:
+            commands = [('psql', postgres_command(config, 'psql', '-d', connection_string(config)))]
+            commands[:0] = [(decompressor[0], decompressor) for magic, decompressor in DECOMPRESSORS
+                            if head.startswith(magic)]
+
+        # Cadena descompresor | psql (o solo pg_restore/psql) alimentada desde el flujo
+        processes = []
+        for position, (_, command) in enumerate(commands):
+            stdin = processes[-1].stdout if processes else subprocess.PIPE
+            stdout = subprocess.PIPE if position < len(commands) - 1 else None
+            processes.append(subprocess.Popen(command, stdin=stdin, stdout=stdout, env=postgres_env(config)))
+            if processes[:-1]:
+                stdin.close()
+        try:
+            size = copy_stream(stream, processes[0].stdin, head)
+        except BaseException:
+            for process in processes:
+                process.kill()
+            raise
+        finally:
+            processes[0].stdin.close()
+            returncodes = [process.wait() for process in processes]
+    for (name, _), returncode in zip(commands, returncodes):
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, name)
+    return {'seconds': time.monotonic() - start, 'bytes': size}
+
+
+def archive_input(config, source):
+    """
+    Cómo recibe pg_restore un respaldo custom o directory. Sin contenedor lee
+    la misma ruta. Con ``docker_container``, un archivo del equipo se traduce
+    con ``docker_backup_mount`` (directorio del equipo montado en /backups del
+    contenedor) si está dentro de ese directorio y, si no, se entrega por la
+    entrada estándar; cualquier otra ruta (por ejemplo, el directorio
+    ``backup_dir`` que escribió pg_dump) ya es una ruta del contenedor.
+
+    :return: (argumentos de archivo para pg_restore, archivo del equipo para
+             la entrada estándar o None)
+    """
+    if not config.get('docker_container', 'postgres') or not os.path.isfile(source):
+        return [source], None
+    mount = config.get('docker_backup_mount')
+    if mount:
+        relative = os.path.relpath(os.path.abspath(source), os.path.abspath(mount))
+        if relative != os.pardir and not relative.startswith(os.pardir + os.sep):
+            return [f"{CONTAINER_BACKUP_DIR}/{relative}"], None
+    return [], source
+
+
+def open_input(path):
+    """
+    Abre el archivo de la entrada estándar de pg_restore, o nada si es None.
+    """
+    return open(path, 'rb') if path else contextlib.nullcontext()
+
+
+def restore_parallel(config, source, jobs=4, clean=False):
+    """
+    Restauración completa con pg_restore -j. Se ejecuta por etapas para que los
+    índices y restricciones se creen después de cargar todos los datos. Un
+    archivo entregado por la entrada estándar (ver ``archive_input``) se
+    restaura en un solo proceso: pg_restore -j necesita leer el archivo.
+
+    :param config: diccionario de configuración
+    :param source: archivo custom o directorio del respaldo
+    :param jobs: cantidad de procesos en paralelo
+    :param clean: elimina los objetos existentes antes de recrearlos
+    :return: diccionario etapa -> segundos
+    """
+    files, stdin = archive_input(config, source)
+    if stdin and jobs > 1:
+        print(f"{source} no está en docker_backup_mount: se restaura por la entrada estándar, sin --jobs")
+    durations = {}
+    for section in SECTIONS:
+        args = ['-d', connection_string(config), f'--section={section}', '--exit-on-error']
+        if not stdin:
+            args.append(f'--jobs={jobs}')
+        if clean and section == 'pre-data':
+            args += ['--clean', '--if-exists']
+        start = time.monotonic()
+        with open_input(stdin) as f:
+            result = subprocess.run(postgres_command(config, 'pg_restore', *args, *files),
+                                    stdin=f, env=postgres_env(config))
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, f'pg_restore --section={section}')
+        durations[section] = time.monotonic() - start
+    return durations
+
+
+def archive_tables(config, source):
+    """
+    Tablas con datos en el respaldo, según su índice (pg_restore -l).
+    """
+    files, stdin = archive_input(config, source)
+    with open_input(stdin) as f:
+        result = subprocess.run(postgres_command(config, 'pg_restore', '-l', *files), stdin=f,
+                                capture_output=True, text=True, env=postgres_env(config))
+    if result.returncode != 0:
+        raise RuntimeError(f"pg_restore -l falló: {result.stderr.strip()}")
+    tables = {}
+    for line in result.stdout.splitlines():
+        # 2569; 0 16412 TABLE DATA public apis1_ifv1 administrador
+        parts = line.split()
+        if not line.startswith(';') and parts[3:5] == ['TABLE', 'DATA']:
+            tables[parts[6]] = parts[5]
+    return tables
+
+
+def resolve_tables(available, requested):
+    """
+    Expande los nombres pedidos: un nombre exacto o un prefijo de subsistema
+    ('apis3' selecciona apis3_motor1 y apis3_motor2).
 
-# Define la ruta al archivo de configuración JSON
-CONFIG_FILE = '/home/administrador/scripts/config.json'
-
-try:
-    # Abre y lee el archivo JSON
-    with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
-    
-    # Extrae los datos de configuración
-    db_name = config.get('db_name')
-    db_user = config.get('db_user')
-    output_file = config.get('output_file')
-    
-    # Construye la cadena de conexión para psql
-    connection_string = f'"user={db_user} dbname={db_name}"'
-    
-    # Se construye el comando de psql
-    command = f'docker exec -i postgres psql -d {connection_string} < {output_file}'
-    
-    result = os.system(command)
-
-    if result == 0:
+    :param available: diccionario tabla -> esquema del respaldo
+    :param requested: nombres o prefijos pedidos
+    :return: lista de (esquema, tabla)
+    """
+    selected = []
+    for name in requested:
+        matches = [t for t in available if t == name or t.startswith(f"{name}_")]
+        if not matches:
+            raise ValueError(f"La tabla '{name}' no está en el respaldo")
+        selected += [(available[t], t) for t in sorted(matches) if (available[t], t) not in selected]
+    return selected
+
+
+def filter_copy(source, target, since=None, until=None):
+    """
+    Copia la salida SQL de pg_restore hacia psql, conservando de los bloques
+    COPY solo las filas cuyo timestamp está en [since, until).
+
+    :param source: flujo binario de salida de pg_restore
+    :param target: flujo binario de entrada de psql
+    :return: (filas copiadas, filas omitidas)
+    """
+    kept = skipped = 0
+    column = None           # Posición de la columna timestamp en el bloque COPY actual
+    for line in source:
+        if column is None:
+            if line.startswith(b'COPY ') and line.rstrip().endswith(b'FROM stdin;'):
+                columns = line[line.index(b'(') + 1:line.index(b')')].split(b', ')
+                column = [c.strip(b'"') for c in columns].index(b'timestamp')
+            target.write(line)
+            continue
+        if line == b'\\.\n':
+            column = None
+            target.write(line)
+            continue
+        if since is not None or until is not None:
+            value = line.split(b'\t')[column]
+            ts = datetime.fromisoformat(value.decode()) if value != b'\\N' else None
+            if ts is None or (since is not None and ts < since) or (until is not None and ts >= until):
+                skipped += 1
+                continue
+        kept += 1
+        target.write(line)
+    return kept, skipped
+
+
+def restore_table(config, source, schema, table, since=None, until=None, replace=False):
+    """
+    Restaura los datos de una tabla existente en una única transacción.
+
+    Con ``replace`` y sin rango se vacía la tabla y, para cargarla más rápido,
+    se eliminan sus índices y restricciones antes del COPY y se recrean al
+    final. Con rango se conservan los índices y solo se borran (con ``replace``)
+    las filas del rango antes de cargarlo.
+
+    :return: diccionario con filas cargadas, filas omitidas y segundos
+    """
+    qualified = f'{schema}.{table}'
+    prefix, suffix = [], []
+    if replace and since is None and until is None:
+        deferred = run_psql(config, DEFERRED_OBJECTS_SQL.format(table=qualified))
+        prefix += [drop for drop, _ in deferred] + [f'TRUNCATE {qualified};']
+        suffix += [create for _, create in reversed(deferred)]
+    elif replace:
+        conditions = []
+        if since is not None:
+            conditions.append(f"timestamp >= '{since.isoformat(' ')}'")
+        if until is not None:
+            conditions.append(f"timestamp < '{until.isoformat(' ')}'")
+        prefix.append(f"DELETE FROM {qualified} WHERE {' AND '.join(conditions)};")
+
+    start = time.monotonic()
+    files, stdin = archive_input(config, source)
+    with open_input(stdin) as f:
+        dump = subprocess.Popen(postgres_command(config, 'pg_restore', '--data-only', '-n', schema,
+                                                 '-t', table, '-f', '-', *files),
+                                stdin=f, stdout=subprocess.PIPE, env=postgres_env(config))
+    load = subprocess.Popen(postgres_command(config, 'psql', '-d', connection_string(config), '-X', '-q',
+                                             '-v', 'ON_ERROR_STOP=1', '--single-transaction', '-f', '-'),
+                            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, env=postgres_env(config))
+    try:
+        load.stdin.write(''.join(f"{sql}\n" for sql in prefix).encode())
+        kept, skipped = filter_copy(dump.stdout, load.stdin, since, until)
+        load.stdin.write(''.join(f"{sql}\n" for sql in suffix).encode())
+        load.stdin.close()
+    except BrokenPipeError:
+        pass    # psql terminó antes (error en la carga); se informa por su código de salida
+    finally:
+        dump.stdout.close()
+    if dump.wait() != 0:
+        load.kill()
+        load.wait()
+        raise subprocess.CalledProcessError(dump.returncode, f'pg_restore -t {table}')
+    if load.wait() != 0:
+        raise subprocess.CalledProcessError(load.returncode, f'psql ({table})')
+    return {'rows': kept, 'skipped': skipped, 'seconds': time.monotonic() - start}
+
+
+def restore_selected(config, source, requested, jobs=4, since=None, until=None, replace=False):
+    """
+    Restaura en paralelo las tablas pedidas (nombres o prefijos de subsistema).
+
+    :return: diccionario tabla -> estadísticas de restore_table
+    """
+    tables = resolve_tables(archive_tables(config, source), requested)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {table: executor.submit(restore_table, config, source, schema, table,
+                                          since, until, replace)
+                   for schema, table in tables}
+        return {table: future.result() for table, future in futures.items()}
+
+
+def restore_incremental_chain(config, directory, requested=None, backup_id=None, jobs=4,
+                              replace=False, schema=False):
+    """
+    Restaura la base y los incrementos de un directorio de respaldos incrementales.
+
+    :param requested: tablas o subsistemas a restaurar (por defecto, todas)
+    :param backup_id: último respaldo de la cadena a aplicar (por defecto, el más reciente)
+    :param schema: crea antes las tablas con el esquema guardado en la base
+    :return: diccionario tabla -> estadísticas (filas y segundos)
+    """
+    chain = restore_chain(directory, backup_id)
+    tables = None
+    if requested:
+        available = {t: 'public' for backup in chain for t in backup['tables']}
+        tables = [table for _, table in resolve_tables(available, requested)]
+    if schema:
+        restore_plain(config, os.path.join(directory, chain[0]['id'], chain[0]['schema']))
+
+    start = time.monotonic()
+    rows = restore_incremental(directory, connect_config(config), backup_id=backup_id, tables=tables,
+                               jobs=jobs, replace=replace)
+    elapsed = time.monotonic() - start
+    print("Cadena: " + ', '.join(f"{b['id']} ({b['type']})" for b in chain))
+    return {table: {'rows': n, 'skipped': 0, 'seconds': elapsed} for table, n in rows.items()}
+
+
+def tune_schema(config):
+    """
+    Deja la base restaurada lista para las consultas por rango de tiempo:
+    crea las tablas de captura que falten, aplica sus parámetros de
+    almacenamiento e índices BRIN y actualiza sus estadísticas (VACUUM ANALYZE).
+    """
+    conn = connect_config(config)()
+    try:
+        manager = schema_manager.from_config(config, conn)
+        for block in capture_blocks(config).values():
+            manager.create(block, vacuum=True)
+    finally:
+        conn.close()
+
+
+def print_report(tables, elapsed):
+    """
+    Muestra las filas cargadas y la duración de cada tabla restaurada.
+    """
+    print(f"{'Tabla':<16} {'Duración':>10} {'Filas':>12} {'Omitidas':>10}")
+    for table in sorted(tables):
+        stats = tables[table]
+        print(f"{table:<16} {stats['seconds']:>8.2f} s {stats['rows']:>12} {stats['skipped']:>10}")
+    print(f"Total: {len(tables)} tablas, {sum(s['rows'] for s in tables.values())} filas en {elapsed:.2f} s")
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"instante inválido: {value} (formato AAAA-MM-DD[ HH:MM:SS])")
+
+
+def parse_args(config, argv=None):
+    parser = argparse.ArgumentParser(description="Restauración de la base de datos SCADA.")
+    parser.add_argument('--format', choices=FORMATS, default=config.get('backup_format', FORMAT_PLAIN),
+                        help="formato del respaldo (por defecto, 'backup_format' de la configuración o plain)")
+    parser.add_argument('-i', '--input', help="archivo o directorio del respaldo")
+    parser.add_argument('-j', '--jobs', type=int, default=config.get('restore_jobs', 4),
+                        help="procesos en paralelo (custom/directory)")
+    parser.add_argument('--clean', action='store_true',
+                        help="restauración completa: elimina los objetos existentes antes de recrearlos")
+    parser.add_argument('-t', '--tables', nargs='+', metavar='TABLA',
+                        help="restaura solo estas tablas o subsistemas (por ejemplo apis3 o apis3_motor1)")
+    parser.add_argument('--since', type=parse_timestamp, help="solo filas con timestamp >= este instante")
+    parser.add_argument('--until', type=parse_timestamp, help="solo filas con timestamp < este instante")
+    parser.add_argument('--replace', action='store_true',
+                        help="restauración selectiva: reemplaza las filas existentes de las tablas (o del rango)")
+    parser.add_argument('--backup-id', help="formato incremental: último respaldo de la cadena a aplicar")
+    parser.add_argument('--schema', action='store_true',
+                        help="formato incremental: crea las tablas con el esquema guardado en la base")
+    parser.add_argument('--stream', action='store_true',
+                        help="carga en flujo un respaldo de backup_dbscada.py --stream desde la entrada "
+                             "estándar o la FIFO indicada con -i ('stream_fifo' de la configuración)")
+    parser.add_argument('--tune', action='store_true', default=config.get('restore_tune', False),
+                        help="al terminar, ajusta el esquema y las estadísticas de las tablas de captura "
+                             "(schema_manager.py)")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs debe ser mayor o igual a 1")
+    selective = args.tables or args.since or args.until
+    if selective and args.format == FORMAT_PLAIN:
+        parser.error("la restauración selectiva requiere un respaldo custom o directory")
+    if (args.since or args.until) and args.format == FORMAT_INCREMENTAL:
+        parser.error("--since/--until no aplican al formato incremental")
+    if (args.since or args.until) and not args.tables:
+        parser.error("--since/--until requieren --tables")
+    if args.replace and not selective and args.format != FORMAT_INCREMENTAL:
+        parser.error("--replace solo aplica a la restauración selectiva")
+    if args.stream and (selective or args.format not in (FORMAT_PLAIN, FORMAT_CUSTOM)):
+        parser.error("--stream solo aplica a la restauración completa de respaldos plain o custom")
+    return args
+
+
+def main(argv=None):
+    config, args, failed = None, None, True
+    try:
+        config = load_config()
+        args = parse_args(config, argv)
+        start = time.monotonic()
+
+        tables, sections, size = None, None, None
+        if args.stream:
+            source = args.input or config.get('stream_fifo', '-')
+            stats = restore_stream(config, source, clean=args.clean)
+            size = stats['bytes']
+            print(f"{source}: {format_bytes(size)} en {stats['seconds']:.2f} s")
+        elif args.format == FORMAT_PLAIN:
+            restore_plain(config, args.input or config['output_file'])
+        elif args.format == FORMAT_INCREMENTAL:
+            directory = args.input or config.get('incremental_dir',
+                                                 os.path.join(os.path.dirname(CONFIG_FILE), 'incremental'))
+            tables = restore_incremental_chain(config, directory, args.tables, backup_id=args.backup_id,
+                                               jobs=args.jobs, replace=args.replace, schema=args.schema)
+            print_report(tables, time.monotonic() - start)
+        else:
+            source = args.input or (config.get('backup_dir', '/backups/db_scada')
+                                    if args.format == FORMAT_DIRECTORY else config['output_file'])
+            if args.tables:
+                tables = restore_selected(config, source, args.tables, jobs=args.jobs,
+                                          since=args.since, until=args.until, replace=args.replace)
+                print_report(tables, time.monotonic() - start)
+            else:
+                sections = restore_parallel(config, source, jobs=args.jobs, clean=args.clean)
+                for section, seconds in sections.items():
+                    print(f"{section:<10} {seconds:>8.2f} s")
+        if args.tune:
+            tune_schema(config)
+        write_metrics(config, 'restore', args.format, time.monotonic() - start, size=size, tables=tables,
+                      sections=sections)
         print("Recuperacion de la base de datos completada con exito.")
-    else:
-        print(f"Error: psql falló con código de salida {result}.", file=sys.stderr)
-        sys.exit(result)
-
-except FileNotFoundError:
-    print(f"Error: El archivo de configuración '{CONFIG_FILE}' no fue encontrado.", file=sys.stderr)
-    sys.exit(1)
-except json.JSONDecodeError:
-    print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
-    sys.exit(1)
-except KeyError as e:
-    print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
-    sys.exit(1)
-except Exception as e:
-    print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
-    sys.exit(1)
-# Si todo fue bien, sale con código de éxito (0)
-sys.exit(0)
+        failed = False
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error: {e.cmd} falló con código de salida {e.returncode}.", file=sys.stderr)
+        sys.exit(e.returncode)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if failed and args is not None:
+            write_metrics(config, 'restore', args.format, failed=True)
+    # Si todo fue bien, sale con código de éxito (0)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
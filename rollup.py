@@ -0,0 +1,281 @@
+#!/usr/bin/env python3.12
+
+# Tablas de agregados (rollups) para los tableros: por cada tabla de captura se
+# mantienen agregados de 1 s, 1 min y 15 min con mínimo, máximo, promedio y
+# último valor de cada campo (<tabla>_1s, <tabla>_1min, <tabla>_15min).
+#
+# Los agregados se actualizan de forma incremental, nunca desde cero: solo se
+# recalculan los intervalos que contienen filas nuevas, el de 1 s desde las
+# filas crudas y los mayores desde el nivel anterior. La actualización se hace
+# al escribir cada lote (BufferedWriter y SpoolDrainer con ``rollups``) o con
+# este script, que avanza una marca de agua por tabla (por ejemplo, desde cron
+# o para construir los agregados del historial existente). La marca de agua es
+# el instante de inserción (ingested_at, ver incremental_backup.py): las filas
+# que el spool carga tarde con instantes antiguos también recalculan sus
+# intervalos.
+
+import sys
+import json
+import argparse
+import logging                                      # Para registro de eventos e información de depuración
+from datetime import datetime, timedelta
+from scada_config import load_config, capture_blocks, CONFIG_FILE
+from incremental_backup import connect_config, ingest_cutoff, INGEST_COLUMN
+from raw_frames import raw_table
+
+log = logging.getLogger()
+
+# Niveles de agregación: nombre (sufijo de la tabla) y duración del intervalo en segundos
+TIERS = (('1s', 1), ('1min', 60), ('15min', 900))
+
+# Periodo de muestreo de las tablas crudas, para la regla de selección de nivel
+RAW_PERIOD = 0.1
+
+WATERMARK_TABLE = 'rollup_watermark'
+EPOCH = datetime(1970, 1, 1)
+
+
+def floor_time(ts, seconds):
+    """
+    Inicio del intervalo de ``seconds`` segundos que contiene a ``ts``.
+    """
+    step = timedelta(seconds=seconds)
+    return EPOCH + (ts - EPOCH) // step * step
+
+
+def bucket_ranges(buckets, seconds):
+    """
+    Agrupa intervalos ordenados de ``seconds`` segundos en rangos contiguos.
+
+    :return: lista de (primer instante, último instante) para Rollups.refresh
+    """
+    step = timedelta(seconds=seconds)
+    ranges = []
+    for bucket in buckets:
+        if ranges and ranges[-1][1] + step == bucket:
+            ranges[-1][1] = bucket
+        else:
+            ranges.append([bucket, bucket])
+    return [(first, last + step - timedelta(microseconds=1)) for first, last in ranges]
+
+
+def select_tier(start, end, max_points=2000, raw_period=RAW_PERIOD):
+    """
+    Regla de selección de nivel: el nivel más fino cuyo número de puntos en
+    el rango [start, end) no supera ``max_points``.
+
+    :return: None para las filas crudas, o el nombre del nivel ('1s', '1min', '15min')
+    """
+    span = (end - start).total_seconds()
+    if span / raw_period <= max_points:
+        return None
+    for tier, seconds in TIERS:
+        if span / seconds <= max_points:
+            return tier
+    return TIERS[-1][0]
+
+
+def tier_table(table, tier):
+    """
+    Tabla de un nivel (None corresponde a la tabla cruda).
+    """
+    return f"{table}_{tier}" if tier else table
+
+
+# Función SQL con la misma regla, para elegir la tabla desde Grafana:
+#   SELECT rollup_table('apis1_ifv1', $__timeFrom()::timestamp, $__timeTo()::timestamp)
+SELECT_TIER_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION rollup_table(source text, start timestamp, stop timestamp,
+                                        max_points integer DEFAULT 2000)
+RETURNS text LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN extract(epoch FROM stop - start) / {RAW_PERIOD} <= max_points THEN source
+        {' '.join(f"WHEN extract(epoch FROM stop - start) / {seconds} <= max_points THEN source || '_{tier}'"
+                  for tier, seconds in TIERS[:-1])}
+        ELSE source || '_{TIERS[-1][0]}'
+    END
+$$
+"""
+
+
+class Rollups:
+    """
+    Sentencias de creación y actualización de los agregados de las tablas de captura.
+    """
+
+    def __init__(self, blocks, raw=False):
+        """
+        :param blocks: diccionario tabla -> bloque compilado (register_map.CompiledBlock)
+        :param raw: las tablas de captura son vistas sobre tablas de tramas (raw_frames.py)
+        """
+        self.blocks = blocks
+        self.raw = raw
+        self._refresh = {table: self._compile(table, [f.name for f in block.fields])
+                         for table, block in blocks.items()}
+
+    @staticmethod
+    def _compile(table, fields):
+        """
+        Sentencias INSERT ... ON CONFLICT que recalculan los intervalos de cada
+        nivel dentro de un rango [%(start)s, %(end)s).
+        """
+        names = [f"{f}_{agg}" for f in fields for agg in ('min', 'max', 'avg', 'last')]
+        columns = ', '.join(['bucket', 'samples'] + names)
+        updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in ['samples'] + names)
+        statements = []
+        source = None
+        for tier, seconds in TIERS:
+            target = tier_table(table, tier)
+            if source is None:
+                # Primer nivel: desde las filas crudas
+                bucket = "date_trunc('second', timestamp)"
+                aggregates = ', '.join(
+                    f"min({f}), max({f}), avg({f}), (array_agg({f} ORDER BY timestamp DESC))[1]"
+                    for f in fields)
+                select = (f"SELECT {bucket}, count(*), {aggregates} FROM {table} "
+                          f"WHERE timestamp >= %(start)s AND timestamp < %(end)s GROUP BY 1")
+            else:
+                # Niveles mayores: desde el nivel anterior, con promedio ponderado por muestras
+                bucket = f"date_bin('{seconds} seconds', bucket, TIMESTAMP '1970-01-01')"
+                aggregates = ', '.join(
+                    f"min({f}_min), max({f}_max), "
+                    f"sum({f}_avg * samples) / nullif(sum(samples) FILTER (WHERE {f}_avg IS NOT NULL), 0), "
+                    f"(array_agg({f}_last ORDER BY bucket DESC))[1]"
+                    for f in fields)
+                select = (f"SELECT {bucket}, sum(samples), {aggregates} FROM {source} "
+                          f"WHERE bucket >= %(start)s AND bucket < %(end)s GROUP BY 1")
+            statements.append((seconds, f"INSERT INTO {target} ({columns}) {select} "
+                                        f"ON CONFLICT (bucket) DO UPDATE SET {updates}"))
+            source = target
+        return statements
+
+    def create_statements(self, table):
+        """
+        Sentencias que crean las tablas de agregados de una tabla de captura,
+        la marca de agua y la función de selección de nivel.
+        """
+        fields = [f.name for f in self.blocks[table].fields]
+        columns = ', '.join(f"{f}_{agg} double precision" for f in fields for agg in ('min', 'max', 'avg', 'last'))
+        statements = [f"CREATE TABLE IF NOT EXISTS {tier_table(table, tier)} "
+                      f"(bucket timestamp PRIMARY KEY, samples integer NOT NULL, {columns})"
+                      for tier, _ in TIERS]
+        # El recálculo del primer nivel filtra la tabla cruda por rango de tiempo
+        # (schema_manager.py ajusta luego el índice a la densidad de cada tabla)
+        storage = raw_table(table) if self.raw else table
+        statements.append(f"CREATE INDEX IF NOT EXISTS {storage}_timestamp_brin ON {storage} USING brin (timestamp)")
+        statements.append(f"CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} "
+                          f"(source text PRIMARY KEY, watermark timestamptz NOT NULL)")
+        statements.append(SELECT_TIER_FUNCTION)
+        return statements
+
+    def create(self, conn):
+        """
+        Crea las tablas de agregados de todas las tablas de captura.
+        """
+        with conn.cursor() as cursor:
+            for table in self.blocks:
+                for sql in self.create_statements(table):
+                    cursor.execute(sql)
+        conn.commit()
+
+    def refresh(self, cursor, table, start, end):
+        """
+        Recalcula, en la transacción del cursor, los intervalos de todos los
+        niveles que contienen filas con timestamp en [start, end].
+
+        :param cursor: cursor psycopg2 (el commit lo hace quien llama)
+        :param table: tabla de captura
+        :param start: primer instante con filas nuevas
+        :param end: último instante con filas nuevas
+        """
+        for seconds, sql in self._refresh[table]:
+            lower = floor_time(start, seconds)
+            upper = floor_time(end, seconds) + timedelta(seconds=seconds)
+            cursor.execute(sql, {'start': lower, 'end': upper})
+
+    def catch_up(self, conn, table, settle_seconds=60, chunk=timedelta(hours=1)):
+        """
+        Avanza la marca de agua de una tabla, sobre el instante de inserción,
+        hasta el corte de ``ingest_cutoff``. Por cada tramo de ``chunk`` de
+        inserciones se recalculan los intervalos de 15 min (y los de 1 s y
+        1 min que contienen) con filas insertadas en el tramo, cualquiera sea
+        su timestamp, y se confirma el tramo. Sin marca previa, comienza en la
+        fila insertada primero.
+
+        :return: cantidad de tramos procesados
+        """
+        storage = raw_table(table) if self.raw else table
+        seconds = TIERS[-1][1]
+        with conn.cursor() as cursor:
+            cutoff = ingest_cutoff(cursor, settle_seconds)
+            cursor.execute(f"SELECT watermark FROM {WATERMARK_TABLE} WHERE source = %s", (table,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(f"SELECT min({INGEST_COLUMN}) FROM {storage}")
+                row = cursor.fetchone()
+            conn.rollback()
+            start = row[0]
+            chunks = 0
+            while start is not None and start < cutoff:
+                end = min(start + chunk, cutoff)
+                cursor.execute(f"SELECT DISTINCT date_bin('{seconds} seconds', timestamp, TIMESTAMP '1970-01-01') "
+                               f"FROM {storage} WHERE {INGEST_COLUMN} >= %s AND {INGEST_COLUMN} < %s ORDER BY 1",
+                               (start, end))
+                for first, last in bucket_ranges([b for b, in cursor.fetchall()], seconds):
+                    self.refresh(cursor, table, first, last)
+                cursor.execute(f"INSERT INTO {WATERMARK_TABLE} (source, watermark) VALUES (%s, %s) "
+                               f"ON CONFLICT (source) DO UPDATE SET watermark = EXCLUDED.watermark",
+                               (table, end))
+                conn.commit()
+                start = end
+                chunks += 1
+        log.info(f"Agregados de {table} actualizados hasta la inserción {start} ({chunks} tramos)")
+        return chunks
+
+
+def parse_args(tables, argv=None):
+    parser = argparse.ArgumentParser(description="Actualización de las tablas de agregados de las tablas de captura.")
+    parser.add_argument('-t', '--tables', nargs='+', metavar='TABLA', choices=tables, default=tables,
+                        help="tablas a actualizar (por defecto, todas las tablas de captura)")
+    parser.add_argument('--create', action='store_true', help="crea las tablas de agregados si no existen")
+    parser.add_argument('--settle', type=int, default=60,
+                        help="segundos de margen entre el instante actual y la marca de agua")
+    parser.add_argument('--chunk-hours', type=float, default=1.0, help="horas recalculadas por transacción")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        config = load_config()
+        blocks = capture_blocks(config)
+        args = parse_args(sorted(blocks), argv)
+        rollups = Rollups({table: blocks[table] for table in args.tables}, raw=config.get('raw_frames', False))
+        conn = connect_config(config)()
+        try:
+            if args.create:
+                rollups.create(conn)
+            for table in args.tables:
+                rollups.catch_up(conn, table, settle_seconds=args.settle,
+                                 chunk=timedelta(hours=args.chunk_hours))
+        finally:
+            conn.close()
+        print("Agregados actualizados con éxito.")
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
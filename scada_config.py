@@ -0,0 +1,41 @@
+#!/usr/bin/env python3.12
+
+# Configuración compartida por los procesos de captura y los de respaldo: la
+# ruta del archivo de configuración, su lectura y las tablas de captura del
+# mapa de registros. Los procesos de captura la importan sin cargar
+# backup_dbscada.py (pg_dump, subprocesos y métricas de los trabajos).
+
+import os
+import json
+from register_map import load_register_map
+
+# Define la ruta al archivo de configuración JSON
+# Puedes ajustar esta ruta si el archivo no está en el mismo directorio
+# (o indicar otro archivo con la variable de entorno SCADA_CONFIG)
+CONFIG_FILE = os.environ.get('SCADA_CONFIG', '/home/administrador/scripts/config.json')
+
+
+def load_config(path=CONFIG_FILE):
+    """
+    Lee el archivo de configuración JSON.
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def capture_blocks(config):
+    """
+    Diccionario tabla -> bloque compilado de todas las tablas de captura del mapa de registros.
+    """
+    path = config.get('register_map_file', os.path.join(os.path.dirname(CONFIG_FILE), 'register_map.json'))
+    return {block.table: block for blocks in load_register_map(path).values() for block in blocks}
+
+
+def format_bytes(size):
+    """
+    Tamaño legible (B, KiB, MiB, GiB).
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3.12
+
+# Planificador de ciclos con plazos absolutos compartido por los scripts de captura.
+# Reemplaza el time.sleep() fijo al final de cada ciclo: el periodo se mide
+# desde el inicio del ciclo anterior sobre un reloj monotónico, de modo que
+# el tiempo de E/S no se acumula como deriva.
+
+import math                                         # Para la desviación estándar del jitter
+import time                                         # Reloj monotónico y esperas
+import logging                                      # Para registro de eventos e información de depuración
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+CYCLES = metrics.counter('scada_cycles_total', "Ciclos de muestreo completados", ('loop',))
+OVERRUNS = metrics.counter('scada_cycle_overruns_total', "Ciclos que excedieron su plazo", ('loop',))
+SKIPPED = metrics.counter('scada_cycles_skipped_total', "Ciclos omitidos por la política 'skip'", ('loop',))
+JITTER_SECONDS = metrics.histogram('scada_cycle_jitter_seconds', "Retraso del inicio de cada ciclo respecto a su plazo", ('loop',))
+CYCLE_SECONDS = metrics.histogram('scada_cycle_work_seconds', "Tiempo de trabajo útil de cada ciclo", ('loop',))
+PERIOD_SECONDS = metrics.gauge('scada_sample_period_seconds', "Periodo de muestreo objetivo", ('loop',))
+
+# Políticas ante un ciclo que excede su plazo
+POLICY_CATCHUP = 'catchup'      # Ejecuta de inmediato los ciclos atrasados hasta alcanzar el reloj
+POLICY_SKIP = 'skip'            # Descarta los ciclos perdidos y se realinea con el siguiente plazo
+
+
+class JitterStats:
+    """
+    Estadísticas acumuladas del jitter (retraso del inicio real de cada ciclo
+    respecto a su plazo) y de la duración de los ciclos, calculadas en línea
+    (algoritmo de Welford) sin guardar las muestras.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Reinicia todos los contadores.
+        """
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_jitter = 0.0
+        self.max_cycle = 0.0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, jitter, cycle_time):
+        """
+        Registra un ciclo.
+
+        :param jitter: segundos de retraso del inicio del ciclo respecto a su plazo
+        :param cycle_time: segundos de trabajo útil del ciclo
+        """
+        self.cycles += 1
+        delta = jitter - self._mean
+        self._mean += delta / self.cycles
+        self._m2 += delta * (jitter - self._mean)
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.max_cycle = max(self.max_cycle, cycle_time)
+
+    @property
+    def mean_jitter(self):
+        return self._mean
+
+    @property
+    def stdev_jitter(self):
+        return math.sqrt(self._m2 / (self.cycles - 1)) if self.cycles > 1 else 0.0
+
+    def summary(self):
+        """
+        Resumen legible de las estadísticas para el log.
+        """
+        return (f"ciclos={self.cycles} excedidos={self.overruns} omitidos={self.skipped} "
+                f"jitter_medio={self.mean_jitter * 1000:.2f}ms jitter_std={self.stdev_jitter * 1000:.2f}ms "
+                f"jitter_max={self.max_jitter * 1000:.2f}ms ciclo_max={self.max_cycle * 1000:.2f}ms")
+
+
+class DeadlineScheduler:
+    """
+    Marca ciclos sobre plazos absolutos de un reloj monotónico.
+
+    Uso típico al final de cada iteración del bucle principal::
+
+        scheduler = DeadlineScheduler(0.110)
+        while True:
+            ...lectura e inserción...
+            scheduler.wait()
+
+    Si el trabajo de un ciclo supera el periodo, ``wait()`` no duerme, cuenta
+    el exceso y aplica la política configurada: ``catchup`` conserva la rejilla
+    original y ejecuta los ciclos atrasados sin espera; ``skip`` descarta los
+    plazos perdidos y continúa en el siguiente plazo futuro de la rejilla.
+    En ``catchup``, un atraso mayor a ``max_catchup`` periodos (por ejemplo,
+    tras una pausa por reconexión) se trata como ``skip``.
+    """
+
+    def __init__(self, period, policy=POLICY_SKIP, max_catchup=10, report_every=None,
+                 name='captura'):
+        """
+        :param period: periodo objetivo en segundos
+        :param policy: política ante ciclos excedidos ('catchup' o 'skip')
+        :param max_catchup: máximo de periodos de atraso que se recuperan en 'catchup'
+        :param report_every: segundos entre resúmenes de jitter en el log (None desactiva)
+        :param name: nombre del bucle para los mensajes de log
+        """
+        if period <= 0:
+            raise ValueError("El periodo debe ser mayor que cero")
+        if policy not in (POLICY_CATCHUP, POLICY_SKIP):
+            raise ValueError(f"Política desconocida: {policy}")
+        self.period = period
+        self.policy = policy
+        self.max_catchup = max_catchup
+        self.report_every = report_every
+        self.name = name
+        self.stats = JitterStats()
+        self._labels = (name,)
+        PERIOD_SECONDS.set(period, self._labels)
+        self.reset()
+
+    def reset(self):
+        """
+        Reinicia la rejilla de plazos a partir del instante actual, por ejemplo
+        tras una pausa por reconexión.
+        """
+        now = time.monotonic()
+        self._deadline = now + self.period
+        self._cycle_start = now
+        self._last_report = now
+
+    def wait(self):
+        """
+        Espera hasta el siguiente plazo y registra el jitter del ciclo.
+
+        :return: True si el ciclo que termina excedió su plazo, False en caso contrario
+        """
+        now = time.monotonic()
+        cycle_time = now - self._cycle_start
+        overrun = now > self._deadline
+
+        skip = False
+        if overrun:
+            self.stats.overruns += 1
+            OVERRUNS.inc(self._labels)
+            late = now - self._deadline
+            skip = self.policy == POLICY_SKIP or late > self.max_catchup * self.period
+            if skip:
+                # Salta los plazos perdidos y se alinea con el siguiente de la rejilla
+                missed = int(late // self.period) + 1
+                self.stats.skipped += missed - 1
+                SKIPPED.inc(self._labels, missed - 1)
+                self._deadline += missed * self.period
+                log.warning(f"[{self.name}] Ciclo excedido por {late * 1000:.1f} ms "
+                            f"({missed - 1} ciclos omitidos)")
+            else:
+                log.warning(f"[{self.name}] Ciclo excedido por {late * 1000:.1f} ms, recuperando")
+
+        if not overrun or skip:
+            delay = self._deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        start = time.monotonic()
+        # En catchup el plazo actual ya pasó: el retraso cuenta como jitter
+        jitter = max(0.0, start - self._deadline)
+        self.stats.add(jitter, cycle_time)
+        CYCLES.inc(self._labels)
+        JITTER_SECONDS.observe(jitter, self._labels)
+        CYCLE_SECONDS.observe(cycle_time, self._labels)
+        self._cycle_start = start
+        self._deadline += self.period
+
+        if self.report_every and start - self._last_report >= self.report_every:
+            log.info(f"[{self.name}] {self.stats.summary()}")
+            self._last_report = start
+        return overrun
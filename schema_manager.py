@@ -0,0 +1,468 @@
+#!/usr/bin/env python3.12
+
+# Esquema de las tablas de captura. Crea las nueve tablas a partir de los
+# bloques de register_map.json (una columna double por campo, o las tablas de
+# tramas y sus vistas con 'raw_frames'), de modo que una base nueva o recién
+# restaurada quede lista para las consultas por rango de tiempo:
+#   - Índice BRIN sobre timestamp: las filas llegan en orden de tiempo, así que
+#     cada rango de páginas cubre un intervalo de tiempo contiguo. Su
+#     pages_per_range se calcula para que un rango cubra unos
+#     'schema_brin_range_seconds' de lecturas según el periodo de muestreo y
+#     el tamaño de fila de cada tabla, y autosummarize resume los rangos
+#     nuevos sin esperar al VACUUM.
+#   - Parámetros de almacenamiento para tablas de solo inserción: páginas
+#     llenas (fillfactor 100) y autovacuum disparado por inserciones, que
+#     mantiene al día el mapa de visibilidad, las estadísticas y el
+#     congelamiento de las filas sin recorrer después todo el historial.
+#   - Columna ingested_at (instante de inserción, DEFAULT now()) con su propio
+#     BRIN, que usa la marca de agua de los respaldos incrementales
+#     (incremental_backup.py); en una tabla existente se agrega sin reescribirla.
+#   - Reporte del uso de los índices y de la hinchazón estimada de tablas e
+#     índices (--report).
+# Las tablas particionadas reciben los parámetros en cada partición;
+# partition_manager.py los aplica también a las particiones que crea.
+
+import sys
+import json
+import math
+import argparse
+import logging                                      # Para registro de eventos e información de depuración
+from scada_config import load_config, capture_blocks, format_bytes, CONFIG_FILE
+from incremental_backup import connect_config, INGEST_COLUMN, INGEST_DEFINITION
+import raw_frames
+
+log = logging.getLogger()
+
+# Parámetros de almacenamiento por defecto de las tablas de captura; se
+# reemplazan uno a uno con 'schema_storage_parameters'
+STORAGE_PARAMETERS = {
+    'fillfactor': 100,                                  # Sin UPDATE: no se reserva espacio en las páginas
+    'autovacuum_vacuum_insert_scale_factor': 0.01,      # VACUUM tras insertar un 1 % de la tabla...
+    'autovacuum_vacuum_insert_threshold': 10000,        # ...más 10000 filas
+    'autovacuum_analyze_scale_factor': 0.01,            # Estadísticas al día del último tramo de tiempo
+    'autovacuum_freeze_min_age': 0,                     # Congela las filas en el primer VACUUM
+}
+
+# Periodo de muestreo de cada grupo ('period_<grupo>'), con los valores por
+# defecto de los scripts de captura
+DEFAULT_PERIODS = {'apis1': 0.110, 'apis2': 1.0, 'apis3': 0.5}
+
+BLOCK_SIZE = 8192
+PAGE_HEADER = 24
+TUPLE_HEADER = 23
+ITEM_POINTER = 4
+MAX_PAGES_PER_RANGE = 131072
+
+
+def maxalign(size):
+    return (size + 7) // 8 * 8
+
+
+def row_bytes(block, raw=False):
+    """
+    Bytes estimados que ocupa una fila de un bloque en el heap (cabecera,
+    datos alineados y puntero de línea).
+    """
+    if raw:
+        frame = 2 * block.count
+        data = maxalign(8 + frame + (1 if frame < 127 else 4)) + 8
+    else:
+        data = 8 * (len(block.fields) + 2)
+    return maxalign(maxalign(TUPLE_HEADER) + data) + ITEM_POINTER
+
+
+def pages_per_range(block, period, range_seconds, raw=False, fillfactor=100):
+    """
+    Páginas por rango del BRIN para que cada rango cubra unos ``range_seconds``
+    de lecturas, redondeado a la potencia de dos más cercana.
+
+    :param period: periodo de muestreo del bloque en segundos
+    """
+    rows_per_page = max(1, (BLOCK_SIZE - PAGE_HEADER) * fillfactor // 100 // row_bytes(block, raw))
+    pages = range_seconds / period / rows_per_page
+    return min(MAX_PAGES_PER_RANGE, 2 ** max(0, round(math.log2(max(pages, 1)))))
+
+
+def parse_options(reloptions):
+    """
+    Diccionario de las opciones de una relación (pg_class.reloptions).
+    """
+    return dict(option.split('=', 1) for option in reloptions or [])
+
+
+def storage_clause(parameters):
+    """
+    Cláusula WITH (...) de los parámetros de almacenamiento, o cadena vacía.
+    """
+    if not parameters:
+        return ''
+    return f" WITH ({', '.join(f'{name} = {value}' for name, value in parameters.items())})"
+
+
+def storage_parameters(config):
+    """
+    Parámetros de almacenamiento de las tablas de captura según config.json.
+    """
+    return {**STORAGE_PARAMETERS, **config.get('schema_storage_parameters', {})}
+
+
+class SchemaManager:
+    """
+    Creación y ajuste de las tablas de captura y de sus índices BRIN. Cada
+    tabla se ajusta en su propia transacción; las reconstrucciones de índices
+    de tablas sin particionar se hacen con CONCURRENTLY.
+    """
+
+    def __init__(self, conn, periods=None, parameters=None, range_seconds=300, raw=False, dry_run=False):
+        """
+        :param conn: conexión psycopg2
+        :param periods: diccionario grupo -> periodo de muestreo en segundos
+        :param parameters: parámetros de almacenamiento de las tablas
+        :param range_seconds: segundos de lecturas que cubre cada rango del BRIN
+        :param raw: las tablas guardan tramas (raw_frames.py)
+        :param dry_run: solo registra las sentencias, sin ejecutarlas
+        """
+        self.conn = conn
+        self.periods = {**DEFAULT_PERIODS, **(periods or {})}
+        self.parameters = STORAGE_PARAMETERS if parameters is None else parameters
+        self.range_seconds = range_seconds
+        self.raw = raw
+        self.dry_run = dry_run
+        self.actions = []
+
+    def _execute(self, statements, autocommit=False):
+        """
+        Ejecuta las sentencias en la transacción actual, o cada una por
+        separado con ``autocommit`` (CREATE/DROP INDEX CONCURRENTLY).
+        """
+        if autocommit and not self.dry_run:
+            self.conn.commit()
+            self.conn.autocommit = True
+        try:
+            with self.conn.cursor() as cursor:
+                for sql in statements:
+                    self.actions.append(sql)
+                    log.info(sql if len(sql) < 200 else f"{sql[:200]}...")
+                    if not self.dry_run:
+                        cursor.execute(sql)
+        finally:
+            if autocommit and not self.dry_run:
+                self.conn.autocommit = False
+
+    def _query(self, sql, params=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def _relkind(self, table):
+        rows = self._query("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        return rows[0][0] if rows else None
+
+    def storage_table(self, table):
+        """
+        Tabla que guarda las filas de una tabla de captura.
+        """
+        return raw_frames.raw_table(table) if self.raw else table
+
+    def period(self, block):
+        return self.periods.get(block.device.split('_')[0], 1.0)
+
+    def pages_per_range(self, block):
+        """
+        Páginas por rango recomendadas para el BRIN de la tabla de un bloque.
+        """
+        return pages_per_range(block, self.period(block), self.range_seconds, raw=self.raw,
+                               fillfactor=int(self.parameters.get('fillfactor', 100)))
+
+    def brin_options(self, block):
+        return {'pages_per_range': self.pages_per_range(block), 'autosummarize': 'on'}
+
+    def leaves(self, table):
+        """
+        Tablas con filas de una tabla: ella misma o sus particiones, con sus opciones.
+        """
+        # pg_partition_tree no devuelve filas para una tabla sin particionar
+        return self._query("SELECT c.oid::regclass::text, c.reloptions FROM pg_class c "
+                           "WHERE c.relkind = 'r' AND (c.oid = to_regclass(%(table)s) "
+                           "OR c.oid IN (SELECT relid FROM pg_partition_tree(%(table)s)))", {'table': table})
+
+    def brin_indexes(self, table):
+        """
+        Índices BRIN sobre timestamp de una tabla, con sus opciones.
+        """
+        return self._query("""
+            SELECT c.relname, c.reloptions
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am a ON a.oid = c.relam
+            JOIN pg_attribute t ON t.attrelid = i.indrelid AND t.attnum = i.indkey[0]
+            WHERE i.indrelid = to_regclass(%s) AND a.amname = 'brin' AND t.attname = 'timestamp'
+              AND i.indisvalid
+        """, (table,))
+
+    def create(self, block, rebuild=False, vacuum=False):
+        """
+        Crea la tabla de un bloque si no existe (con 'raw_frames', la tabla de
+        tramas y la vista), aplica los parámetros de almacenamiento y crea o
+        ajusta el índice BRIN sobre timestamp.
+
+        :param rebuild: reconstruye el BRIN si sus páginas por rango difieren de las recomendadas
+        :param vacuum: VACUUM ANALYZE de la tabla (por ejemplo, tras una restauración): estadísticas,
+                       mapa de visibilidad y resumen de los rangos del BRIN aún sin resumir
+        """
+        table = block.table
+        storage = self.storage_table(table)
+        if self.raw:
+            raw_frames.RawFrames(self.conn).check(block)
+        try:
+            kind = self._relkind(storage)
+            if kind is None:
+                columns = raw_frames.RAW_DEFINITION if self.raw else \
+                    ', '.join(['timestamp timestamp NOT NULL'] + [f"{f.name} double precision" for f in block.fields] +
+                              [INGEST_DEFINITION])
+                self._execute([f"CREATE TABLE {storage} ({columns}){storage_clause(self.parameters)}"])
+            elif kind == 'v':
+                raise ValueError(f"{storage} es una vista de tramas (falta 'raw_frames' en la configuración)")
+            elif kind not in ('r', 'p'):
+                raise ValueError(f"{storage} no es una tabla")
+            else:
+                self._tune_storage(storage)
+                if not self._query("SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) "
+                                   "AND attname = %s AND NOT attisdropped", (storage, INGEST_COLUMN)):
+                    # DEFAULT now() es estable: las filas existentes no se reescriben
+                    self._execute([f"ALTER TABLE {storage} ADD COLUMN {INGEST_DEFINITION}"])
+            self._index(block, storage, kind == 'p', rebuild)
+            if not self._query("SELECT 1 FROM pg_class WHERE oid = to_regclass(%s)",
+                               (f"{storage}_{INGEST_COLUMN}_brin",)):
+                options = ', '.join(f'{k} = {v}' for k, v in self.brin_options(block).items())
+                self._execute([f"CREATE INDEX {storage}_{INGEST_COLUMN}_brin ON {storage} "
+                               f"USING brin ({INGEST_COLUMN}) WITH ({options})"])
+            if self.raw and self._relkind(table) is None:
+                # Tras cambiar el mapa de registros las vistas se actualizan con raw_frames.py --create
+                self._execute(raw_frames.view_sql(block))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        if vacuum:
+            self._execute([f"VACUUM (ANALYZE) {storage}"], autocommit=True)
+
+    def _tune_storage(self, storage):
+        """
+        Aplica los parámetros de almacenamiento a la tabla o a sus particiones,
+        solo donde difieren (SET no bloquea las inserciones y el fillfactor
+        rige para las páginas nuevas).
+        """
+        wanted = {name: str(value) for name, value in self.parameters.items()}
+        for name, reloptions in self.leaves(storage):
+            current = parse_options(reloptions)
+            changed = {key: value for key, value in wanted.items() if current.get(key) != value}
+            if changed:
+                self._execute([f"ALTER TABLE {name} SET ({', '.join(f'{k} = {v}' for k, v in changed.items())})"])
+
+    def _index(self, block, storage, partitioned, rebuild):
+        """
+        Crea el BRIN sobre timestamp. Uno existente sin opciones (creado a mano
+        o por rollup.py) se reemplaza por uno con las recomendadas; uno con
+        otras páginas por rango, solo con ``rebuild``. En tablas sin particionar
+        el reemplazo se hace con CONCURRENTLY, sin bloquear las inserciones.
+        """
+        options = self.brin_options(block)
+        name = f"{storage}_timestamp_brin"
+        indexes = self.brin_indexes(storage)
+        definition = (f"ON {storage} USING brin (timestamp) WITH "
+                      f"({', '.join(f'{k} = {v}' for k, v in options.items())})")
+        if not indexes:
+            self._execute([f"CREATE INDEX {name} {definition}"])
+            return
+        if len(indexes) > 1:
+            log.warning(f"{storage}: {len(indexes)} índices BRIN sobre timestamp "
+                        f"({', '.join(index for index, _ in indexes)})")
+        index, reloptions = indexes[0]
+        current = parse_options(reloptions)
+        if current.get('pages_per_range') == str(options['pages_per_range']):
+            if current.get('autosummarize') != 'on':
+                self._execute([f"ALTER INDEX {index} SET (autosummarize = on)"])
+            return
+        if current and not rebuild:
+            log.info(f"{index}: pages_per_range {current.get('pages_per_range', 128)}, recomendado "
+                     f"{options['pages_per_range']} (usar --rebuild)")
+            return
+        new = f"{name}_new"
+        concurrently = '' if partitioned else ' CONCURRENTLY'
+        # Un reemplazo interrumpido deja el índice nuevo inválido
+        statements = [f"DROP INDEX{concurrently} IF EXISTS {new}",
+                      f"CREATE INDEX{concurrently} {new} {definition}",
+                      f"DROP INDEX{concurrently} {index}",
+                      f"ALTER INDEX {new} RENAME TO {name}"]
+        if partitioned:
+            self._execute(statements)
+        else:
+            self._execute(statements, autocommit=True)
+
+    def report(self, blocks):
+        """
+        Uso e hinchazón estimada de las tablas de captura y de sus índices. La
+        hinchazón compara el tamaño con el que tendrían las filas vivas según
+        las estadísticas (pg_stats); sin estadísticas queda en None.
+
+        :return: (lista de estadísticas por tabla, lista de estadísticas por índice)
+        """
+        tables, indexes = [], []
+        for table, block in blocks.items():
+            storage = self.storage_table(table)
+            if self._relkind(storage) not in ('r', 'p'):
+                continue
+            fillfactor = int(self.parameters.get('fillfactor', 100))
+            pages = rows = dead = seq_scan = seq_read = idx_scan = size = expected = 0
+            analyzed = True
+            for name, reloptions in self.leaves(storage):
+                (relpages, reltuples, live, dead_rows, scans, read, index_scans, relsize, width) = self._query("""
+                    SELECT c.relpages, greatest(c.reltuples, 0), s.n_live_tup, s.n_dead_tup, s.seq_scan,
+                           s.seq_tup_read, coalesce(s.idx_scan, 0), pg_relation_size(c.oid),
+                           (SELECT sum(avg_width) FROM pg_stats p
+                            WHERE p.schemaname = n.nspname AND p.tablename = c.relname)
+                    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                    WHERE c.oid = %s::regclass
+                """, (name,))[0]
+                pages += relpages
+                rows += live or 0
+                dead += dead_rows or 0
+                seq_scan += scans or 0
+                seq_read += read or 0
+                idx_scan += index_scans
+                size += relsize
+                if width is None:
+                    analyzed = analyzed and not reltuples
+                    continue
+                leaf_fill = int(parse_options(reloptions).get('fillfactor', fillfactor))
+                tuple_bytes = maxalign(maxalign(TUPLE_HEADER) + width)
+                expected += math.ceil(reltuples * (tuple_bytes + ITEM_POINTER)
+                                      / ((BLOCK_SIZE - PAGE_HEADER) * leaf_fill / 100))
+            bloat = max(0.0, 1 - expected / pages) if analyzed and pages else None
+            tables.append({'table': table, 'storage': storage, 'rows': rows, 'dead': dead, 'size': size,
+                           'bloat': bloat, 'seq_scan': seq_scan, 'seq_read': seq_read, 'idx_scan': idx_scan})
+            indexes.extend(self._index_report(block, storage))
+        self.conn.rollback()
+        return tables, indexes
+
+    def _index_report(self, block, storage):
+        """
+        Tamaño, lecturas y notas de los índices de una tabla (sumando sus particiones).
+        """
+        recommended = self.pages_per_range(block)
+        rows = self._query("""
+            SELECT c.relname, a.amname, c.reloptions, i.indisunique,
+                   t.size, t.scans, t.read, t.pages, t.tuples,
+                   (SELECT sum(p.avg_width) FROM pg_attribute k JOIN pg_stats p
+                    ON p.schemaname = 'public' AND p.tablename = %(table)s AND p.attname = k.attname
+                    WHERE k.attrelid = i.indrelid AND k.attnum = ANY (i.indkey))
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_am a ON a.oid = c.relam
+            CROSS JOIN LATERAL (
+                SELECT sum(pg_relation_size(x.oid)) AS size, coalesce(sum(s.idx_scan), 0) AS scans,
+                       coalesce(sum(s.idx_tup_read), 0) AS read, sum(x.relpages) AS pages,
+                       sum(greatest(x.reltuples, 0)) AS tuples
+                FROM pg_class x LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = x.oid
+                WHERE x.oid = c.oid OR x.oid IN (SELECT relid FROM pg_partition_tree(c.oid))
+            ) t
+            WHERE i.indrelid = to_regclass(%(table)s)
+            ORDER BY c.relname
+        """, {'table': storage})
+        report = []
+        for name, method, reloptions, unique, size, scans, read, pages, tuples, width in rows:
+            notes, bloat = [], None
+            if method == 'brin':
+                current = int(parse_options(reloptions).get('pages_per_range', 128))
+                if current != recommended:
+                    notes.append(f"pages_per_range {current}, recomendado {recommended}")
+            elif method == 'btree' and width is not None and pages:
+                # Entradas de hoja: cabecera de 8 bytes, clave alineada y puntero de línea; hojas al 90 %
+                expected = math.ceil(tuples * (maxalign(8 + width) + ITEM_POINTER)
+                                     / ((BLOCK_SIZE - PAGE_HEADER) * 0.9))
+                bloat = max(0.0, 1 - expected / pages)
+            if not scans and not unique:
+                notes.append("sin uso")
+            report.append({'table': storage, 'index': name, 'method': method, 'size': size or 0,
+                           'scans': scans, 'read': read, 'bloat': bloat, 'notes': notes})
+        return report
+
+
+def from_config(config, conn, dry_run=False):
+    """
+    Administrador del esquema configurado desde config.json: periodos de
+    muestreo ('period_<grupo>'), 'schema_brin_range_seconds',
+    'schema_storage_parameters' y 'raw_frames'.
+    """
+    periods = {group: config[f'period_{group}'] for group in DEFAULT_PERIODS if f'period_{group}' in config}
+    return SchemaManager(conn, periods=periods, parameters=storage_parameters(config),
+                         range_seconds=config.get('schema_brin_range_seconds', 300),
+                         raw=config.get('raw_frames', False), dry_run=dry_run)
+
+
+def print_report(tables, indexes):
+    percent = lambda value: '-' if value is None else f"{value:.0%}"
+    print(f"{'Tabla':<20} {'Filas':>12} {'Muertas':>10} {'Tamaño':>12} {'Hinchazón':>10} "
+          f"{'Lect. sec.':>11} {'Filas sec.':>14} {'Lect. índ.':>11}")
+    for t in tables:
+        print(f"{t['storage']:<20} {t['rows']:>12} {t['dead']:>10} {format_bytes(t['size']):>12} "
+              f"{percent(t['bloat']):>10} {t['seq_scan']:>11} {t['seq_read']:>14} {t['idx_scan']:>11}")
+    print()
+    print(f"{'Índice':<34} {'Tipo':<6} {'Tamaño':>12} {'Hinchazón':>10} {'Lecturas':>10} {'Filas leídas':>14}  Notas")
+    for i in indexes:
+        print(f"{i['index']:<34} {i['method']:<6} {format_bytes(i['size']):>12} {percent(i['bloat']):>10} "
+              f"{i['scans']:>10} {i['read']:>14}  {'; '.join(i['notes'])}")
+
+
+def parse_args(tables, argv=None):
+    parser = argparse.ArgumentParser(description="Esquema e índices de las tablas de captura.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--apply', action='store_true',
+                        help="crea las tablas que faltan y ajusta sus parámetros de almacenamiento e índices BRIN")
+    action.add_argument('--report', action='store_true',
+                        help="muestra el uso de los índices y la hinchazón estimada de tablas e índices")
+    parser.add_argument('-t', '--tables', nargs='+', metavar='TABLA', choices=tables, default=tables,
+                        help="tablas a procesar (por defecto, todas las tablas de captura)")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="con --apply, reconstruye los BRIN cuyas páginas por rango difieren de las recomendadas")
+    parser.add_argument('--vacuum', action='store_true',
+                        help="con --apply, VACUUM ANALYZE de las tablas (estadísticas y resumen de los BRIN)")
+    parser.add_argument('--dry-run', action='store_true', help="muestra las sentencias sin ejecutarlas")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        config = load_config()
+        blocks = capture_blocks(config)
+        args = parse_args(sorted(blocks), argv)
+        conn = connect_config(config)()
+        manager = from_config(config, conn, dry_run=args.dry_run)
+        try:
+            if args.report:
+                print_report(*manager.report({t: blocks[t] for t in args.tables}))
+            else:
+                for table in args.tables:
+                    manager.create(blocks[table], rebuild=args.rebuild, vacuum=args.vacuum)
+                print(f"Esquema de las tablas de captura: {len(manager.actions)} sentencias.")
+        finally:
+            conn.close()
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
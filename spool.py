@@ -0,0 +1,444 @@
+#!/usr/bin/env python3.12
+
+# Cola local en disco (spool) para no perder muestras cuando PostgreSQL no está
+# disponible. Las lecturas Modbus sin decodificar se agregan a archivos de
+# segmento con registros binarios de tamaño fijo; un hilo en segundo plano
+# (SpoolDrainer) los carga en orden cuando la conexión vuelve. Cada segmento
+# se copia con COPY a una tabla temporal y pasa a la tabla con un
+# INSERT ... SELECT ... WHERE NOT EXISTS que omite las lecturas cuyo instante
+# ya está en la tabla, de modo que reintentar un segmento no duplica filas.
+# Ante un error de datos el segmento se carga fila por fila y solo se
+# descartan las filas que fallan; si no entra ninguna, se aparta como
+# .rejected en lugar de bloquear los segmentos siguientes.
+
+import io                                           # Buffer en memoria para COPY
+import os                                           # Manejo de archivos y directorios
+import contextlib
+import struct                                       # Codificación binaria de los registros
+import threading                                    # Hilo de vaciado y sincronización
+import logging                                      # Para registro de eventos e información de depuración
+from datetime import datetime, timedelta
+from psycopg2 import Error, OperationalError, InterfaceError
+from db_writer import copy_line, ROWS_REJECTED
+from raw_frames import pack_frame, raw_table, RAW_COLUMNS
+from backoff import Backoff
+import metrics                                      # Métricas en formato Prometheus
+
+log = logging.getLogger()
+
+ROWS_LOADED = metrics.counter('scada_spool_rows_loaded_total', "Filas cargadas en PostgreSQL desde el spool", ('table',))
+
+# Cabecera de segmento: firma, cantidad de registros por lectura y largo del nombre de tabla
+SEGMENT_MAGIC = b'SPL1'
+HEADER = struct.Struct('<4sHH')
+SEGMENT_SUFFIX = '.seg'
+REJECTED_SUFFIX = '.rejected'       # Segmentos apartados que el drainer no puede cargar
+
+# Los instantes se guardan como microsegundos desde esta época (sin zona horaria),
+# lo que conserva exactamente el datetime original
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+DEFAULT_MAX_BYTES = 1024 ** 3       # 1 GiB
+DEFAULT_SEGMENT_RECORDS = 10000
+
+
+def record_struct(count):
+    """
+    Estructura de un registro: instante (int64, µs) seguido de ``count`` registros de 16 bits.
+    """
+    return struct.Struct(f'<q{count}H')
+
+
+class _Segment:
+    """
+    Segmento abierto para escritura.
+    """
+
+    def __init__(self, path, table, count):
+        self.path = path
+        self.table = table
+        self.record = record_struct(count)
+        self.records = 0
+        self.file = open(path, 'ab')
+        name = table.encode()
+        self.file.write(HEADER.pack(SEGMENT_MAGIC, count, len(name)) + name)
+        self.size = self.file.tell()
+
+    def write(self, timestamp, registers):
+        data = self.record.pack((timestamp - EPOCH) // ONE_MICROSECOND, *registers)
+        self.file.write(data)
+        self.records += 1
+        self.size += len(data)
+        return len(data)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class Spool:
+    """
+    Cola en disco de lecturas Modbus pendientes de escribir en PostgreSQL.
+
+    Mientras la cola tenga datos (``active``), el escritor agrega aquí todas las
+    lecturas nuevas para conservar el orden de inserción; el SpoolDrainer la
+    vacía y, al terminar, el escritor vuelve a escribir directamente. El uso de
+    disco está acotado por ``max_bytes``: si se excede, se descartan los
+    segmentos más antiguos.
+
+    Cada proceso de captura usa su propio directorio; aun así, al iniciar solo
+    se recuperan los segmentos de las tablas del proceso (``tables``).
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, segment_records=DEFAULT_SEGMENT_RECORDS,
+                 tables=None):
+        """
+        :param directory: directorio de los archivos de segmento
+        :param max_bytes: uso máximo de disco en bytes
+        :param segment_records: registros por segmento antes de rotar
+        :param tables: tablas del proceso cuyos segmentos se recuperan (por defecto, todas)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_records = segment_records
+        self._lock = threading.Lock()
+        self._open = {}         # tabla -> _Segment
+        self._sealed = []       # rutas de segmentos cerrados, en orden de creación
+        self._sizes = {}        # ruta -> bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Recupera los segmentos que quedaron de una ejecución anterior
+        self._seq = 0
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                seq, _, table = name[:-len(SEGMENT_SUFFIX)].partition('-')
+                self._seq = max(self._seq, int(seq))
+                if tables is not None and table not in tables:
+                    log.warning(f"Segmento {name} de la tabla {table}, que no es de este proceso: se ignora")
+                    continue
+                path = os.path.join(directory, name)
+                self._sealed.append(path)
+                self._sizes[path] = os.path.getsize(path)
+        if self._sealed:
+            log.warning(f"Spool con {len(self._sealed)} segmentos pendientes en {directory}")
+
+    @property
+    def active(self):
+        """
+        True si hay lecturas en disco pendientes de cargar.
+        """
+        with self._lock:
+            return bool(self._sealed or self._open)
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def append_frames(self, block, timestamps, frames):
+        """
+        Agrega un lote de lecturas de un bloque y las sincroniza a disco.
+
+        :param block: bloque compilado (register_map.CompiledBlock)
+        :param timestamps: instantes de adquisición
+        :param frames: listas de registros del bloque
+        """
+        with self._lock:
+            segment = None
+            for timestamp, registers in zip(timestamps, frames):
+                segment = self._open.get(block.table)
+                if segment is None or segment.records >= self.segment_records:
+                    if segment is not None:
+                        self._seal(block.table)
+                    segment = self._new_segment(block)
+                self._sizes[segment.path] += segment.write(timestamp, registers)
+            if segment is not None:
+                segment.sync()
+            self._enforce_limit()
+
+    def take_segment(self):
+        """
+        Retorna la ruta del segmento más antiguo listo para cargarse. Si solo
+        quedan segmentos abiertos, los cierra para poder cargarlos. Retorna None
+        cuando la cola está vacía, momento en que deja de estar activa.
+        """
+        with self._lock:
+            if not self._sealed:
+                for table in list(self._open):
+                    self._seal(table)
+            return self._sealed[0] if self._sealed else None
+
+    def remove(self, path):
+        """
+        Elimina un segmento ya cargado en la base de datos (o que ya no existe).
+        """
+        with self._lock:
+            self._forget(path)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def reject(self, path):
+        """
+        Aparta un segmento que no se puede cargar (renombrado a <segmento>.rejected),
+        para que no detenga la carga de los siguientes.
+        """
+        with self._lock:
+            self._forget(path)
+            with contextlib.suppress(FileNotFoundError):
+                os.replace(path, path + REJECTED_SUFFIX)
+
+    def _forget(self, path):
+        if path in self._sealed:
+            self._sealed.remove(path)
+        self._sizes.pop(path, None)
+
+    def close(self):
+        """
+        Cierra y sincroniza los segmentos abiertos.
+        """
+        with self._lock:
+            for table in list(self._open):
+                self._seal(table)
+
+    @staticmethod
+    def read_segment(path):
+        """
+        Lee un segmento completo. Un registro incompleto al final (por ejemplo,
+        tras un corte de energía) se ignora.
+
+        :param path: ruta del segmento
+        :return: (tabla, lista de instantes, lista de listas de registros); tabla es None si el segmento está vacío
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            return None, [], []     # Segmento creado pero sin cabecera completa
+        magic, count, name_len = HEADER.unpack_from(data)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Segmento de spool inválido: {path}")
+        start = HEADER.size + name_len
+        table = data[HEADER.size:start].decode()
+        record = record_struct(count)
+        usable = start + (len(data) - start) // record.size * record.size
+        timestamps, frames = [], []
+        for values in record.iter_unpack(data[start:usable]):
+            timestamps.append(EPOCH + values[0] * ONE_MICROSECOND)
+            frames.append(list(values[1:]))
+        return table, timestamps, frames
+
+    def _new_segment(self, block):
+        self._seq += 1
+        path = os.path.join(self.directory, f"{self._seq:012d}-{block.table}{SEGMENT_SUFFIX}")
+        segment = self._open[block.table] = _Segment(path, block.table, block.count)
+        self._sizes[path] = segment.size
+        return segment
+
+    def _seal(self, table):
+        segment = self._open.pop(table)
+        segment.close()
+        self._sealed.append(segment.path)
+        self._sealed.sort()
+
+    def _enforce_limit(self):
+        while sum(self._sizes.values()) > self.max_bytes and self._sealed:
+            path = self._sealed.pop(0)
+            log.error(f"Spool lleno ({self.max_bytes} bytes): se descarta el segmento {path}")
+            self._sizes.pop(path, None)
+            os.remove(path)
+
+
+class SpoolDrainer(threading.Thread):
+    """
+    Hilo en segundo plano que carga los segmentos del spool en PostgreSQL.
+
+    Los segmentos se cargan en orden de creación, cada uno con un único COPY a
+    una tabla temporal y un INSERT en su propia transacción, y se eliminan
+    después del commit. Solo se insertan las lecturas cuyo instante no existe
+    ya en la tabla, por lo que reintentar un segmento ya cargado no duplica
+    filas aunque las lecturas hayan llegado al spool fuera de orden. Un error
+    de datos (que no sea de conexión) no se reintenta: el segmento se carga
+    fila por fila con savepoints y se descartan las filas que fallan; si
+    fallan todas, el segmento se aparta como .rejected. Con
+    ``rollups`` se recalculan en la misma transacción los agregados del rango
+    cargado. Con ``raw_frames`` las lecturas se cargan como tramas en
+    <tabla>_raw, sin decodificarlas.
+
+    Con ``release`` la conexión se devuelve (por ejemplo, a un
+    db_pool.ConnectionPool) cuando el spool queda vacío, en lugar de cerrarse.
+    """
+
+    def __init__(self, spool, blocks, connect, interval=1.0, backoff=None, rollups=None,
+                 release=None, raw_frames=False):
+        """
+        :param spool: instancia de Spool a vaciar
+        :param blocks: diccionario tabla -> bloque compilado, para decodificar
+        :param connect: función sin argumentos que retorna una conexión o None
+        :param interval: segundos entre revisiones cuando la cola está vacía
+        :param backoff: instancia de Backoff para reintentos tras errores
+        :param rollups: instancia de rollup.Rollups para actualizar los agregados
+        :param release: función que recibe la conexión obtenida con ``connect`` al dejar de usarla
+        :param raw_frames: carga las lecturas como tramas de registros en <tabla>_raw
+        """
+        super().__init__(name="spool-drainer", daemon=True)
+        self.spool = spool
+        self.blocks = blocks
+        self.connect = connect
+        self.interval = interval
+        self.backoff = backoff or Backoff()
+        self.rollups = rollups
+        self.release = release
+        self.raw_frames = raw_frames
+        self.loaded_rows = 0
+        self._stop_event = threading.Event()
+        self._conn = None
+
+    def stop(self, timeout=None):
+        """
+        Detiene el hilo y cierra su conexión.
+        """
+        self._stop_event.set()
+        self.join(timeout)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            path = self.spool.take_segment() if self.spool.active else None
+            if path is None:
+                self._close_connection(keep=True)
+                self._stop_event.wait(self.interval)
+                continue
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self.connect()
+                    if self._conn is None:
+                        self._stop_event.wait(self.backoff.next_delay())
+                        continue
+                self._replay(path)
+                self.backoff.reset()
+            except Exception as e:
+                log.error(f"Error al cargar el segmento {path} del spool: {e}")
+                self._close_connection()
+                self._stop_event.wait(self.backoff.next_delay())
+        self._close_connection(keep=True)
+
+    def _replay(self, path):
+        try:
+            table, timestamps, frames = Spool.read_segment(path)
+        except FileNotFoundError:
+            log.warning(f"El segmento {path} del spool ya no existe")
+            self.spool.remove(path)
+            return
+        except ValueError as e:
+            log.error(f"{e}: se aparta como {os.path.basename(path)}{REJECTED_SUFFIX}")
+            self.spool.reject(path)
+            return
+        if table is None:
+            self.spool.remove(path)
+            return
+        block = self.blocks.get(table)
+        if block is None:
+            log.error(f"El segmento {path} es de la tabla {table}, que no es de este proceso: "
+                      f"se aparta como {os.path.basename(path)}{REJECTED_SUFFIX}")
+            self.spool.reject(path)
+            return
+        if self.raw_frames:
+            target, columns = raw_table(table), ', '.join(RAW_COLUMNS)
+        else:
+            target, columns = table, ', '.join(block.columns)
+        inserted = 0
+        if timestamps:
+            if self.raw_frames:
+                rows = [(ts, pack_frame(r)) for ts, r in zip(timestamps, frames)]
+            else:
+                rows = block.decode_batch(timestamps, frames)
+            try:
+                with self._conn.cursor() as cursor:
+                    inserted = self._insert(cursor, target, columns, rows)
+                    self._refresh_rollups(cursor, table, timestamps, inserted)
+            except (OperationalError, InterfaceError):
+                raise
+            except Error as e:
+                log.error(f"Error de datos al cargar {os.path.basename(path)}, se carga fila por fila: {e}")
+                self._conn.rollback()
+                with self._conn.cursor() as cursor:
+                    inserted, rejected = self._insert_rows(cursor, table, target, columns, rows)
+                    if rejected == len(rows):
+                        self._conn.rollback()
+                        log.error(f"Ninguna fila de {path} se pudo cargar: "
+                                  f"se aparta como {os.path.basename(path)}{REJECTED_SUFFIX}")
+                        self.spool.reject(path)
+                        return
+                    self._refresh_rollups(cursor, table, timestamps, inserted)
+                if rejected:
+                    ROWS_REJECTED.inc((table,), rejected)
+        self._conn.commit()
+        self.spool.remove(path)
+        self.loaded_rows += inserted
+        ROWS_LOADED.inc((table,), inserted)
+        log.info(f"Spool: {inserted} filas cargadas en {table} desde {os.path.basename(path)}")
+
+    def _insert(self, cursor, target, columns, rows):
+        """
+        Carga las filas en una tabla temporal y solo inserta las lecturas cuyo
+        instante no está ya en la tabla (reintento idempotente).
+
+        :return: filas insertadas
+        """
+        staging = f"spool_{target}"
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                       f"(LIKE {target} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN",
+                           io.StringIO(''.join(copy_line(r) for r in rows)))
+        cursor.execute(f"""
+            INSERT INTO {target} ({columns})
+            SELECT {columns} FROM {staging} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {target} t
+                WHERE t.timestamp = s.timestamp AND t.timestamp BETWEEN %s AND %s
+            )
+            ORDER BY s.timestamp
+        """, (min(r[0] for r in rows), max(r[0] for r in rows)))
+        return cursor.rowcount
+
+    def _insert_rows(self, cursor, table, target, columns, rows):
+        """
+        Inserta las filas de a una, cada una tras un savepoint, y descarta las que fallan.
+
+        :return: (filas insertadas, filas descartadas)
+        """
+        inserted = rejected = 0
+        error = None
+        for row in rows:
+            cursor.execute("SAVEPOINT spool_row")
+            try:
+                inserted += self._insert(cursor, target, columns, [row])
+                cursor.execute(f"DELETE FROM spool_{target}")
+            except (OperationalError, InterfaceError):
+                raise
+            except Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT spool_row")
+                rejected += 1
+                error = e
+            cursor.execute("RELEASE SAVEPOINT spool_row")
+        if rejected:
+            log.error(f"Spool: {rejected} de {len(rows)} filas de {table} descartadas, la última por: {error}")
+        return inserted, rejected
+
+    def _refresh_rollups(self, cursor, table, timestamps, inserted):
+        if inserted and self.rollups is not None:
+            self.rollups.refresh(cursor, table, min(timestamps), max(timestamps))
+
+    def _close_connection(self, keep=False):
+        if self._conn is not None:
+            if not keep or self.release is None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            if self.release is not None:
+                self.release(self._conn)
+            self._conn = None
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3.12
+
+# Supervisor único de captura: ejecuta en un solo proceso las tuberías de todos
+# los dispositivos del mapa de registros (APIS1, APIS2, APIS3 y los que se
+# agreguen), en lugar de un script por equipo. Cada grupo de dispositivos
+# ('apis1', 'apis2', ...) lee en su propio hilo con su periodo, y todos
+# entregan sus lecturas a una única cola, un único escritor y un pool acotado
+# de conexiones a PostgreSQL. Si una tubería falla o se bloquea, el supervisor
+# la reinicia con backoff sin afectar a las demás.
+
+# Importación de librerías necesarias
+import psycopg2                                     # Conector para PostgreSQL
+from datetime import datetime                       # Para obtener la fecha y hora actual
+import time                                         # Reloj monotónico y esperas
+import logging                                      # Para registro de eventos e información de depuración
+import os                                           # Para construir rutas de archivos
+from scada_config import load_config, CONFIG_FILE   # Configuración compartida con los respaldos
+import threading                                    # Un hilo por tubería
+from concurrent.futures import ThreadPoolExecutor   # Lectura en paralelo de los dispositivos de un grupo
+from db_writer import BufferedWriter                # Escritura en bloque con COPY
+from db_pool import ConnectionPool                  # Conexiones a PostgreSQL compartidas
+from scheduler import DeadlineScheduler             # Ciclos sobre plazos absolutos
+from device_manager import ModbusDevice, Backoff    # Conexión Modbus por dispositivo con backoff
+from register_map import load_register_map          # Decodificación declarativa de registros
+from spool import Spool, SpoolDrainer               # Cola en disco ante caídas de PostgreSQL
+from pipeline import FrameQueue, WriterThread       # Adquisición y escritura en hilos separados
+from rollup import Rollups                          # Agregados de 1 s, 1 min y 15 min
+from deadband import DeadbandFilter                 # Registro por excepción
+from read_planner import ReadPlan                   # Peticiones Modbus mínimas por ciclo
+from burst import BurstRecorder, start_bursts       # Captura en ráfaga alrededor de eventos
+import metrics                                      # Métricas en formato Prometheus
+
+# Configuración de logging
+logging.basicConfig()
+log = logging.getLogger()
+log.setLevel(logging.INFO)
+
+# Carga de configuración desde archivo JSON (ruta en scada_config.py; la
+# variable de entorno SCADA_CONFIG permite usar otro archivo, por ejemplo,
+# desde benchmark.py)
+config = load_config()
+
+# Configuración de la base de datos PostgreSQL
+DB_CONFIG = {
+    'host': config['db_host'],
+    'port': config.get('db_port', 5432),
+    'database': config['db_name'],
+    'user': config['db_user'],
+    'password': config['db_password']
+}
+
+# Configuración de conexión a los dispositivos Modbus
+MODBUS_PORT = config['modbus_port']
+
+# Tolerancia a fallas: timeout Modbus (s), fallos consecutivos que abren el
+# circuito de un dispositivo y límites del backoff exponencial (s)
+MODBUS_TIMEOUT = config.get('modbus_timeout', 3)
+DEVICE_FAILURE_THRESHOLD = config.get('device_failure_threshold', 3)
+BACKOFF_BASE = config.get('backoff_base', 0.5)
+BACKOFF_MAX = config.get('backoff_max', 30)
+
+# Periodo de muestreo de cada grupo ('period_<grupo>'), con los valores por
+# defecto de los scripts individuales; política ante ciclos excedidos y
+# segundos entre resúmenes de jitter en el log
+DEFAULT_PERIODS = {'apis1': 0.110, 'apis2': 1.0, 'apis3': 0.5}
+SCHEDULE_POLICY = config.get('schedule_policy', 'skip')
+JITTER_REPORT_INTERVAL = config.get('jitter_report_interval', 60)
+
+# Lectura concurrente de los dispositivos de un mismo grupo (True) o secuencial (False)
+CONCURRENT_READS = config.get('concurrent_reads', True)
+
+# Spool en disco para no perder muestras si PostgreSQL no está disponible
+# (spool_dir = null lo desactiva; cada proceso usa su subdirectorio, aquí
+# 'supervisor'), uso máximo de disco y registros por segmento
+SPOOL_DIR = config.get('spool_dir', os.path.join(os.path.dirname(CONFIG_FILE), 'spool'))
+SPOOL_MAX_BYTES = config.get('spool_max_bytes', 1024 ** 3)
+SPOOL_SEGMENT_RECORDS = config.get('spool_segment_records', 10000)
+
+# Cola compartida entre las tuberías y el escritor: capacidad (la suma de las
+# colas de los scripts individuales) y política ante cola llena
+QUEUE_MAX_FRAMES = config.get('queue_max_frames', 1600)
+QUEUE_OVERFLOW_POLICY = config.get('queue_overflow_policy', 'spill')
+
+# Conexiones a PostgreSQL del proceso: una del escritor y una del SpoolDrainer
+DB_POOL_SIZE = config.get('db_pool_size', 2)
+
+# Actualización de las tablas de agregados en cada escritura (ver rollup.py)
+ROLLUP_ON_WRITE = config.get('rollup_on_write', False)
+
+# Registro por excepción (ver deadband.py)
+DEADBAND = config.get('deadband', False)
+DEADBAND_HEARTBEAT = config.get('deadband_heartbeat', 60.0)
+
+# Plan de lecturas Modbus (ver read_planner.py): solo los registros usados por
+# los campos, uniendo rangos cuando el hueco cuesta menos que una petición
+# ('read_request_cost', en registros) y sin leer fuera de los bloques declarados
+READ_PLANNER = config.get('read_planner', False)
+READ_REQUEST_COST = config.get('read_request_cost', 32)
+READ_BRIDGE_UNMAPPED = config.get('read_bridge_unmapped', False)
+
+# Captura en ráfaga (ver burst.py): los bloques con 'burst' en el mapa de
+# registros se leen también a la máxima tasa del equipo ('burst_period' > 0 la
+# limita) y se guardan las ventanas alrededor de cada disparo en '<tabla>_event';
+# el registrador de eventos usa una conexión más del pool ('db_pool_size')
+BURST = config.get('burst', False)
+BURST_PERIOD = config.get('burst_period', 0.0)
+BURST_CAPACITY = config.get('burst_capacity', 4096)
+
+# Almacenamiento como tramas de registros (ver raw_frames.py): cada lectura se
+# escribe sin decodificar en '<tabla>_raw' y la vista '<tabla>' la decodifica
+RAW_FRAMES = config.get('raw_frames', False)
+
+# Límites del buffer de escritura compartido (filas, bytes y segundos de espera)
+BATCH_MAX_ROWS = config.get('batch_max_rows', 350)
+BATCH_MAX_BYTES = config.get('batch_max_bytes', 1024 * 1024)
+BATCH_MAX_LATENCY = config.get('batch_max_latency', 5.0)
+
+# Supervisión: errores consecutivos que dan por fallida una tubería, segundos
+# sin completar un ciclo que la dan por bloqueada y segundos entre revisiones
+PIPELINE_MAX_ERRORS = config.get('pipeline_max_errors', 10)
+PIPELINE_STALL_TIMEOUT = config.get('pipeline_stall_timeout', 60)
+SUPERVISOR_INTERVAL = config.get('supervisor_interval', 1.0)
+
+# Mapa de registros: dispositivos, bloques, campos y escalas (register_map.json)
+REGISTER_MAP_FILE = config.get('register_map_file',
+                               os.path.join(os.path.dirname(CONFIG_FILE), 'register_map.json'))
+REGISTER_MAP = load_register_map(REGISTER_MAP_FILE)
+
+# Grupos de captura ('apis1', 'apis2', ...): prefijo del nombre de cada
+# dispositivo del mapa; la IP de cada uno se lee de 'modbus_ip_<dispositivo>'
+GROUPS = {}
+for _device, _blocks in REGISTER_MAP.items():
+    GROUPS.setdefault(_device.split('_')[0], {})[_device] = _blocks
+MODBUS_IPS = {device: config[f'modbus_ip_{device}'] for device in REGISTER_MAP}
+
+
+def connect_postgres():
+    """
+    Intenta establecer conexión a PostgreSQL.
+    Retorna un objeto de conexión si tiene éxito, o None si falla.
+    """
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        log.info("Conexión a PostgreSQL establecida.")
+        return conn
+    except Exception as e:
+        log.error(f"Error al conectar a PostgreSQL: {e}")
+        return None
+
+
+class Pipeline(threading.Thread):
+    """
+    Tubería de captura de un grupo de dispositivos: lee sus bloques en cada
+    ciclo y entrega las lecturas a la cola compartida.
+
+    Con un solo dispositivo cada bloque lleva el instante de su lectura; con
+    varios (APIS2) se leen en paralelo y comparten el instante del ciclo, como
+    en los scripts individuales. Tras ``max_errors`` errores consecutivos la
+    tubería termina y el supervisor la reinicia con dispositivos nuevos.
+    """
+
+    def __init__(self, group, devices, sink, period, max_errors=PIPELINE_MAX_ERRORS):
+        """
+        :param group: nombre del grupo ('apis1', 'apis2', ...)
+        :param devices: diccionario dispositivo -> bloques compilados
+        :param sink: destino de las lecturas (FrameQueue compartida)
+        :param period: periodo de muestreo en segundos
+        :param max_errors: errores consecutivos que dan por fallida la tubería
+        """
+        super().__init__(name=f"{group}-pipeline", daemon=True)
+        self.group = group
+        self.max_errors = max_errors
+        self.scheduler = DeadlineScheduler(period, policy=SCHEDULE_POLICY,
+                                           report_every=JITTER_REPORT_INTERVAL, name=group.upper())
+        self.deadband = DeadbandFilter(sink, heartbeat=DEADBAND_HEARTBEAT) if DEADBAND else None
+        self.sink = self.deadband or sink
+        self.reads = [
+            (ModbusDevice(name.upper(), MODBUS_IPS[name], MODBUS_PORT, timeout=MODBUS_TIMEOUT,
+                          failure_threshold=DEVICE_FAILURE_THRESHOLD,
+                          backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)),
+             ReadPlan(blocks, coalesce=READ_PLANNER, request_cost=READ_REQUEST_COST,
+                      bridge_unmapped=READ_BRIDGE_UNMAPPED))
+            for name, blocks in devices.items()
+        ]
+        # Un hilo por dispositivo: la latencia del ciclo queda acotada por el más lento
+        self.executor = ThreadPoolExecutor(max_workers=len(self.reads), thread_name_prefix=group) \
+            if CONCURRENT_READS and len(self.reads) > 1 else None
+        self.last_cycle = time.monotonic()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        error_backoff = Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)
+        errors = 0
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self._cycle()
+                    errors = 0
+                    error_backoff.reset()
+                    self.last_cycle = time.monotonic()
+                    self.scheduler.wait()
+
+                except Exception as e:
+                    errors += 1
+                    log.error(f"[{self.name}] Error inesperado ({errors}/{self.max_errors}): {e}")
+                    if errors >= self.max_errors:
+                        return
+                    self._stop_event.wait(error_backoff.next_delay())
+                    self.scheduler.reset()
+        finally:
+            self.close()
+
+    def _cycle(self):
+        """
+        Lee todos los bloques del grupo y entrega las lecturas exitosas.
+        """
+        if len(self.reads) == 1:
+            device, plan = self.reads[0]
+            for block, registers in plan.execute(device):
+                if registers is not None:
+                    self.sink.add_frame(block, datetime.now(), registers)
+            return
+        timestamp = datetime.now()
+        calls = [lambda device=device, plan=plan: list(plan.execute(device)) for device, plan in self.reads]
+        if self.executor is None:
+            results = [call() for call in calls]
+        else:
+            # result() propaga la excepción de cualquier llamada fallida
+            results = [future.result() for future in [self.executor.submit(call) for call in calls]]
+        for frames in results:
+            for block, registers in frames:
+                if registers is not None:
+                    self.sink.add_frame(block, timestamp, registers)
+
+    def stalled(self, timeout):
+        """
+        Indica si la tubería lleva más de ``timeout`` segundos sin completar un ciclo.
+        """
+        return time.monotonic() - self.last_cycle > timeout
+
+    def stop(self, timeout=None):
+        """
+        Detiene la tubería. Cerrar los clientes Modbus desbloquea una lectura en curso.
+        """
+        self._stop_event.set()
+        self.close()
+        self.join(timeout)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        for device, _ in self.reads:
+            device.close()
+
+    def summary(self):
+        """
+        Resumen legible para el log.
+        """
+        text = f"[{self.group.upper()}] {self.scheduler.stats.summary()}"
+        for device, plan in self.reads:
+            text += f" lecturas {device.name}: {plan.stats.summary()}"
+        if self.deadband is not None:
+            text += f" registro por excepción: {self.deadband.summary()}"
+        return text
+
+
+class Supervisor:
+    """
+    Arranca una tubería por grupo y, en cada revisión, reinicia las que
+    terminaron por errores o dejaron de completar ciclos. Los reinicios de
+    cada grupo se espacian con su propio backoff, que se reinicia cuando la
+    tubería vuelve a completar ciclos.
+    """
+
+    def __init__(self, groups, sink, stall_timeout=PIPELINE_STALL_TIMEOUT):
+        """
+        :param groups: diccionario grupo -> (diccionario dispositivo -> bloques)
+        :param sink: destino compartido de las lecturas (FrameQueue)
+        :param stall_timeout: segundos sin completar un ciclo que dan por bloqueada una tubería
+        """
+        self.groups = groups
+        self.sink = sink
+        self.stall_timeout = stall_timeout
+        self.pipelines = {}
+        self.restarts = {group: 0 for group in groups}
+        self._backoff = {group: Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX) for group in groups}
+        self._restart_at = {group: 0.0 for group in groups}
+
+    def _start(self, group):
+        period = config.get(f'period_{group}', DEFAULT_PERIODS.get(group, 1.0))
+        pipeline = Pipeline(group, self.groups[group], self.sink, period)
+        pipeline.start()
+        self.pipelines[group] = pipeline
+        log.info(f"Tubería {group.upper()} iniciada: {', '.join(self.groups[group])} cada {period} s")
+        for device, plan in pipeline.reads:
+            log.debug(f"Plan de lectura {device.name}: {plan.describe()}")
+
+    def start(self):
+        for group in self.groups:
+            self._start(group)
+
+    def check(self):
+        """
+        Revisa las tuberías y reinicia las fallidas o bloqueadas.
+        """
+        now = time.monotonic()
+        for group, pipeline in list(self.pipelines.items()):
+            if pipeline.is_alive() and not pipeline.stalled(self.stall_timeout):
+                if pipeline.scheduler.stats.cycles:
+                    self._backoff[group].reset()
+                continue
+            if pipeline.is_alive():
+                log.error(f"Tubería {group.upper()} sin ciclos hace más de {self.stall_timeout} s, se reinicia")
+                # Un hilo bloqueado no puede interrumpirse: se abandona tras cerrar sus clientes
+                pipeline.stop(timeout=0)
+                self._restart_at[group] = now
+            elif self._restart_at[group] < pipeline.last_cycle:
+                log.error(f"Tubería {group.upper()} detenida por errores, se reinicia")
+                self._restart_at[group] = now + self._backoff[group].next_delay()
+            if now >= self._restart_at[group]:
+                log.info(pipeline.summary())
+                self.restarts[group] += 1
+                self._start(group)
+
+    def stop(self, timeout=None):
+        for pipeline in self.pipelines.values():
+            pipeline.stop(timeout)
+
+    def summary(self):
+        return [pipeline.summary() + f" reinicios={self.restarts[group]}"
+                for group, pipeline in self.pipelines.items()]
+
+
+def main():
+    """
+    Función principal: arranca el escritor compartido y las tuberías, y las supervisa.
+    """
+    # Métricas por HTTP ('metrics_ports') y/o archivo de texto ('metrics_dir')
+    metrics_exporter = metrics.exporter(config, "supervisor").start()
+    # Todas las tuberías comparten el pool de conexiones, el escritor, el spool y su drainer
+    pool = ConnectionPool(connect_postgres, max_connections=DB_POOL_SIZE)
+    tables = {block.table: block for blocks in REGISTER_MAP.values() for block in blocks}
+    spool = Spool(os.path.join(SPOOL_DIR, 'supervisor'), max_bytes=SPOOL_MAX_BYTES,
+                  segment_records=SPOOL_SEGMENT_RECORDS, tables=tables) if SPOOL_DIR else None
+    rollups = Rollups(tables) if ROLLUP_ON_WRITE else None
+    writer = BufferedWriter(max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES,
+                            max_latency=BATCH_MAX_LATENCY, connect=pool.connect, spool=spool,
+                            backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX), rollups=rollups,
+                            release=pool.release, raw_frames=RAW_FRAMES)
+    drainer = None
+    if spool is not None:
+        drainer = SpoolDrainer(spool, tables, pool.connect,
+                               backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX), rollups=rollups,
+                               release=pool.release, raw_frames=RAW_FRAMES)
+        drainer.start()
+    queue = FrameQueue(QUEUE_MAX_FRAMES, policy=QUEUE_OVERFLOW_POLICY, spool=spool, name="SUPERVISOR")
+    writer_thread = WriterThread(queue, writer, report_every=JITTER_REPORT_INTERVAL, name="writer")
+    writer_thread.start()
+    supervisor = Supervisor(GROUPS, queue)
+    supervisor.start()
+    # Captura en ráfaga con conexiones Modbus propias; los eventos van a sus tablas
+    recorder, bursts = None, []
+    if BURST:
+        recorder = BurstRecorder(pool.connect, release=pool.release,
+                                 backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX))
+        recorder.start()
+        bursts = start_bursts(REGISTER_MAP, lambda name: ModbusDevice(
+            f"{name.upper()}_BURST", MODBUS_IPS[name], MODBUS_PORT, timeout=MODBUS_TIMEOUT,
+            failure_threshold=DEVICE_FAILURE_THRESHOLD, backoff=Backoff(BACKOFF_BASE, max_delay=BACKOFF_MAX)),
+            recorder, period=BURST_PERIOD, capacity=BURST_CAPACITY)
+
+    try:
+        while True:
+            time.sleep(SUPERVISOR_INTERVAL)
+            supervisor.check()
+
+    except KeyboardInterrupt:
+        log.info("Deteniendo el supervisor...")
+        for line in supervisor.summary():
+            log.info(f"Estadísticas de muestreo: {line}")
+        for burst in bursts:
+            log.info(f"Captura en ráfaga {burst.device.name}: {burst.summary()}")
+        if recorder is not None:
+            log.info(f"Eventos en ráfaga: {recorder.summary()}")
+        log.info(f"Pool de PostgreSQL: {pool.summary()}")
+
+    finally:
+        # Primero se detienen las tuberías; luego el vaciado final de la cola
+        # (a PostgreSQL o al spool) y el cierre de conexiones
+        supervisor.stop(timeout=5)
+        for burst in bursts:
+            burst.stop(timeout=5)
+        if recorder is not None:
+            recorder.stop(timeout=30)
+        writer_thread.stop(timeout=30)
+        if drainer is not None:
+            drainer.stop(timeout=30)
+            spool.close()
+        pool.close()
+        metrics_exporter.stop()
+        log.info("Conexiones cerradas")
+
+if __name__ == "__main__":
+    main()
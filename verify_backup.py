@@ -0,0 +1,181 @@
+#!/usr/bin/env python3.12
+
+# Verificación de los respaldos de backup_dbscada.py contra su manifiesto
+# (ver backup_manifest.py), sin restaurarlos:
+#   - plain: los datos de cada tabla y los tramos entre tablas se releen en
+#     paralelo desde su posición en el archivo.
+#   - plain comprimido (--stream) y custom: una lectura del archivo, que pasa
+#     a la vez por el descompresor o por pg_restore --data-only.
+#   - incremental: cada segmento de la cadena se descomprime y verifica en
+#     paralelo (filas, primer y último instante, SHA-256 de las filas).
+# Con --restore además restaura el respaldo en una base de prueba y compara
+# filas e instantes mínimo y máximo de cada tabla con el manifiesto.
+# Termina con código 1 si el respaldo no coincide con el manifiesto, de modo
+# que Bacula marca el trabajo como fallido antes de leer el respaldo.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import psycopg2
+import backup_manifest
+from scada_config import load_config, CONFIG_FILE
+from backup_dbscada import dump_decoder, postgres_env, write_metrics, FORMAT_PLAIN, FORMAT_CUSTOM, FORMAT_INCREMENTAL
+from restore_dbscada import restore_stream, restore_incremental_chain
+from incremental_backup import restore_chain, connect_config
+
+FORMATS = (FORMAT_PLAIN, FORMAT_CUSTOM, FORMAT_INCREMENTAL)
+
+
+def verify_file(config, path, manifest, jobs=4):
+    """
+    Verifica un respaldo plain o custom (archivo o flujo guardado) contra su manifiesto.
+
+    :return: (diccionario tabla -> estadísticas calculadas, lista de problemas)
+    """
+    if 'pieces' in manifest:
+        return backup_manifest.verify_pieces(path, manifest, jobs)
+    decoder = dump_decoder(config, manifest['format'], manifest['compression'])
+    return backup_manifest.verify_stream(path, manifest, decoder, env=postgres_env(config))
+
+
+def scratch_database(config, name, drop=False):
+    """
+    Crea (o con ``drop``, elimina) la base de prueba en el mismo servidor.
+    """
+    conn = connect_config({**config, 'db_name': 'postgres'})()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+            if not drop:
+                cursor.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        conn.close()
+
+
+def verify_restore(config, path, manifest, expected, scratch, jobs=4, backup_id=None, keep=False):
+    """
+    Restaura el respaldo en la base ``scratch`` y compara filas e instantes
+    mínimo y máximo de cada tabla con los esperados.
+
+    :param expected: diccionario tabla -> estadísticas del manifiesto
+    :param keep: conserva la base de prueba al terminar
+    :return: lista de problemas
+    """
+    scratch_config = {**config, 'db_name': scratch}
+    scratch_database(config, scratch)
+    try:
+        if manifest is None:
+            restore_incremental_chain(scratch_config, path, backup_id=backup_id, jobs=jobs,
+                                      schema='schema' in restore_chain(path, backup_id)[0])
+        else:
+            restore_stream(scratch_config, path)
+        conn = connect_config(scratch_config)()
+        try:
+            actual = backup_manifest.database_tables(conn, expected)
+        finally:
+            conn.close()
+    finally:
+        if not keep:
+            scratch_database(config, scratch, drop=True)
+    return [f"restaurado en {scratch}: {problem}"
+            for problem in backup_manifest.compare_tables(expected, actual, ('rows', 'min', 'max'))]
+
+
+def print_report(tables, problems, elapsed):
+    """
+    Muestra las filas y el rango de tiempo verificados de cada tabla y los problemas encontrados.
+    """
+    print(f"{'Tabla':<24} {'Filas':>12}  {'Desde':<26}  {'Hasta':<26}")
+    for table in sorted(tables):
+        stats = tables[table]
+        print(f"{table:<24} {stats['rows']:>12}  {stats.get('min') or '-':<26}  {stats.get('max') or '-':<26}")
+    print(f"Total: {len(tables)} tablas, {sum(s['rows'] for s in tables.values())} filas en {elapsed:.2f} s")
+    for problem in problems:
+        print(f"Error: {problem}", file=sys.stderr)
+
+
+def parse_args(config, argv=None):
+    parser = argparse.ArgumentParser(description="Verificación de los respaldos de la base de datos SCADA.")
+    parser.add_argument('--format', choices=FORMATS, default=config.get('backup_format', FORMAT_PLAIN),
+                        help="formato del respaldo (por defecto, 'backup_format' de la configuración o plain)")
+    parser.add_argument('-i', '--input', help="archivo (plain/custom) o directorio (incremental) del respaldo")
+    parser.add_argument('--manifest', help="manifiesto del respaldo (por defecto, <archivo>.manifest.json)")
+    parser.add_argument('-j', '--jobs', type=int, default=config.get('verify_jobs', 4),
+                        help="tablas o segmentos verificados en paralelo")
+    parser.add_argument('--backup-id', help="formato incremental: último respaldo de la cadena a verificar")
+    parser.add_argument('--restore', action='store_true',
+                        help="restaura además el respaldo en una base de prueba y la compara con el manifiesto")
+    parser.add_argument('--scratch-db', default=config.get('verify_scratch_db', f"{config['db_name']}_verify"),
+                        help="base de prueba de --restore (se elimina y se crea de nuevo)")
+    parser.add_argument('--keep-scratch', action='store_true', help="conserva la base de prueba al terminar")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs debe ser mayor o igual a 1")
+    if args.scratch_db == config['db_name']:
+        parser.error("la base de prueba no puede ser la base de la captura")
+    return args
+
+
+def main(argv=None):
+    config, args, failed = None, None, True
+    try:
+        config = load_config()
+        args = parse_args(config, argv)
+        start = time.monotonic()
+
+        if args.format == FORMAT_INCREMENTAL:
+            path = args.input or config.get('incremental_dir',
+                                            os.path.join(os.path.dirname(CONFIG_FILE), 'incremental'))
+            manifest = None
+            chain = restore_chain(path, args.backup_id)
+            tables, problems = backup_manifest.verify_segments(path, chain, args.jobs)
+        else:
+            path = args.input or config['output_file']
+            manifest = backup_manifest.load_manifest(args.manifest or backup_manifest.manifest_path(path))
+            if manifest['format'] != args.format:
+                raise ValueError(f"{path}: el manifiesto corresponde a un respaldo {manifest['format']}")
+            tables, problems = verify_file(config, path, manifest, args.jobs)
+        if args.restore and not problems:
+            expected = tables if manifest is None else manifest.get('tables', {})
+            problems = verify_restore(config, path, manifest, expected, args.scratch_db, jobs=args.jobs,
+                                      backup_id=args.backup_id, keep=args.keep_scratch)
+        elapsed = time.monotonic() - start
+        print_report(tables, problems, elapsed)
+        if problems:
+            sys.exit(1)
+        write_metrics(config, 'verify', args.format, elapsed,
+                      tables={table: {'rows': stats['rows']} for table, stats in tables.items()})
+        print("Verificación del respaldo completada con éxito.")
+        failed = False
+
+    except FileNotFoundError as e:
+        print(f"Error: El archivo '{e.filename}' no fue encontrado.", file=sys.stderr)
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print(f"Error: No se pudo decodificar el archivo JSON '{CONFIG_FILE}'. Verifica el formato.", file=sys.stderr)
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Falta la clave '{e}' en el archivo de configuración '{CONFIG_FILE}'.", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error: {e.cmd} falló con código de salida {e.returncode}.", file=sys.stderr)
+        sys.exit(e.returncode)
+    except psycopg2.Error as e:
+        print(f"Error de base de datos: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Ocurrió un error inesperado: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if failed and args is not None:
+            write_metrics(config, 'verify', args.format, failed=True)
+    # Si todo fue bien, sale con código de éxito (0)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()